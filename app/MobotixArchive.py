@@ -0,0 +1,312 @@
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from MobotixFrameStore import link_file
+from MobotixNetCDF import NetCDFMerger, archive_position, archive_timestamp
+from MobotixTrace import traced
+
+# budget of the archive, 0 for no limit
+DEFAULT_ARCHIVE_MAX_BYTES = "10G"
+DEFAULT_ARCHIVE_MAX_AGE = 0
+
+# days after which the NetCDF files of single frames are packed into daily files
+DEFAULT_ARCHIVE_COMPACT = 1
+
+# seconds between two background evictions and compactions
+DEFAULT_MAINTAIN_INTERVAL = 600
+
+INDEX_NAME = ".index.jsonl"
+
+DAY_NS = 24 * 3600 * 1_000_000_000
+
+_SIZE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$", re.IGNORECASE)
+_DAILY = re.compile(r"_daily_\d{4}-\d{2}-\d{2}\.nc$")
+
+ArchiveEntry = namedtuple('ArchiveEntry', ['name', 'timestamp', 'position', 'kind', 'size', 'used'])
+
+
+def parse_size(arg):
+    '''Parses a size in bytes with an optional k, M, G or T suffix (powers of 1024).'''
+    m = _SIZE.match(str(arg))
+    if not m:
+        raise ValueError(f"Invalid size '{arg}'. Use e.g. 500M or 20G")
+    return int(float(m.group(1)) * 1024 ** ' KMGT'.index(m.group(2).upper() or ' '))
+
+
+def archive_kind(name):
+    '''Kind of an archived file: `daily.nc` for daily files, else its extension.'''
+    if _DAILY.search(name):
+        return 'daily.nc'
+    return Path(name).suffix.lstrip('.')
+
+
+class Archive:
+    ''' Archive directory kept within a byte and age budget.
+
+    Files are added with `add`, as hardlinks (or reflinks) of the uploaded
+    files when the filesystem allows. An index of every archived file (name,
+    capture timestamp, position, kind, size and last use) is kept in memory
+    and in an append-only log in the archive, so listing the archive never
+    scans the directory; the log is rewritten when it gets long. A missing
+    log is rebuilt from one scan of the directory.
+
+    `maintain` evicts files captured more than `max_age` seconds ago, then
+    the least recently used files until the archive fits in `max_bytes`, and
+    packs the NetCDF files of single frames older than `compact_after`
+    seconds into one compressed NetCDF file per day. It runs on a background
+    thread at most every `interval` seconds.
+
+    Parameters:
+        directory (str or Path): Archive directory, created if needed.
+        max_bytes (int): Size budget, 0 for no limit.
+        max_age (float): Age budget in seconds, 0 for no limit.
+        compact_after (float): Age in seconds of the frames packed into daily files, 0 to never pack.
+        interval (float): Minimum seconds between two background runs of `maintain`.
+    '''
+    def __init__(self, directory, max_bytes=0, max_age=0, compact_after=0, interval=DEFAULT_MAINTAIN_INTERVAL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compact_after = compact_after
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._log_lines = 0
+        self._thread = None
+        self._last_maintain = None
+        self._load()
+        self._log = open(self.directory / INDEX_NAME, 'a')
+
+    def _load(self):
+        path = self.directory / INDEX_NAME
+        if not path.exists():
+            self._rebuild()
+            return
+        with open(path) as f:
+            for line in f:
+                self._log_lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash
+                    continue
+                op = record.pop('op')
+                if op == 'add':
+                    self._entries[record['name']] = ArchiveEntry(**record)
+                elif op == 'remove':
+                    self._entries.pop(record['name'], None)
+                elif op == 'use' and record['name'] in self._entries:
+                    self._entries[record['name']] = self._entries[record['name']]._replace(used=record['used'])
+        if self._log_lines > 2 * len(self._entries) + 1000:
+            self._rewrite()
+
+    def _rebuild(self):
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith('.json'):
+                    self._index(entry.name, entry.stat().st_size)
+        if self._entries:
+            logging.info("Indexed %d files found in %s", len(self._entries), self.directory)
+        self._rewrite()
+
+    def _rewrite(self):
+        path = self.directory / INDEX_NAME
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            for entry in self._entries.values():
+                f.write(json.dumps({'op': 'add', **entry._asdict()}) + '\n')
+        os.replace(tmp, path)
+        self._log_lines = len(self._entries)
+        if getattr(self, '_log', None) is not None:
+            self._log.close()
+            self._log = open(path, 'a')
+
+    def _append(self, op, **record):
+        self._log.write(json.dumps({'op': op, **record}) + '\n')
+        self._log.flush()
+        self._log_lines += 1
+
+    def _index(self, name, size, used=None):
+        timestamp = archive_timestamp(name) or time.time_ns()
+        entry = ArchiveEntry(name, timestamp, archive_position(name), archive_kind(name), size,
+                             time.time() if used is None else used)
+        self._entries[name] = entry
+        return entry
+
+    @traced('archive')
+    def add(self, path, name=None):
+        '''Hardlinks `path` into the archive as `name` and indexes it. Returns the archived path.'''
+        dst = self.directory / (name or Path(path).name)
+        link_file(path, dst)
+        with self._lock:
+            entry = self._index(dst.name, dst.stat().st_size)
+            self._append('add', **entry._asdict())
+        return dst
+
+    def files(self, start=None, end=None, positions=None, kinds=None):
+        '''
+        Returns (timestamp, path) of the archived files sorted by timestamp,
+        within [`start`, `end`] (ns), at `positions`, of `kinds` (e.g. ['nc',
+        'daily.nc']). Daily files match any position and every timestamp of
+        their day.
+        '''
+        if positions is not None:
+            positions = {str(p) for p in positions}
+        with self._lock:
+            entries = list(self._entries.values())
+        files = []
+        for entry in entries:
+            daily = entry.kind == 'daily.nc'
+            if kinds is not None and entry.kind not in kinds:
+                continue
+            if (start is not None and entry.timestamp + (DAY_NS - 1 if daily else 0) < start) or \
+                    (end is not None and entry.timestamp > end):
+                continue
+            if positions is not None and not daily and entry.position not in positions:
+                continue
+            files.append((entry.timestamp, self.directory / entry.name))
+        files.sort()
+        return files
+
+    def touch(self, paths):
+        '''Marks archived files as used now, e.g. after merging them, so they are evicted last.'''
+        now = time.time()
+        with self._lock:
+            for path in paths:
+                name = Path(path).name
+                if name in self._entries:
+                    self._entries[name] = self._entries[name]._replace(used=now)
+                    self._append('use', name=name, used=now)
+
+    def size(self):
+        '''Returns the bytes of the archived files.'''
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def _remove(self, names):
+        freed = 0
+        for name in names:
+            for path in (self.directory / name, self.directory / (name + '.manifest.json')):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                entry = self._entries.pop(name, None)
+                if entry is not None:
+                    freed += entry.size
+                    self._append('remove', name=name)
+        return freed
+
+    def evict(self, now=None):
+        '''
+        Removes the files past `max_age`, then the least recently used ones
+        until the archive fits in `max_bytes`. Returns (files, bytes) removed.
+        '''
+        now = time.time() if now is None else now
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: (e.used, e.timestamp))
+        evicted = []
+        if self.max_age:
+            cutoff = (now - self.max_age) * 1e9
+            # daily files go once their whole day is past the age
+            evicted = [e.name for e in entries if e.timestamp + (DAY_NS if e.kind == 'daily.nc' else 0) < cutoff]
+        if self.max_bytes:
+            total = sum(e.size for e in entries if e.name not in evicted)
+            for entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry.name not in evicted:
+                    evicted.append(entry.name)
+                    total -= entry.size
+        freed = self._remove(evicted)
+        if evicted:
+            logging.info("Evicted %d files (%.1f MB) from %s", len(evicted), freed / 1e6, self.directory)
+        return len(evicted), freed
+
+    def compact(self, now=None):
+        '''
+        Packs the NetCDF files of single frames captured more than
+        `compact_after` seconds ago into one file per UTC day, appending to
+        the daily file of a day packed before, and removes the files packed.
+        Files the merge skips stay in the archive. Returns the number of
+        files packed.
+        '''
+        if not self.compact_after:
+            return 0
+        now = time.time() if now is None else now
+        cutoff = (now - self.compact_after) * 1e9
+        days = {}
+        for timestamp, path in self.files(end=cutoff, kinds=['nc']):
+            day = datetime.datetime.fromtimestamp(timestamp / 1e9, datetime.timezone.utc).date()
+            days.setdefault(day, []).append((timestamp, path))
+
+        packed = 0
+        for day, files in sorted(days.items()):
+            start = datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc)
+            daily = self.directory / f"{int(start.timestamp()) * 1_000_000_000}_daily_{day:%Y-%m-%d}.nc"
+            merger = NetCDFMerger(daily)
+            # files packed before, left behind by a crash before their removal
+            merged = merger.sources()
+            try:
+                appended = set(merger.merge(files))
+            except Exception as e:
+                logging.warning("Cannot pack the archive of %s: %s", day, e)
+                continue
+            # not the files merge skipped, unreadable or of another resolution
+            names = [path.name for _, path in files if path.name in appended or path.name in merged]
+            if not names:
+                continue
+            with self._lock:
+                # the daily file is as recently used as its last frame
+                used = max((self._entries[name].used for name in [daily.name] + names if name in self._entries),
+                           default=None)
+                entry = self._index(daily.name, daily.stat().st_size, used=used)
+                self._append('add', **entry._asdict())
+            self._remove(names)
+            packed += len(names)
+            logging.info("Packed %d frames of %s into %s", len(names), day, daily.name)
+        return packed
+
+    def maintain(self, wait=False):
+        '''
+        Evicts and compacts on a background thread, unless it ran less than
+        `interval` seconds ago or is still running. With `wait` it runs now.
+        The daily files are written holding `MobotixNetCDF.NETCDF_LOCK`, like
+        every NetCDF file.
+        '''
+        if wait:
+            self.compact()
+            self.evict()
+            return
+        now = time.monotonic()
+        with self._lock:
+            if (self._thread is not None and self._thread.is_alive()) or \
+                    (self._last_maintain is not None and now - self._last_maintain < self.interval):
+                return
+            self._last_maintain = now
+            self._thread = threading.Thread(target=self.maintain, kwargs={'wait': True}, name="archive", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        '''Waits for a background maintenance and closes the index log.'''
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if self._log_lines > 2 * len(self._entries) + 1000:
+                self._rewrite()
+            self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -4,9 +4,13 @@ import os
 import datetime
 
 
+import base64
+import http.client
 import logging
+import queue
 import re
 import subprocess
+import threading
 from pathlib import Path
 from select import select
 
@@ -14,19 +18,181 @@ from select import select
 # for netcdf and plot
 import numpy as np
 #import pandas as pd
-import xarray as xr
-import matplotlib.pyplot as plt
+# xarray is imported on first use, it is slow to load
 
 from waggle.plugin import Plugin
 
+from MobotixFrameStore import FrameStore
+from MobotixImaging import DEFAULT_JPEG_QUALITY, bgra_to_jpeg, render_thermal
+from MobotixNetCDF import NETCDF_LOCK
+from MobotixThermal import THERMAL_SUFFIX, FrameAccumulator, read_celsius_csv, write_thermal_frame
+from MobotixTrace import traced
+from MobotixWatcher import DirectoryWatcher, frame_timestamp
+
 # camera image fetch timeout (seconds)
 DEFAULT_CAMERA_TIMEOUT = 30
 
+# Mobotix C++ sampler built from mobotix_sdk
+DEFAULT_SAMPLER = "/thermal-raw"
+
+# frames dropped at the start of a capture session window (stream latency)
+DEFAULT_SESSION_SKIP = 1
+
 # camera move timeout (seconds)
 DEFAULT_MOVEMENT_TIMEOUT = 15
 
 DEFAULT_MOVEMENT_WAIT = 1 # for safety
 
+_PLOT_LOCK = threading.Lock()
+
+# thermal outputs: the CSVs with one NetCDF file per frame, or compact binary frames
+THERMAL_FORMATS = ['netcdf', 'compact']
+
+# retries for a failed camera command and base of the exponential backoff (seconds)
+DEFAULT_COMMAND_RETRIES = 3
+DEFAULT_COMMAND_BACKOFF = 0.5
+
+
+class TransportError(Exception):
+    '''Raised when a command could not be delivered to the camera.'''
+
+
+class CurlTransport:
+    ''' Sends camera HTTP requests by running one curl process per request.
+
+    Parameters:
+        user (str): Camera user ID.
+        passwd (str): Camera password.
+        ip (str): Camera IP or URL.
+        timeout (float): Seconds to wait for each request.
+    '''
+    def __init__(self, user, passwd, ip, timeout=DEFAULT_MOVEMENT_TIMEOUT):
+        self.user = user
+        self.passwd = passwd
+        self.ip = ip
+        self.timeout = timeout
+
+    def post(self, path, timeout=None):
+        '''POSTs to `path` on the camera and returns the response body.'''
+        return self._run(["-X", "POST", f"http://{self.ip}{path}"], timeout, check=False).decode()
+
+    def get(self, path, timeout=None):
+        '''GETs `path` from the camera and returns the response body as bytes.'''
+        return self._run(["--fail", f"http://{self.ip}{path}"], timeout, check=True)
+
+    def _run(self, args, timeout, check):
+        cmd = ["curl", "-u", f"{self.user}:{self.passwd}"] + args
+        try:
+            result = subprocess.run(cmd, capture_output=True, timeout=timeout or self.timeout, check=check)
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+            raise TransportError(str(e)) from e
+        return result.stdout
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    ''' Sends camera HTTP requests over a pool of keep-alive connections.
+
+    The basic-auth header is built once and connections are reused between
+    requests, so a command costs one round trip instead of a process start,
+    a TCP handshake and an authentication. Failed requests are retried with
+    exponential backoff on a fresh connection.
+
+    Parameters:
+        user (str): Camera user ID.
+        passwd (str): Camera password.
+        ip (str): Camera IP or URL.
+        timeout (float): Seconds to wait for each request.
+        retries (int): Attempts after the first failed one.
+        backoff (float): Delay before the first retry, doubled on each retry.
+        pool_size (int): Maximum number of idle connections kept open.
+    '''
+    def __init__(self, user, passwd, ip, timeout=DEFAULT_MOVEMENT_TIMEOUT,
+                 retries=DEFAULT_COMMAND_RETRIES, backoff=DEFAULT_COMMAND_BACKOFF, pool_size=2):
+        self.ip = ip
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        token = base64.b64encode(f"{user}:{passwd}".encode()).decode()
+        self.headers = {"Authorization": f"Basic {token}", "Connection": "keep-alive"}
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _get_connection(self, timeout):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = http.client.HTTPConnection(self.ip, timeout=timeout)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def _release_connection(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def post(self, path, timeout=None):
+        '''POSTs to `path` on the camera and returns the response body.'''
+        _, body = self.request("POST", path, timeout)
+        return body.decode()
+
+    def get(self, path, timeout=None):
+        '''GETs `path` from the camera and returns the response body as bytes.'''
+        status, body = self.request("GET", path, timeout)
+        if status != 200:
+            raise TransportError(f"{path}: HTTP {status}")
+        return body
+
+    def request(self, method, path, timeout=None):
+        '''Sends one request, retrying on connection errors. Returns (status, body).'''
+        timeout = timeout or self.timeout
+        attempt = 0
+        while True:
+            conn = self._get_connection(timeout)
+            reused = conn.sock is not None
+            try:
+                conn.request(method, path, headers=self.headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused:
+                    # the camera may have dropped an idle connection, retry
+                    # straight away on a new one.
+                    continue
+                if attempt == self.retries:
+                    raise TransportError(f"{path}: {e}") from e
+                delay = self.backoff * 2 ** attempt
+                attempt += 1
+                logging.warning("Camera request failed (%s), retrying in %.1f s", e, delay)
+                time.sleep(delay)
+                continue
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release_connection(conn)
+            return response.status, body
+
+    def close(self):
+        '''Closes all idle connections.'''
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+TRANSPORTS = {
+    'http': HTTPTransport,
+    'curl': CurlTransport,
+}
+
+
 class MobotixPT:
     ''' A class representing Mobotix Pan-Tilt camera control.
 
@@ -34,12 +200,19 @@ class MobotixPT:
         user (str): Camera user ID.
         passwd (str): Camera password.
         ip (str): Camera IP or URL.
+        transport (str or object): Name in `TRANSPORTS` or a transport instance
+            used to deliver the commands.
     '''
-    def __init__(self, user, passwd, ip):
+    def __init__(self, user, passwd, ip, transport='http'):
         logging.info("Initializing MobotixPT with IP: %s", ip)
         self.user = user
         self.passwd = passwd
         self.ip = ip
+        if isinstance(transport, str):
+            transport = TRANSPORTS[transport](user, passwd, ip)
+        self.transport = transport
+        # objects with a camera_moving() method, told before every movement
+        self.listeners = []
         self.presets = {
         1: "%FF%01%00%07%00%01%09",
         2: "%FF%01%00%07%00%02%0A",
@@ -109,31 +282,22 @@ class MobotixPT:
 
 
     def _send_command(self, code):
-        cmd = ["curl",
-               "-u",
-               f"{self.user}:{self.passwd}",
-               "-X",
-               "POST",
-               f"http://{self.ip}/control/rcontrol?action=putrs232&rs232outtext={code}"]
-        
-        logging.info("Sending command : %s", cmd)
+        path = f"/control/rcontrol?action=putrs232&rs232outtext={code}"
 
-        try:
-            result = subprocess.run(cmd, capture_output=True, timeout=DEFAULT_MOVEMENT_TIMEOUT, text=True)
-            
-            if result.stdout.strip() != 'OK':
-                logging.warning('PT unit did not respond with OK')
-                raise Exception(f"INVALID_CREDENTIALS_OR_CONNECTION_ERROR:{result.stdout}")
-            else:
-                return result.stdout
+        logging.info("Sending command : %s", path)
 
-        except subprocess.TimeoutExpired as e:
-            logging.error("Error: {}".format(e))
-            return e
-        except subprocess.CalledProcessError as e:
+        try:
+            response = self.transport.post(path)
+        except TransportError as e:
             logging.error("Error: {}".format(e))
             return e
 
+        if response.strip() != 'OK':
+            logging.warning('PT unit did not respond with OK')
+            raise Exception(f"INVALID_CREDENTIALS_OR_CONNECTION_ERROR:{response}")
+        return response
+
+    @traced('move')
     def move_to_preset(self, pt_id):
         '''Moves the camera to the specified preset location.'''
         preset_code = self.presets.get(pt_id)
@@ -141,23 +305,32 @@ class MobotixPT:
         logging.info("Moving to preset with ID: %d", pt_id)
 
         if preset_code:
+            self._notify_moving()
             return self._send_command(preset_code)
         else:
             return "Invalid preset ID."
 
+    @traced('move')
     def move(self, direction, speed, duration):
         '''
         Moves the camera in the specified direction at the
           given speed and duration.'''
-        code = self.speed_codes[direction].get(speed)
-        if code:
-            self._send_command(code)
-            time.sleep(duration)
-            self.stop()
-            #time.sleep(DEFAULT_MOVEMENT_WAIT) # for safety
-        else:
+        if self.start_move(direction, speed) is None:
             return "Invalid code value for movement."
-        
+        time.sleep(duration)
+        self.stop()
+        #time.sleep(DEFAULT_MOVEMENT_WAIT) # for safety
+
+    def start_move(self, direction, speed):
+        '''
+        Starts turning the camera in the specified direction at the given
+        speed, until `stop`. Returns None for an unknown speed.'''
+        code = self.speed_codes[direction].get(speed)
+        if not code:
+            return None
+        self._notify_moving()
+        return self._send_command(code)
+
 
     def stop(self):
         '''Stops the camera movement.'''
@@ -167,11 +340,227 @@ class MobotixPT:
     def remote_reset(self):
         '''Remote reset of the camera moves it to home position.'''
         code = '%FF%01%00%0F%00%00%10'
+        self._notify_moving()
         return self._send_command(code)
 
+    def _notify_moving(self):
+        for listener in self.listeners:
+            listener.camera_moving()
+
+    def close(self):
+        '''Closes the connections held by the transport.'''
+        self.transport.close()
+
+
 
 
 
+class CaptureSession:
+    ''' Keeps one thermal-raw sampler streaming for a whole scan.
+
+    The sampler writes every frame into a spool directory next to the workdir.
+    Frames are kept only while a window is open: `open_window` is called when
+    the camera is in position and `camera_moving` (signalled by `MobotixPT`)
+    closes it, so frames streamed during a movement are deleted. The first
+    `frames` frames of a window, after skipping `skip` frames of stream
+    latency, are moved into the workdir. A stream window instead keeps
+    every frame, or one every `interval` seconds, movements included,
+    until `close_window`.
+
+    Parameters:
+        ip (str): Camera IP or URL.
+        user (str): Camera user ID.
+        passwd (str): Camera password.
+        workdir (str or Path): Directory receiving the frames of a window.
+        frames (int): Number of frames to keep per window.
+        skip (int): Frames to drop at the start of each window.
+        sampler (str): Path of the thermal-raw executable.
+        watch (str): `DirectoryWatcher` backend following the spool directory.
+    '''
+    FRAME_LINE = re.compile(r"frame\s#(\d+).*ts \(system\):\s*(\d+)")
+
+    def __init__(self, ip, user, passwd, workdir, frames, skip=DEFAULT_SESSION_SKIP, sampler=DEFAULT_SAMPLER,
+                 watch='auto'):
+        self.ip = ip
+        self.user = user
+        self.password = passwd
+        self.workdir = Path(workdir)
+        self.spool = self.workdir.with_name(self.workdir.name + ".spool")
+        self.frames = frames
+        self.skip = skip
+        self.sampler = sampler
+        self.watch = watch
+        self.discarded = 0
+        self._watcher = None
+        self._pending = {}
+        self._process = None
+        self._thread = None
+        self._window = None
+        self._cond = threading.Condition()
+
+    def start(self):
+        '''Starts the sampler and the thread reading its output.'''
+        self.spool.mkdir(parents=True, exist_ok=True)
+        for stale in self.spool.iterdir():
+            stale.unlink()
+        self._watcher = DirectoryWatcher(self.spool, backend=self.watch)
+        self._pending = {}
+
+        cmd = [
+            self.sampler,
+            "--url",
+            self.ip,
+            "--user",
+            self.user,
+            "--password",
+            self.password,
+            "--dir",
+            str(self.spool),
+        ]
+        logging.info(f"Starting capture session: {cmd}")
+        self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        self._thread = threading.Thread(target=self._read_output, args=(self._process,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stops the sampler and removes the spooled frames.'''
+        if self._process is None:
+            return
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._thread.join()
+        self._process = None
+        self._watcher.close()
+        for path in self.spool.glob("*"):
+            path.unlink()
+
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def _read_output(self, process):
+        previous = None
+        for line in process.stdout:
+            line = line.strip().decode(errors="replace")
+            logging.debug(line)
+            m = self.FRAME_LINE.search(line)
+            if not m:
+                continue
+            # the sampler announces a frame before writing its files, so the
+            # previous frame is complete once the next one is announced.
+            if previous is not None:
+                self._frame_complete(previous)
+            previous = int(m.group(2))
+
+        logging.info("Capture session sampler exited with %s", process.wait())
+        with self._cond:
+            self._cond.notify_all()
+
+    def _frame_complete(self, timestamp):
+        # the files of the frame are already in the spool, their events queued
+        for path in self._watcher.poll():
+            self._pending.setdefault(frame_timestamp(path), set()).add(path)
+        files = sorted(self._pending.pop(timestamp, ()))
+        for stale in [ts for ts in self._pending if ts is None or ts < timestamp]:
+            for path in self._pending.pop(stale):
+                path.unlink(missing_ok=True)
+
+        with self._cond:
+            window = self._window
+            keep = False
+            if window is not None and timestamp >= window['start']:
+                if window['skipped'] < self.skip:
+                    window['skipped'] += 1
+                elif window['stream']:
+                    keep = not window['frames'] or timestamp - window['frames'][-1] >= window['interval']
+                elif len(window['frames']) < self.frames:
+                    keep = True
+
+            if keep:
+                for path in files:
+                    os.rename(path, self.workdir / path.name)
+                    window['files'].append(self.workdir / path.name)
+                window['frames'].append(timestamp)
+                self._cond.notify_all()
+            else:
+                for path in files:
+                    path.unlink()
+                self.discarded += 1
+
+    def camera_moving(self):
+        '''Closes the current window, frames from now on are discarded. Stream windows stay open.'''
+        with self._cond:
+            if self._window is not None and not self._window['stream']:
+                self._window = None
+
+    def open_window(self, tag=None, stream=False, interval=0):
+        '''
+        Starts keeping frames for the position identified by `tag`. A
+        `stream` window keeps a frame every `interval` seconds until
+        `close_window`, while the camera moves too.
+        '''
+        if not self.running():
+            self.stop()
+            self.start()
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        with self._cond:
+            self._window = {'tag': tag, 'start': time.time_ns(), 'skipped': 0, 'frames': [], 'files': [],
+                            'stream': stream, 'interval': int(interval * 1_000_000_000)}
+
+    def wait_frames(self, count=None, timeout=DEFAULT_CAMERA_TIMEOUT):
+        '''
+        Waits until the open window holds `count` frames, by default one
+        more than it holds now. Returns False on timeout or when the sampler
+        exits.
+        '''
+        with self._cond:
+            window = self._window
+            if window is None:
+                raise Exception("No capture window open.")
+            if count is None:
+                count = len(window['frames']) + 1
+            return self._cond.wait_for(lambda: len(window['frames']) >= count or not self.running(), timeout) \
+                and len(window['frames']) >= count
+
+    def close_window(self):
+        '''Closes the open window and returns the files of its frames, moved into the workdir.'''
+        with self._cond:
+            window, self._window = self._window, None
+        if window is None:
+            return []
+        logging.info("Kept %d frames for %s", len(window['frames']), window['tag'])
+        return window['files']
+
+    def wait_window(self, timeout=DEFAULT_CAMERA_TIMEOUT):
+        '''
+        Waits until the open window holds `frames` frames, closes it and
+        returns the files of the frames, moved into the workdir.
+        '''
+        with self._cond:
+            window = self._window
+            if window is None:
+                raise Exception("No capture window open.")
+            done = self._cond.wait_for(
+                lambda: len(window['frames']) >= self.frames or not self.running(), timeout)
+            self._window = None
+
+        if not done or len(window['frames']) < self.frames:
+            logging.error("Capture session got %d of %d frames for %s",
+                          len(window['frames']), self.frames, window['tag'])
+            raise Exception("Camera timeout.")
+        logging.info("Captured frames %s for %s", window['frames'], window['tag'])
+        return window['files']
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
 
 class MobotixImager():
     ''' A class for capturing frames and processsing image data.
@@ -182,8 +571,24 @@ class MobotixImager():
         passwd (str): Camera password.
         workdir (str or Path): Directory to cache camera data before publishing to beehive.
         frames (int): Number of frames to capture in each attempt.
+        session (bool): Keep one sampler running in a `CaptureSession` instead
+            of starting it for every capture.
+        jpeg_backend (str): Encoder used for the visible frames, see `MobotixImaging.JPEG_BACKENDS`.
+        jpeg_quality (int): JPEG quality of the visible frames.
+        jpeg_scale (float): Downscale factor of the visible frames.
+        preview (str): Thermal plot renderer, 'fast' (turbo lookup table) or
+            'publication' (matplotlib figure with axes and colorbar).
+        preview_colorbar (bool): Add a colour strip to the fast previews.
+        sampler (str): Path of the thermal-raw executable.
+        thermal_format (str): 'netcdf' keeps the thermal CSVs and adds a NetCDF
+            file per frame, 'compact' replaces the CSVs by compact binary frames.
+        aggregate (bool): Replace the celsius CSVs of a capture by one NetCDF file
+            of their per-pixel statistics, see `aggregate_csvs`.
 '''
-    def __init__(self, ip, user, passwd, workdir, frames):
+    def __init__(self, ip, user, passwd, workdir, frames, session=False,
+                 jpeg_backend='auto', jpeg_quality=DEFAULT_JPEG_QUALITY, jpeg_scale=1,
+                 preview='fast', preview_colorbar=False, sampler=DEFAULT_SAMPLER, thermal_format='netcdf',
+                 aggregate=False):
         logging.info("Initializing MobotixImager with IP: %s and workdir: %s", ip, workdir)
         super().__init__()
         self.ip = ip
@@ -191,6 +596,27 @@ class MobotixImager():
         self.password = passwd
         self.workdir = Path(workdir)
         self.frames = frames
+        self.sampler = sampler
+        self.session = CaptureSession(ip, user, passwd, workdir, frames, sampler=sampler) if session else None
+        # the session streaming a continuous sweep, started for it without `session`
+        self._stream = None
+        self.jpeg_backend = jpeg_backend
+        self.jpeg_quality = jpeg_quality
+        self.jpeg_scale = jpeg_scale
+        self.preview = preview
+        self.preview_colorbar = preview_colorbar
+        if aggregate and thermal_format == 'compact':
+            raise ValueError("aggregate writes NetCDF statistics, it cannot be used with the compact thermal format")
+        self.thermal_format = thermal_format
+        self.aggregate = aggregate
+
+    def close(self):
+        '''Stops the capture session, if any.'''
+        if self._stream is not None and self._stream is not self.session:
+            self._stream.stop()
+        self._stream = None
+        if self.session is not None:
+            self.session.stop()
 
     def extract_timestamp_and_filename(self, path: Path):
         '''Extracts timestamp and filename from mobotix file path.'''
@@ -203,28 +629,15 @@ class MobotixImager():
         '''Extracts image resolution from the file name.'''
         return re.search("\d+x\d+", path.stem).group()
 
+    @traced('convert.jpeg')
     def convert_rgb_to_jpg(self, fname_rgb: Path):
         fname_jpg = fname_rgb.with_suffix(".jpg")
-        image_dims = self.extract_resolution(fname_rgb)
+        width, height = map(int, self.extract_resolution(fname_rgb).split("x"))
         logging.info(f"Converting {fname_rgb} from RGB to JPG")
         try:
-            subprocess.run(
-                [
-                    "ffmpeg",
-                    "-f",
-                    "rawvideo",
-                    "-pixel_format",
-                    "bgra",
-                    "-video_size",
-                    image_dims,
-                    "-i",
-                    str(fname_rgb),
-                    str(fname_jpg),
-                ],
-                check=True,
-                timeout=60
-            )
-        except subprocess.CalledProcessError as e:
+            bgra_to_jpeg(fname_rgb, fname_jpg, width, height, quality=self.jpeg_quality,
+                         scale=self.jpeg_scale, backend=self.jpeg_backend)
+        except (subprocess.CalledProcessError, RuntimeError, ValueError) as e:
             logging.error(f"Error converting RGB to JPG: {e}")
             raise
 
@@ -234,21 +647,16 @@ class MobotixImager():
     
 
     
-    def read_metadata_and_data(self, file_path):
+    @traced('convert.csv')
+    def read_metadata_and_data(self, file_path, chunk_rows=None):
+        '''Reads the header and float32 temperature grid of a celsius CSV.
+        Set `chunk_rows` to parse large sensors a block of rows at a time.'''
         logging.info(f"Reading metadata and data from {file_path}")
-        with file_path.open('r') as f:
-            lines = f.readlines()
-
-        metadata = {}
-        for line in lines[:7]:  # Assuming metadata is the first 7 lines
-            key, value = line.strip().split(';')
-            metadata[key] = value
-
-        temperature_data = [list(map(float, line.split(';'))) for line in lines[8:]]
-        return metadata, np.array(temperature_data)
+        return read_celsius_csv(file_path, chunk_rows=chunk_rows)
 
     def convert_to_dataset(self, metadata, temperature_data, time):
         logging.info('creating xarray dataset...')
+        import xarray as xr
         height, width = int(metadata['height']), int(metadata['width'])
         ds = xr.Dataset(
             {'temperature': (['time', 'y', 'x'], temperature_data[np.newaxis, :, :])},
@@ -267,44 +675,170 @@ class MobotixImager():
             ds.attrs[key] = value
         return ds
 
+    @traced('convert.netcdf')
     def save_to_netcdf(self, ds, file_path):
         output_filename = file_path.with_suffix(".nc")
-        ds.to_netcdf(output_filename)
+        with NETCDF_LOCK:
+            ds.to_netcdf(output_filename)
         logging.info('saving netcdf . . .')
         return output_filename
 
+    @traced('convert.plot')
     def plot_data(self, ds, file_path):
+        '''Plots the 1-frame Dataset `ds`, fast previews also take the temperature array.'''
         logging.info('ploting data ...')
-        fig, ax = plt.subplots(figsize=(8, 5))
-        ds.temperature.squeeze().plot(ax=ax, cmap='turbo', yincrease=False, center=False, robust=True)
         plot_filename = file_path.with_name(f"{file_path.stem}_plot.jpg")
-        fig.savefig(plot_filename)
+        if self.preview == 'fast':
+            data = ds if isinstance(ds, np.ndarray) else ds.temperature.values.squeeze()
+            render_thermal(data, plot_filename, colorbar=self.preview_colorbar)
+            return plot_filename
+
+        # matplotlib is only loaded for publication plots
+        import matplotlib.pyplot as plt
+        # pyplot keeps global state, serialise plots made by pipeline workers
+        with _PLOT_LOCK:
+            fig, ax = plt.subplots(figsize=(8, 5))
+            ds.temperature.squeeze().plot(ax=ax, cmap='turbo', yincrease=False, center=False, robust=True)
+            fig.savefig(plot_filename)
+            plt.close(fig)
         return plot_filename
 
-    def csv_to_netcdf(self, file_path):
+    def csv_to_netcdf(self, file_path, writer=None, meta=None, on_thermal=None):
+        '''Converts a celsius CSV to a NetCDF file and a plot. With a
+        `LoopNetCDFWriter` the frame is appended to the loop file instead,
+        at the position given by `meta`, and the CSV is removed: the loop
+        file is uploaded in its place. `on_thermal(file_path, metadata,
+        temperature_data)` is called with the frame. Returns the files
+        written next to the CSV.'''
         logging.info('creating netcdf from CSV .. . .')
         try:
             metadata, temperature_data = self.read_metadata_and_data(file_path)
+            if on_thermal is not None:
+                on_thermal(file_path, metadata, temperature_data)
             time, _ = self.extract_timestamp_and_filename(file_path)
             ds = self.convert_to_dataset(metadata, temperature_data, time/1000000000)
-            nc_filename = self.save_to_netcdf(ds, file_path)
+            created = []
+            if writer is None:
+                nc_filename = self.save_to_netcdf(ds, file_path)
+                created.append(nc_filename)
+            else:
+                writer.append(meta['position'], metadata, temperature_data, time/1000000000,
+                              direction=meta.get('direction', ''))
+                nc_filename = writer.path
             plot_filename = self.plot_data(ds, file_path)
+            created.append(plot_filename)
             logging.info(f"File saved as {nc_filename}")
             logging.info(f"Plot saved as {plot_filename}")
         except Exception as e:
             logging.error(f"Error in converting CSV to NetCDF: {e}")
             raise
+        if writer is not None:
+            file_path.unlink()
         logging.info('Done, if file names are printed above.')
-        return
+        return created
+
+    @traced('convert.compact')
+    def save_compact(self, file_path, data, metadata, kind):
+        return write_thermal_frame(file_path.with_suffix(THERMAL_SUFFIX), data, metadata, kind=kind)
+
+    def csv_to_compact(self, file_path, writer=None, meta=None, on_thermal=None):
+        '''Converts a celsius or uint CSV to a compact thermal frame (see
+        `MobotixThermal.write_thermal_frame`), with a plot of celsius frames,
+        and removes the CSV. With a `LoopNetCDFWriter` celsius frames are also
+        appended to the loop file. `on_thermal` is called as in `csv_to_netcdf`.
+        Returns the files written next to the CSV.'''
+        logging.info(f"Converting {file_path} to a compact thermal frame")
+        try:
+            if 'celsius' not in file_path.name:
+                metadata, counts = read_celsius_csv(file_path, dtype=np.uint16)
+                created = [self.save_compact(file_path, counts, metadata, 'counts')]
+            else:
+                metadata, temperature_data = self.read_metadata_and_data(file_path)
+                if on_thermal is not None:
+                    on_thermal(file_path, metadata, temperature_data)
+                created = [self.save_compact(file_path, temperature_data, metadata, 'celsius')]
+                time, _ = self.extract_timestamp_and_filename(file_path)
+                if writer is not None:
+                    writer.append(meta['position'], metadata, temperature_data, time/1000000000,
+                                  direction=meta.get('direction', ''))
+                # the Dataset is only built for matplotlib plots
+                plot_source = temperature_data if self.preview == 'fast' else \
+                    self.convert_to_dataset(metadata, temperature_data, time/1000000000)
+                created.append(self.plot_data(plot_source, file_path))
+        except Exception as e:
+            logging.error(f"Error in converting CSV to a compact thermal frame: {e}")
+            raise
+        file_path.unlink()
+        return created
+
+    def aggregate_to_dataset(self, metadata, accumulator):
+        '''Dataset of a `FrameAccumulator`: the mean frame as `temperature`, as
+        `convert_to_dataset` would give it, with its min, max and standard
+        deviation, and the frame count and time span as attributes.'''
+        ds = self.convert_to_dataset(metadata, accumulator.mean, accumulator.start)
+        for name, data in (('temperature_min', accumulator.minimum), ('temperature_max', accumulator.maximum),
+                           ('temperature_std', accumulator.std())):
+            ds[name] = (['time', 'y', 'x'], data[np.newaxis, :, :])
+        ds.attrs['frame_count'] = accumulator.count
+        ds.attrs['time_start'] = accumulator.start
+        ds.attrs['time_end'] = accumulator.end
+        ds.attrs['time_span'] = accumulator.end - accumulator.start
+        return ds
 
+    @traced('convert.aggregate')
+    def aggregate_csvs(self, file_paths, writer=None, meta=None, on_thermal=None):
+        '''Folds the celsius CSVs of one capture into a `FrameAccumulator`, one
+        frame in memory at a time. Writes one NetCDF file of the mean, min,
+        max and standard deviation of the frames, and a plot of the mean,
+        named after the first frame. With a `LoopNetCDFWriter` the mean frame
+        is appended to the loop file instead. `on_thermal` is called with the
+        mean frame. The CSVs are removed once all is written, a frame that
+        cannot be read leaves them in place. Returns the files written.'''
+        file_paths = sorted(file_paths)
+        logging.info(f"Aggregating {len(file_paths)} thermal frames")
+        accumulator = FrameAccumulator()
+        try:
+            for file_path in file_paths:
+                time, _ = self.extract_timestamp_and_filename(file_path)
+                metadata = accumulator.read(file_path, time=time/1000000000)
+        except Exception as e:
+            logging.error(f"Error in aggregating thermal frames: {e}")
+            raise
 
-    def get_camera_frames(self):
+        first = file_paths[0]
+        if on_thermal is not None:
+            on_thermal(first, metadata, accumulator.mean)
+        ds = self.aggregate_to_dataset(metadata, accumulator)
+        created = []
+        if writer is None:
+            created.append(self.save_to_netcdf(ds, first))
+        else:
+            writer.append(meta['position'], metadata, accumulator.mean, accumulator.start,
+                          direction=meta.get('direction', ''))
+        created.append(self.plot_data(accumulator.mean if self.preview == 'fast' else ds, first))
+        for file_path in file_paths:
+            file_path.unlink()
+        return created
+
+
+    @traced('capture')
+    def get_camera_frames(self, tag=None):
         '''Calls the camera interface to capture frames and 
-        stores them in the working directory.
+        stores them in the working directory. Returns the captured files.
         '''
+        if self.session is not None:
+            self.session.open_window(tag)
+            return self.session.wait_window()
+
+        # files the sampler wrote after the previous capture was stopped
+        with os.scandir(self.workdir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    logging.debug("Removing stale %s", entry.name)
+                    os.unlink(entry.path)
 
         cmd = [
-            "/thermal-raw",
+            self.sampler,
             "--url",
             self.ip,
             "--user",
@@ -317,9 +851,11 @@ class MobotixImager():
         logging.info(f"Calling camera interface: {cmd}")
 
         start_time = time.time()
+        captured = []
         
         try:
-            with subprocess.Popen(cmd, stdout=subprocess.PIPE) as process:
+            with DirectoryWatcher(self.workdir) as watcher, \
+                    subprocess.Popen(cmd, stdout=subprocess.PIPE) as process:
                 while True:
                     pollresults = select([process.stdout], [], [], 5)[0]
 
@@ -336,39 +872,117 @@ class MobotixImager():
                         continue
                     m = re.search("frame\s#(\d+)", output.strip().decode())
                     logging.info(output.strip().decode())
+                    # files of the frames announced so far are in place
+                    captured.extend(watcher.poll())
                     if m and int(m.groups()[0]) > self.frames:
-                        #Check if the  workdir is empty.
-                        dir_ls = os.listdir(self.workdir) 
-                        if len(dir_ls) == 0:
+                        # leave out the frame just announced
+                        ts = CaptureSession.FRAME_LINE.search(output.decode())
+                        files = [p for p in captured
+                                 if ts is None or (frame_timestamp(p) or 0) < int(ts.group(2))]
+                        if len(files) == 0:
                             logging.warning("Empty directory. No Frames captured.")
                             continue
 
                         logging.info("Max frame count reached, closing camera capture")
-                        return
+                        return files
                     
         except Exception as e:
             logging.exception("Camera plugin encountered an error: %s", str(e))
             raise
 
-    def capture(self):
+    def start_stream(self, tag=None, interval=0, timeout=DEFAULT_CAMERA_TIMEOUT):
+        '''
+        Starts keeping the frames the camera streams, one every `interval`
+        seconds, moves included, in the capture session (a session of its
+        own without one). Returns once the first frame is kept, so the
+        stream starts before the camera moves.
+        '''
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        self._stream = self.session or CaptureSession(self.ip, self.user, self.password, self.workdir,
+                                                      self.frames, sampler=self.sampler)
+        self._stream.open_window(tag, stream=True, interval=interval)
+        if not self._stream.wait_frames(1, timeout):
+            for path in self._end_stream():
+                path.unlink(missing_ok=True)
+            raise Exception("Camera timeout.")
+
+    @traced('capture')
+    def stop_stream(self, timeout=DEFAULT_CAMERA_TIMEOUT):
+        '''
+        Waits for one more frame, of the camera at rest after the stream,
+        stops keeping frames and returns the files kept since `start_stream`.
+        '''
+        if self._stream is None:
+            return []
+        try:
+            if not self._stream.wait_frames(timeout=timeout):
+                logging.warning("No frame after the end of the stream")
+        finally:
+            files = self._end_stream()
+        return files
+
+    def _end_stream(self):
+        stream, self._stream = self._stream, None
+        files = stream.close_window()
+        if stream is not self.session:
+            stream.stop()
+        return files
+
+    def capture(self, tag=None, convert=True):
         '''Captures frames from the camera, converts them to JPG, 
-        and stores them in the working directory.'''
+        and stores them in the working directory. With `convert=False` the
+        raw sampler files are left for a later `convert` call.
+        Returns the captured files.'''
         try:
             self.workdir.mkdir(parents=True, exist_ok=True)
-            self.get_camera_frames()
+            files = self.get_camera_frames(tag)
         except Exception as e:
             logging.exception("Camera plugin encountered an error: %s", str(e))
             raise Exception(e)
 
-        for tspath in self.workdir.glob("*"):
+        if convert:
+            store = FrameStore(self.workdir)
+            for path in files:
+                store.add(path)
+            self.convert(store)
+            return store.paths()
+
+        return files
+
+    def convert(self, directory, writer=None, meta=None, on_thermal=None):
+        '''Converts the raw sampler files in `directory` to JPG and NetCDF,
+        or compact thermal frames (see `thermal_format`).
+        `directory` can be a `FrameStore`, whose index then lists the
+        converted files. `writer`, `meta` and `on_thermal` are passed on to
+        `csv_to_netcdf`. With `aggregate` the celsius CSVs go to
+        `aggregate_csvs` instead.'''
+        store = directory if isinstance(directory, FrameStore) else None
+        paths = store.paths() if store is not None else list(Path(directory).glob("*"))
+        if self.aggregate:
+            celsius = [path for path in paths if path.name.endswith('.thermal.celsius.csv')]
+            if celsius:
+                created = self.aggregate_csvs(celsius, writer=writer, meta=meta, on_thermal=on_thermal)
+                if store is not None:
+                    for path in celsius:
+                        store.discard(path)
+                    for path in created:
+                        store.add(path)
+            paths = [path for path in paths if path not in celsius]
+        for tspath in paths:
             if tspath.suffix == ".rgb":
-                tspath = self.convert_rgb_to_jpg(tspath)
+                fname_jpg = self.convert_rgb_to_jpg(tspath)
+                if store is not None:
+                    store.replace(tspath, fname_jpg)
+            elif self.thermal_format == 'compact' and tspath.name.endswith(('.thermal.celsius.csv', '.thermal.uint.csv')):
+                created = self.csv_to_compact(tspath, writer=writer, meta=meta, on_thermal=on_thermal)
+                if store is not None:
+                    store.discard(tspath)
+                    for path in created:
+                        store.add(path)
             elif 'celsius' in tspath.name and tspath.suffix == ".csv":
-                self.csv_to_netcdf(tspath)
-
-
-        return 
-
-
-
-
+                created = self.csv_to_netcdf(tspath, writer=writer, meta=meta, on_thermal=on_thermal)
+                if store is not None:
+                    if writer is not None:
+                        store.discard(tspath)
+                    for path in created:
+                        store.add(path)
@@ -0,0 +1,177 @@
+import errno
+import logging
+import os
+import re
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+from MobotixTrace import traced
+
+FrameKey = namedtuple('FrameKey', ['timestamp', 'sensor', 'kind', 'position'])
+
+_RESOLUTION = re.compile(r"^\d+x\d+$")
+
+# ioctl cloning a file on Linux, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def parse_frame_name(name):
+    '''
+    Splits a sampler file name into (timestamp, sensor, kind):
+    `1700000000000000000_1280x960.rgb` is (1700000000000000000, 'visible', 'rgb'),
+    `1700000000000000000_left_336x252_14bit.thermal.celsius.csv` is
+    (1700000000000000000, 'left', 'thermal.celsius.csv'). Names without a
+    timestamp get None.
+    '''
+    timestamp = None
+    prefix, sep, rest = name.partition("_")
+    if sep and prefix.isdigit():
+        timestamp, name = int(prefix), rest
+    base, _, kind = name.partition(".")
+    sensor = base.split("_", 1)[0]
+    if _RESOLUTION.match(sensor):
+        sensor = 'visible'
+    return timestamp, sensor, kind
+
+
+def reflink_file(src, dst):
+    '''
+    Clones `src` to `dst` on filesystems with copy-on-write extents (btrfs,
+    XFS): the new file shares the bytes of `src` until either is modified.
+    Returns False, leaving no `dst`, when the filesystem cannot clone.
+    '''
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except (ImportError, OSError) as e:
+        logging.debug("Cannot reflink %s to %s: %s", src, dst, e)
+        try:
+            os.unlink(dst)
+        except FileNotFoundError:
+            pass
+        return False
+
+
+def link_file(src, dst):
+    '''
+    Hardlinks `src` to `dst`, so both names share the same bytes on disk.
+    Falls back to a reflink, then to a copy, when they are on different
+    filesystems or the filesystem has no hardlinks. Returns True when no
+    bytes were copied.
+    '''
+    try:
+        os.link(src, dst)
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    if reflink_file(src, dst):
+        return True
+    logging.debug("Cannot hardlink %s to %s, copying", src, dst)
+    shutil.copyfile(src, dst)
+    return False
+
+
+class FrameStore:
+    ''' Index of the files of one capture, keyed by (timestamp, sensor, kind, position).
+
+    `stage` moves the files of a capture out of the workdir with a single
+    directory scan and indexes them. After that, the conversion, renaming,
+    archiving and upload steps look files up in the index instead of
+    scanning the directory again. Renames are `os.rename`, and archived
+    copies are hardlinks, so no step rewrites the bytes of a frame.
+
+    Parameters:
+        directory (str or Path): Directory holding the files of the capture.
+        position: Preset, direction or shot the capture was taken at.
+    '''
+    def __init__(self, directory, position=None):
+        self.directory = Path(directory)
+        self.position = position
+        self._index = {}
+
+    @classmethod
+    @traced('stage')
+    def stage(cls, workdir, staging_dir, position=None, files=None):
+        '''
+        Moves the files captured in `workdir` into `staging_dir` and returns
+        their store, leaving an empty workdir for the next capture. When the
+        capture returned its `files`, only those are moved and the workdir
+        is not scanned.
+        '''
+        store = cls(staging_dir, position)
+        store.directory.mkdir(parents=True, exist_ok=True)
+        if files is None:
+            with os.scandir(workdir) as entries:
+                files = [entry.path for entry in entries if entry.is_file()]
+        for src in files:
+            path = store.directory / Path(src).name
+            os.rename(src, path)
+            store.add(path)
+        return store
+
+    def key(self, path):
+        '''Returns the index key of a file of this capture.'''
+        return FrameKey(*parse_frame_name(Path(path).name), self.position)
+
+    def add(self, path):
+        '''Indexes a file written for this capture, e.g. a converted frame.'''
+        key = self.key(path)
+        self._index[key] = Path(path)
+        return key
+
+    def discard(self, path):
+        '''Removes a file from the index (not from disk).'''
+        self._index = {key: p for key, p in self._index.items() if p != Path(path)}
+
+    def replace(self, old, new):
+        '''Indexes `new` in place of `old`, e.g. a JPEG converted from a raw frame.'''
+        self.discard(old)
+        return self.add(new)
+
+    def rename(self, path, new_path):
+        '''Renames a file, keeping its key. Returns the new path.'''
+        new_path = Path(new_path)
+        os.rename(path, new_path)
+        for key, p in self._index.items():
+            if p == Path(path):
+                self._index[key] = new_path
+        return new_path
+
+    @traced('archive')
+    def link(self, path, directory, name=None):
+        '''Hardlinks a file into `directory`, see `link_file`. Returns the link.'''
+        dst = Path(directory) / (name or Path(path).name)
+        link_file(path, dst)
+        return dst
+
+    def find(self, timestamp=None, sensor=None, kind=None):
+        '''Returns the paths matching the given key fields, in timestamp order.'''
+        return [path for key, path in self.items()
+                if (timestamp is None or key.timestamp == timestamp)
+                and (sensor is None or key.sensor == sensor)
+                and (kind is None or key.kind == kind)]
+
+    def paths(self):
+        '''Returns every indexed path, in timestamp order.'''
+        return self.find()
+
+    def items(self):
+        '''Returns the (key, path) pairs of the index, in timestamp order.'''
+        return sorted(self._index.items(), key=lambda item: (item[0].timestamp or 0, item[1].name))
+
+    def close(self):
+        '''Removes the staging directory once its files have been moved away.'''
+        try:
+            self.directory.rmdir()
+        except OSError:
+            logging.debug("Keeping %s, files were not moved by the uploader", self.directory)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self.paths())
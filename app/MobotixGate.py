@@ -0,0 +1,168 @@
+import io
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from MobotixSettle import decode_thumbnail
+
+# largest change (degC) of the block-averaged thermal grid still counted as the same scene
+DEFAULT_GATE_THERMAL = 1.0
+
+# Hamming distance (of 64 bits) between visible hashes still counted as the same scene
+DEFAULT_GATE_HASH = 10
+
+# at least one capture of a position in this many is uploaded in full
+DEFAULT_GATE_KEYFRAME = 12
+
+# side in pixels of the blocks averaged into the thermal reference
+THERMAL_BLOCK = 8
+
+
+def gate_dir(workdir):
+    '''Directory next to the workdir keeping the references between runs.'''
+    workdir = Path(workdir)
+    return workdir.with_name(workdir.name + ".gate")
+
+
+def position_key(meta):
+    '''Reference key of a capture: its preset and, in direction scans, its direction.'''
+    key = str(meta['position'])
+    if meta.get('direction'):
+        key += f"_{meta['direction']}"
+    return key
+
+
+def block_mean(data, shape):
+    '''Averages `data` down to `shape`, each output value the mean of a block of pixels.'''
+    # repeat the pixels of inputs smaller than `shape`, every block needs one
+    repeats = (-(-shape[0] // data.shape[0]), -(-shape[1] // data.shape[1]))
+    if repeats != (1, 1):
+        data = np.repeat(np.repeat(data, repeats[0], axis=0), repeats[1], axis=1)
+    rows = np.linspace(0, data.shape[0], shape[0] + 1).astype(int)[:-1]
+    cols = np.linspace(0, data.shape[1], shape[1] + 1).astype(int)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(data.astype(np.float64), rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, data.shape[0])), np.diff(np.append(cols, data.shape[1])))
+    return (sums / counts).astype(np.float32)
+
+
+def thermal_signature(data, block=THERMAL_BLOCK):
+    '''Block-averaged thermal grid, robust to sensor noise and about 64 times smaller.'''
+    shape = (max(data.shape[0] // block, 1), max(data.shape[1] // block, 1))
+    return block_mean(data, shape)
+
+
+def visual_hash(jpeg):
+    '''
+    64-bit difference hash of a JPEG (file path or bytes): the signs of the
+    horizontal gradients of an 8x9 thumbnail. Similar images differ in few bits.
+    '''
+    if not isinstance(jpeg, bytes):
+        jpeg = Path(jpeg).read_bytes()
+    small = block_mean(decode_thumbnail(jpeg), (8, 9))
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+class ChangeGate:
+    ''' Decides, per position, whether a capture is uploaded in full.
+
+    For every position the gate keeps a reference: the thermal signature and
+    visible hash of the last capture uploaded in full. A new capture is
+    uploaded when its thermal grid moved by `thermal_threshold` or more in
+    any block, its visible hash by `hash_threshold` bits or more, or when
+    the `keyframe_interval - 1` captures of the position before it were
+    skipped, so that one capture in `keyframe_interval` goes up regardless.
+    References are saved in `state_dir`, so one-off scans started by a
+    scheduler gate against the previous run.
+
+    Parameters:
+        state_dir (str or Path): Directory keeping the references, None to keep them in memory.
+        thermal_threshold (float): Block change in degC that counts as a change.
+        hash_threshold (int): Visible hash distance in bits that counts as a change.
+        keyframe_interval (int): Captures per position of which at least one is uploaded.
+    '''
+    def __init__(self, state_dir=None, thermal_threshold=DEFAULT_GATE_THERMAL, hash_threshold=DEFAULT_GATE_HASH,
+                 keyframe_interval=DEFAULT_GATE_KEYFRAME):
+        self.state_dir = Path(state_dir) if state_dir is not None else None
+        self.thermal_threshold = thermal_threshold
+        self.hash_threshold = hash_threshold
+        self.keyframe_interval = keyframe_interval
+        self._refs = {}
+        self._lock = threading.Lock()
+        if self.state_dir is not None:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        return self.state_dir / (re.sub(r"[^A-Za-z0-9_.-]", "_", key) + ".npz")
+
+    def _load(self, key):
+        if key not in self._refs and self.state_dir is not None and self._path(key).exists():
+            try:
+                with np.load(self._path(key)) as state:
+                    self._refs[key] = {
+                        'thermal': state['thermal'] if state['thermal'].size else None,
+                        'hash': int(state['hash']) if state['has_hash'] else None,
+                        'skipped': int(state['skipped']),
+                    }
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning("Ignoring unreadable gate reference %s: %s", self._path(key), e)
+        return self._refs.get(key)
+
+    def _save(self, key, ref):
+        self._refs[key] = ref
+        if self.state_dir is None:
+            return
+        buffer = io.BytesIO()
+        np.savez(buffer, thermal=ref['thermal'] if ref['thermal'] is not None else np.empty(0, np.float32),
+                 hash=np.uint64(ref['hash'] or 0), has_hash=ref['hash'] is not None, skipped=ref['skipped'])
+        tmp = self._path(key).with_suffix(".tmp")
+        tmp.write_bytes(buffer.getvalue())
+        os.replace(tmp, self._path(key))
+
+    def check(self, key, thermal=None, visible=None):
+        '''
+        Compares a capture of position `key` with its reference. `thermal` is
+        the temperature grid and `visible` the hash (see `visual_hash`), either
+        can be None. Returns whether to upload the capture in full and the
+        difference statistics: `thermal.mean`, `thermal.p95` and `thermal.max`
+        block changes (degC), `visible.distance` (bits) and the `reason`.
+        '''
+        signature = thermal_signature(thermal) if thermal is not None else None
+        stats = {}
+        with self._lock:
+            ref = self._load(key)
+            if ref is None:
+                upload, reason = True, 'first'
+            else:
+                changed = False
+                if signature is not None and ref['thermal'] is not None and ref['thermal'].shape == signature.shape:
+                    change = np.abs(signature - ref['thermal'])
+                    stats['thermal.mean'] = float(change.mean())
+                    stats['thermal.p95'] = float(np.percentile(change, 95))
+                    stats['thermal.max'] = float(change.max())
+                    changed = stats['thermal.max'] >= self.thermal_threshold
+                elif signature is not None:
+                    changed = True
+                if visible is not None and ref['hash'] is not None:
+                    stats['visible.distance'] = bin(visible ^ ref['hash']).count('1')
+                    changed = changed or stats['visible.distance'] >= self.hash_threshold
+                elif visible is not None:
+                    changed = True
+
+                if changed:
+                    upload, reason = True, 'changed'
+                elif ref['skipped'] + 1 >= self.keyframe_interval:
+                    upload, reason = True, 'keyframe'
+                else:
+                    upload, reason = False, 'unchanged'
+
+            if upload:
+                self._save(key, {'thermal': signature, 'hash': visible, 'skipped': 0})
+            else:
+                self._save(key, {**ref, 'skipped': ref['skipped'] + 1})
+        stats['reason'] = reason
+        return upload, stats
@@ -0,0 +1,237 @@
+import functools
+import importlib
+import logging
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=None)
+def _optional_import(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+# opencv comes with pywaggle[vision], Pillow with matplotlib; both are
+# imported on first use so that startup does not pay for them
+def load_cv2():
+    '''Returns the opencv module, or None when it is not installed.'''
+    return _optional_import('cv2')
+
+
+def load_pillow():
+    '''Returns the `PIL.Image` module, or None when Pillow is not installed.'''
+    return _optional_import('PIL.Image')
+
+
+def __getattr__(name):
+    # `MobotixImaging.cv2` and `MobotixImaging.Image`, loaded on first access
+    if name == 'cv2':
+        return load_cv2()
+    if name == 'Image':
+        return load_pillow()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+DEFAULT_JPEG_QUALITY = 90
+
+JPEG_BACKENDS = ['auto', 'opencv', 'pillow', 'ffmpeg']
+
+
+def read_bgra(path, width, height):
+    '''
+    Memory-maps a raw BGRA frame written by the thermal-raw sampler as a
+    (height, width, 4) uint8 array, without reading it into memory.
+    '''
+    return np.memmap(path, dtype=np.uint8, mode='r', shape=(height, width, 4))
+
+
+def _encode_opencv(bgra, fname_jpg, quality, scale):
+    cv2 = load_cv2()
+    if scale != 1:
+        bgra = cv2.resize(bgra, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    # the opencv JPEG encoder drops the alpha channel of 4-channel input itself
+    if not cv2.imwrite(str(fname_jpg), bgra, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        raise RuntimeError(f"opencv could not write {fname_jpg}")
+
+
+def _encode_pillow(bgra, fname_jpg, quality, scale):
+    Image = load_pillow()
+    height, width = bgra.shape[:2]
+    image = Image.frombuffer("RGBA", (width, height), bgra, "raw", "BGRA", 0, 1).convert("RGB")
+    if scale != 1:
+        image = image.resize((round(width * scale), round(height * scale)), Image.BOX)
+    image.save(fname_jpg, quality=quality)
+
+
+def _encode_ffmpeg(fname_rgb, fname_jpg, width, height, scale):
+    cmd = [
+        "ffmpeg",
+        "-f",
+        "rawvideo",
+        "-pixel_format",
+        "bgra",
+        "-video_size",
+        f"{width}x{height}",
+        "-i",
+        str(fname_rgb),
+    ]
+    if scale != 1:
+        cmd += ["-vf", f"scale=iw*{scale}:ih*{scale}"]
+    subprocess.run(cmd + [str(fname_jpg)], check=True, timeout=60)
+
+
+def resolve_jpeg_backend(backend='auto'):
+    '''Returns the backend used for `backend`, 'auto' picks the first one installed.'''
+    if backend != 'auto':
+        return backend
+    if load_cv2() is not None:
+        return 'opencv'
+    if load_pillow() is not None:
+        return 'pillow'
+    return 'ffmpeg'
+
+
+def bgra_to_jpeg(fname_rgb, fname_jpg, width, height, quality=DEFAULT_JPEG_QUALITY, scale=1, backend='auto'):
+    '''
+    Encodes a raw BGRA frame as JPEG. The opencv and pillow backends encode
+    in-process from a memory map of the frame, the ffmpeg backend runs ffmpeg.
+
+    Parameters:
+        fname_rgb (Path): Raw BGRA frame.
+        fname_jpg (Path): JPEG to write.
+        width, height (int): Frame resolution.
+        quality (int): JPEG quality, 1-100 (ignored by ffmpeg).
+        scale (float): Downscale factor applied before encoding, 1 keeps the resolution.
+        backend (str): One of `JPEG_BACKENDS`.
+    '''
+    backend = resolve_jpeg_backend(backend)
+    logging.debug("Encoding %s with %s", fname_rgb, backend)
+
+    if backend == 'ffmpeg':
+        _encode_ffmpeg(fname_rgb, fname_jpg, width, height, scale)
+        return Path(fname_jpg)
+
+    bgra = read_bgra(fname_rgb, width, height)
+    try:
+        if backend == 'opencv':
+            _encode_opencv(bgra, fname_jpg, quality, scale)
+        elif backend == 'pillow':
+            _encode_pillow(bgra, fname_jpg, quality, scale)
+        else:
+            raise ValueError(f"Unknown JPEG backend '{backend}'. Use {JPEG_BACKENDS}")
+    finally:
+        del bgra
+    return Path(fname_jpg)
+
+
+# turbo colormap (Google, Apache 2.0) as 256 RGB triplets, the same table as
+# matplotlib's and opencv's 'turbo'
+_TURBO_HEX = (
+    "30123b32154333184a341b51351e5836215f37246638276d392a733a2d793b2f803c32863d358b3e38913f3b973f3e9c"
+    "4040a24143a74146ac4249b1424bb5434eba4451bf4454c34456c74559cb455ccf455ed34661d64664da4666dd4669e0"
+    "466be3476ee64771e94773eb4776ee4778f0477bf2467df44680f64682f84685fa4687fb458afc458cfd448ffe4391fe"
+    "4294ff4196ff4099ff3e9bfe3d9efe3ba0fd3aa3fc38a5fb37a8fa35abf833adf731aff52fb2f42eb4f22cb7f02ab9ee"
+    "28bceb27bee925c0e723c3e422c5e220c7df1fc9dd1ecbda1ccdd81bd0d51ad2d21ad4d019d5cd18d7ca18d9c818dbc5"
+    "18ddc218dec018e0bd19e2bb19e3b91ae4b61ce6b41de7b21fe9af20eaac22ebaa25eca727eea42aefa12cf09e2ff19b"
+    "32f29835f39438f4913cf58e3ff68a43f78746f8844af8804ef97d52fa7a55fa7659fb735dfc6f61fc6c65fd6969fd66"
+    "6dfe6271fe5f75fe5c79fe597dff5680ff5384ff5188ff4e8bff4b8fff4992ff4796fe4499fe429cfe409ffd3fa1fd3d"
+    "a4fc3ca7fc3aa9fb39acfb38affa37b1f936b4f836b7f735b9f635bcf534bef434c1f334c3f134c6f034c8ef34cbed34"
+    "cdec34d0ea34d2e935d4e735d7e535d9e436dbe236dde037dfdf37e1dd37e3db38e5d938e7d739e9d539ebd339ecd13a"
+    "eecf3aefcd3af1cb3af2c93af4c73af5c53af6c33af7c13af8be39f9bc39faba39fbb838fbb637fcb336fcb136fdae35"
+    "fdac34fea933fea732fea431fea130fe9e2ffe9b2dfe992cfe962bfe932afe9029fd8d27fd8a26fc8725fc8423fb8122"
+    "fb7e21fa7b1ff9781ef9751df8721cf76f1af66c19f56918f46617f36315f26014f15d13f05b12ef5811ed5510ec530f"
+    "eb500eea4e0de84b0ce7490ce5470be4450ae2430ae14109df3f08dd3d08dc3b07da3907d83706d63506d43305d23105"
+    "d02f05ce2d04cc2b04ca2a04c82803c52603c32503c12302be2102bc2002b91e02b71d02b41b01b21a01af1801ac1701"
+    "a91601a71401a41301a112019e10019b0f01980e01950d01920b018e0a018b09028808028507028106027e05027a0403"
+)
+TURBO_LUT = np.frombuffer(bytes.fromhex(_TURBO_HEX), dtype=np.uint8).reshape(256, 3)
+
+PREVIEW_MODES = ['fast', 'publication']
+
+DEFAULT_PREVIEW_SCALE = 2
+COLORBAR_WIDTH = 16
+
+
+def robust_limits(data, low=2, high=98):
+    '''
+    Returns the `low` and `high` percentiles of the finite values of `data`,
+    interpolated like `np.percentile`, from a partial sort with `np.partition`.
+    '''
+    values = np.asarray(data, dtype=np.float32).ravel()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return 0.0, 1.0
+    ranks = [q / 100 * (values.size - 1) for q in (low, high)]
+    kth = sorted({int(np.floor(r)) for r in ranks} | {int(np.ceil(r)) for r in ranks})
+    values = np.partition(values, kth)
+    limits = []
+    for r in ranks:
+        below, above = values[int(np.floor(r))], values[int(np.ceil(r))]
+        limits.append(float(below + (above - below) * (r - np.floor(r))))
+    return tuple(limits)
+
+
+def colorize(data, vmin, vmax, lut=TURBO_LUT):
+    '''Maps `data` to RGB through a 256-entry `lut`, clipping to [vmin, vmax].'''
+    span = vmax - vmin if vmax > vmin else 1.0
+    index = np.nan_to_num((np.asarray(data, dtype=np.float32) - vmin) * (255 / span), nan=0.0)
+    return lut[np.clip(index, 0, 255).astype(np.uint8)]
+
+
+def write_jpeg(rgb, fname_jpg, quality=DEFAULT_JPEG_QUALITY):
+    '''Writes an (height, width, 3) RGB uint8 array as JPEG.'''
+    cv2 = load_cv2()
+    if cv2 is not None:
+        if not cv2.imwrite(str(fname_jpg), rgb[..., ::-1], [cv2.IMWRITE_JPEG_QUALITY, quality]):
+            raise RuntimeError(f"opencv could not write {fname_jpg}")
+    elif load_pillow() is not None:
+        load_pillow().fromarray(np.ascontiguousarray(rgb)).save(fname_jpg, quality=quality)
+    else:
+        raise RuntimeError("Writing a preview needs opencv or Pillow.")
+    return Path(fname_jpg)
+
+
+def read_jpeg(fname_jpg):
+    '''Reads a JPEG as an (height, width, 3) RGB uint8 array.'''
+    cv2 = load_cv2()
+    if cv2 is not None:
+        bgr = cv2.imread(str(fname_jpg), cv2.IMREAD_COLOR)
+        if bgr is None:
+            raise ValueError(f"opencv could not read {fname_jpg}")
+        return bgr[..., ::-1]
+    if load_pillow() is not None:
+        with load_pillow().open(fname_jpg) as image:
+            return np.asarray(image.convert("RGB"))
+    raise RuntimeError("Reading a JPEG needs opencv or Pillow.")
+
+
+def render_thermal(temperature_data, fname_jpg, scale=DEFAULT_PREVIEW_SCALE, colorbar=False,
+                   quality=DEFAULT_JPEG_QUALITY):
+    '''
+    Writes a turbo-coloured JPEG preview of a thermal frame, scaled between
+    its 2nd and 98th percentiles like the robust matplotlib plot. Returns the
+    (vmin, vmax) limits used.
+
+    Parameters:
+        temperature_data (ndarray): (height, width) temperatures, row 0 at the top.
+        fname_jpg (Path): JPEG to write.
+        scale (int): Integer upscale factor (nearest neighbour).
+        colorbar (bool): Append a colour strip, vmax at the top and vmin at the bottom.
+        quality (int): JPEG quality, 1-100.
+    '''
+    vmin, vmax = robust_limits(temperature_data)
+    rgb = colorize(temperature_data, vmin, vmax)
+    if scale != 1:
+        rgb = rgb.repeat(scale, axis=0).repeat(scale, axis=1)
+    if colorbar:
+        height = rgb.shape[0]
+        strip = TURBO_LUT[np.linspace(255, 0, height).astype(np.uint8)]
+        strip = np.broadcast_to(strip[:, None, :], (height, COLORBAR_WIDTH * scale, 3))
+        gap = np.full((height, 4 * scale, 3), 255, dtype=np.uint8)
+        rgb = np.concatenate([rgb, gap, strip], axis=1)
+    write_jpeg(rgb, fname_jpg, quality)
+    return vmin, vmax
@@ -0,0 +1,163 @@
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import timeout_decorator
+
+from waggle.plugin import Plugin
+
+from MobotixPipeline import SharedPipeline
+from MobotixScan import DEFAULT_SCAN_TIMEOUT, SCAN_RUNNERS, ScanSession, open_archive, scan_daemon
+from MobotixTrace import TRACER
+from MobotixUpload import UploadQueue, spool_dir
+
+# options of the whole run, the same for every camera
+SHARED_OPTIONS = ['debug', 'profile_startup', 'daemon', 'schedule', 'scan_timeout', 'workers', 'upload_workers',
+                  'trace', 'cameras', 'archive_max_bytes', 'archive_max_age', 'archive_compact', 'calibrate']
+
+
+def load_cameras(path):
+    '''
+    Reads the list of camera configurations of a JSON file. Each is a dict
+    of the options that differ from the command line, by argument name:
+
+        [{"name": "north", "ip": "10.31.81.14", "preset": "1,5,9"},
+         {"name": "south", "ip": "10.31.81.15", "mode": "direction", "preset": "SS,WH", "south": "3"}]
+    '''
+    with open(path) as f:
+        cameras = json.load(f)
+    if not isinstance(cameras, list) or not cameras:
+        raise ValueError(f"{path} does not hold a list of cameras")
+    return cameras
+
+
+def camera_args(args, cameras):
+    '''
+    Returns the arguments of each camera of `cameras` (see `load_cameras`):
+    the command line `args` with the options of the camera, its `camera`
+    name (its IP by default) and, unless set, a workdir named after the
+    camera inside `args.workdir`.
+    '''
+    result = []
+    for config in cameras:
+        config = dict(config)
+        name = str(config.pop('name', config.get('ip', args.ip)))
+        if name in [camera.camera for camera in result]:
+            raise ValueError(f"Camera name '{name}' is used twice")
+        for key in config:
+            if key in SHARED_OPTIONS or not hasattr(args, key):
+                raise ValueError(f"Option '{key}' of camera '{name}' cannot be set per camera")
+        result.append(argparse.Namespace(**{**vars(args), 'workdir': Path(args.workdir) / name, **config,
+                                            'camera': name}))
+    return result
+
+
+class MultiCameraSession:
+    ''' The plugin, upload queue and pipeline workers shared by several cameras.
+
+    Each camera gets a `ScanSession` of its own on top of them, with its PT
+    controller, imager, workdir and settle detector. The conversion and
+    upload of all the cameras go through one `SharedPipeline` of
+    `args.workers` threads, served in turn, and one `UploadQueue`, so the
+    cameras of a node share one set of workers instead of a plugin each.
+
+    Parameters:
+        args (Namespace): Parsed command line arguments.
+        cameras (list of Namespace): Arguments of each camera, see `camera_args`.
+    '''
+    def __init__(self, args, cameras):
+        self.args = args
+        self._threads = []
+        self._stack = ExitStack()
+        try:
+            self.plugin = self._stack.enter_context(Plugin())
+            if args.trace:
+                TRACER.dump_to(args.trace)
+                self._stack.callback(TRACER.close)
+            self.uploads = self._stack.enter_context(
+                UploadQueue(self.plugin, spool_dir(args.workdir), workers=args.upload_workers))
+            self.pool = self._stack.enter_context(SharedPipeline(workers=args.workers))
+            # the custom scans of all the cameras share the archive and its budget
+            self.archive = self._stack.enter_context(open_archive(args)) \
+                if any(camera.mode == 'custom' for camera in cameras) else None
+            self.sessions = [self._stack.enter_context(ScanSession(camera, shared=self, camera=camera.camera))
+                             for camera in cameras]
+            # stop the scans still running before closing the sessions
+            self._stack.callback(self.reset)
+        except BaseException:
+            self._stack.close()
+            raise
+
+    def reset(self):
+        '''Stops the camera scans still running, after a timeout, and waits for them.'''
+        for session in self.sessions:
+            session.stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for session in self.sessions:
+            session.stop.clear()
+
+    def close(self):
+        self._stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._stack.__exit__(exc_type, exc, tb)
+
+
+def run_camera(session, statuses):
+    '''Runs the scan of one camera of a multi-camera session and records how it ended.'''
+    scan_start = time.time()
+    try:
+        SCAN_RUNNERS[session.args.mode](session)
+        status = 'Scan_Complete'
+    except (Exception, SystemExit) as e:
+        status = 'Scan_Stopped' if session.stop.is_set() else 'Scan_Error'
+        logging.error(f"Scan of camera {session.camera} ended with {status}: {e}")
+        session.reset()
+    session.plugin.publish('camera.scan.duration.sec', time.time()-scan_start, meta={'status': status})
+    statuses[session.camera] = status
+
+
+def run_cameras(multi):
+    '''
+    Runs the scans of all the cameras of `multi` at once, each on its own
+    thread, and waits for them. Publishes the shared upload and timing
+    metrics, and exits with an error when the scan of a camera failed.
+    '''
+    statuses = {}
+    multi._threads = [threading.Thread(target=run_camera, args=(session, statuses), name=f"camera-{session.camera}",
+                                       daemon=True) for session in multi.sessions]
+    for thread in multi._threads:
+        thread.start()
+    for thread in multi._threads:
+        thread.join()
+    multi._threads = []
+
+    multi.uploads.publish_metrics()
+    TRACER.publish(multi.plugin)
+    failed = [camera for camera, status in statuses.items() if status != 'Scan_Complete']
+    if failed:
+        sys.exit(f"Scan failed on cameras {', '.join(failed)}")
+    return statuses
+
+
+@timeout_decorator.timeout(DEFAULT_SCAN_TIMEOUT, use_signals=True)
+def scan_cameras(args, cameras):
+    '''Runs one scan of every camera of `cameras` concurrently.'''
+    with MultiCameraSession(args, cameras) as multi:
+        return run_cameras(multi)
+
+
+def camera_daemon(args, cameras, max_runs=None):
+    '''Resident mode of several cameras: runs `run_cameras` at every time of `args.schedule`.'''
+    return scan_daemon(args, max_runs=max_runs, open_session=lambda args: MultiCameraSession(args, cameras),
+                       runner=run_cameras)
@@ -0,0 +1,321 @@
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from MobotixTrace import traced
+
+# netCDF4 and xarray are imported on first use, they are slow to load
+
+# int16 packing of temperatures: 0.01 degC steps covering -77.67 to 577.67 degC,
+# the full range of the Mobotix thermal sensors
+INT16_SCALE = 0.01
+INT16_OFFSET = 250.0
+INT16_FILL = np.int16(-32768)
+
+DEFAULT_COMPLEVEL = 4
+
+NETCDF_PACKINGS = ['int16', 'float32']
+
+# netCDF-C and HDF5 are not thread-safe: every NetCDF file the plugin reads
+# or writes, through netCDF4 or xarray, is accessed holding this lock
+NETCDF_LOCK = threading.RLock()
+
+
+class LoopNetCDFWriter:
+    ''' Writes every thermal frame of a scan loop into one compressed NetCDF4 file.
+
+    Frames are appended as they arrive to `temperature(position, time, y, x)`,
+    one chunk per frame, compressed with zlib and the shuffle filter. The
+    first frame of a preset opens a new `position` row, further frames of
+    the same preset (`--frames` > 1) go along `time`. Temperatures are stored
+    as scaled int16 (0.01 degC) or float32.
+
+    Parameters:
+        path (str or Path): NetCDF file to create.
+        packing (str): 'int16' or 'float32'.
+        complevel (int): zlib compression level, 1-9.
+    '''
+    def __init__(self, path, packing='int16', complevel=DEFAULT_COMPLEVEL):
+        if packing not in NETCDF_PACKINGS:
+            raise ValueError(f"Unknown packing '{packing}'. Use {NETCDF_PACKINGS}")
+        self.path = Path(path)
+        self.packing = packing
+        self.complevel = complevel
+        self._rows = {}
+        # shared with every other NetCDF file, see NETCDF_LOCK
+        self._lock = NETCDF_LOCK
+        import netCDF4
+        with self._lock:
+            self._ds = netCDF4.Dataset(self.path, 'w', format='NETCDF4')
+            self._ds.createDimension('position', None)
+            self._ds.createDimension('time', None)
+            # small chunks for the per-position variables, the netCDF defaults
+            # for unlimited dimensions reserve megabytes
+            self._ds.createVariable('position', 'i4', ('position',), chunksizes=(32,))
+            self._ds.createVariable('direction', str, ('position',), chunksizes=(32,))
+            times = self._ds.createVariable('time', 'f8', ('position', 'time'), fill_value=np.nan, chunksizes=(32, 4))
+            times.units = 'seconds since 1970-01-01 00:00:00 UTC'
+
+    def _create_temperature(self, metadata):
+        height, width = int(metadata['height']), int(metadata['width'])
+        self._ds.createDimension('y', height)
+        self._ds.createDimension('x', width)
+        self._ds.createVariable('y', 'i4', ('y',))[:] = np.arange(height)
+        self._ds.createVariable('x', 'i4', ('x',))[:] = np.arange(width)
+
+        kwargs = dict(zlib=True, shuffle=True, complevel=self.complevel, chunksizes=(1, 1, height, width))
+        if self.packing == 'int16':
+            var = self._ds.createVariable('temperature', 'i2', ('position', 'time', 'y', 'x'),
+                                          fill_value=INT16_FILL, **kwargs)
+            var.scale_factor = INT16_SCALE
+            var.add_offset = INT16_OFFSET
+        else:
+            var = self._ds.createVariable('temperature', 'f4', ('position', 'time', 'y', 'x'),
+                                          fill_value=np.float32(np.nan), **kwargs)
+        var.units = 'degC'
+
+        for key, value in metadata.items():
+            self._ds.setncattr(key, value)
+        return var
+
+    @traced('convert.netcdf')
+    def append(self, position, metadata, temperature_data, time, direction=''):
+        '''
+        Appends one frame of preset `position` taken at `time` (seconds since
+        the epoch). Returns the (position, time) indices written.
+        '''
+        with self._lock:
+            if 'temperature' not in self._ds.variables:
+                self._create_temperature(metadata)
+            var = self._ds.variables['temperature']
+
+            row, count = self._rows.get(position, (len(self._rows), 0))
+            self._rows[position] = (row, count + 1)
+            if count == 0:
+                self._ds.variables['position'][row] = int(position)
+                self._ds.variables['direction'][row] = str(direction)
+
+            if self.packing == 'int16':
+                low = INT16_OFFSET + (np.iinfo(np.int16).min + 1) * INT16_SCALE
+                high = INT16_OFFSET + np.iinfo(np.int16).max * INT16_SCALE
+                temperature_data = np.clip(temperature_data, low, high)
+            var[row, count, :, :] = temperature_data
+            self._ds.variables['time'][row, count] = time
+            return row, count
+
+    def close(self):
+        '''Closes the file and returns its path.'''
+        with self._lock:
+            if self._ds.isopen():
+                self._ds.close()
+                logging.info("Loop NetCDF saved as %s", self.path)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# `<ns>_...` names written by the sampler, or the `_%Y-%m-%dT%H%M%S` stamp
+# custom scans put in the archived file names
+_NS_PREFIX = re.compile(r"^(\d{19})_")
+_TIME_STAMP = re.compile(r"_(\d{4}-\d{2}-\d{2}T\d{6})")
+_POSITION = re.compile(r"_(?:position|Pt)([A-Za-z0-9]+)")
+
+DEFAULT_MERGE_CHUNK = 8
+
+
+def archive_timestamp(name):
+    '''Returns the nanosecond timestamp encoded in an archived file name, or None.'''
+    m = _NS_PREFIX.match(name)
+    if m:
+        return int(m.group(1))
+    m = _TIME_STAMP.search(name)
+    if m:
+        stamp = datetime.datetime.strptime(m.group(1), '%Y-%m-%dT%H%M%S')
+        return int(stamp.timestamp()) * 1_000_000_000
+    return None
+
+
+def archive_position(name):
+    '''Returns the preset position (or direction) encoded in an archived file name, or None.'''
+    m = _POSITION.search(name)
+    return m.group(1) if m else None
+
+
+def list_archive(archive_dir, start=None, end=None, positions=None):
+    '''
+    Lists the NetCDF files of `archive_dir` as (timestamp, path) sorted by the
+    timestamp in their names (then by name). `start` and `end` (ns, inclusive) and
+    `positions` restrict the files returned.
+    '''
+    if positions is not None:
+        positions = {str(p) for p in positions}
+    files = []
+    with os.scandir(archive_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.nc'):
+                continue
+            timestamp = archive_timestamp(entry.name)
+            if timestamp is None:
+                logging.warning("No timestamp in %s, skipping", entry.name)
+                continue
+            if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                continue
+            if positions is not None and archive_position(entry.name) not in positions:
+                continue
+            files.append((timestamp, Path(entry.path)))
+    files.sort()
+    return files
+
+
+def _load_frames(path):
+    import xarray as xr
+    with xr.load_dataset(path, decode_times=False) as ds:
+        # files merged before, like the daily archive files, name the position and source file of each frame
+        positions = [str(p) for p in ds.position.values] if 'position' in ds and ds.position.dims == ('time',) else None
+        sources = [str(s) for s in ds.source.values] if 'source' in ds and ds.source.dims == ('time',) else None
+        return (ds.temperature.values.astype(np.float32), np.atleast_1d(ds.time.values), dict(ds.attrs), positions,
+                sources)
+
+
+class NetCDFMerger:
+    ''' Merges archived per-frame NetCDF files into one file along `time`.
+
+    Input files are read one after the other and appended to the output
+    before the next one is read, so memory is bound by one file whatever the
+    size of the archive; netCDF-C and HDF5 are not thread-safe, the reads
+    are not spread over threads. The `source` of each output frame is the
+    per-frame file it was archived as, also when it comes from a daily file
+    that packed it. A JSON manifest next to the output records the merged
+    sources, it is written every `chunk` files and when the merge stops on
+    an error; merging again only appends frames whose source is not in it
+    yet, so frames compacted into a daily file since are not merged twice.
+    Files that cannot be read are logged and skipped.
+
+    Parameters:
+        out_filename (str or Path): Merged NetCDF file, created or appended to.
+        chunk (int): Input files merged between two syncs of the output and manifest.
+        complevel (int): zlib compression level of the output.
+    '''
+    def __init__(self, out_filename, chunk=DEFAULT_MERGE_CHUNK, complevel=DEFAULT_COMPLEVEL):
+        self.out_filename = Path(out_filename)
+        self.manifest_path = self.out_filename.with_name(self.out_filename.name + '.manifest.json')
+        self.chunk = chunk
+        self.complevel = complevel
+
+    def sources(self):
+        '''Returns the names of the source files merged so far.'''
+        return self._read_manifest()
+
+    def _read_manifest(self):
+        if not (self.manifest_path.exists() and self.out_filename.exists()):
+            return set()
+        with self.manifest_path.open() as f:
+            return set(json.load(f)['files'])
+
+    def _write_manifest(self, merged):
+        tmp = self.manifest_path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump({'files': sorted(merged)}, f)
+        os.replace(tmp, self.manifest_path)
+
+    def _create(self, shape, attrs):
+        height, width = shape
+        import netCDF4
+        ds = netCDF4.Dataset(self.out_filename, 'w', format='NETCDF4')
+        ds.createDimension('time', None)
+        ds.createDimension('y', height)
+        ds.createDimension('x', width)
+        times = ds.createVariable('time', 'f8', ('time',), chunksizes=(1024,))
+        times.units = 'seconds since 1970-01-01 00:00:00 UTC'
+        ds.createVariable('source', str, ('time',), chunksizes=(1024,))
+        ds.createVariable('position', str, ('time',), chunksizes=(1024,))
+        temperature = ds.createVariable('temperature', 'f4', ('time', 'y', 'x'), zlib=True, shuffle=True,
+                                        complevel=self.complevel, chunksizes=(1, height, width))
+        temperature.units = 'degC'
+        for key, value in attrs.items():
+            ds.setncattr(key, value)
+        return ds
+
+    def merge(self, files, start=None, end=None, positions=None):
+        '''
+        Appends the frames of the (timestamp, path) `files` not merged yet,
+        in the order given. Files holding several frames, like the daily
+        archive files, only contribute the frames taken within [`start`,
+        `end`] (ns) at `positions`. Returns the names of the files frames were
+        appended from.
+        '''
+        if positions is not None:
+            positions = {str(p) for p in positions}
+        merged = self._read_manifest()
+        pending = [path for _, path in files if path.name not in merged]
+        if not pending:
+            logging.info("Nothing new to merge into %s", self.out_filename)
+            return []
+
+        import netCDF4
+        with NETCDF_LOCK:
+            ds = netCDF4.Dataset(self.out_filename, 'a') if merged else None
+        added = []
+        try:
+            for i in range(0, len(pending), self.chunk):
+                batch = pending[i:i + self.chunk]
+                for path in batch:
+                    with NETCDF_LOCK:
+                        try:
+                            temperature, times, attrs, frame_positions, sources = _load_frames(path)
+                        except Exception as e:
+                            logging.warning("Skipping %s, cannot read it: %s", path.name, e)
+                            continue
+                        if ds is None:
+                            ds = self._create(temperature.shape[-2:], attrs)
+                        var = ds.variables['temperature']
+                        if temperature.shape[-2:] != var.shape[-2:]:
+                            logging.warning("Skipping %s, resolution %s differs from %s",
+                                            path.name, temperature.shape[-2:], var.shape[-2:])
+                            continue
+                        row = var.shape[0]
+                        frames = temperature.reshape(-1, *var.shape[-2:])
+                        if sources is None:
+                            sources = [path.name] * len(frames)
+                        if frame_positions is None:
+                            frame_positions = [archive_position(path.name) or ''] * len(frames)
+                            keep = range(len(frames))
+                        else:
+                            keep = [j for j in range(len(frames))
+                                    if (start is None or times[j] * 1e9 >= start)
+                                    and (end is None or times[j] * 1e9 <= end)
+                                    and (positions is None or frame_positions[j] in positions)]
+                        # frames merged before, maybe from the file a daily file packed them from
+                        keep = [j for j in keep if sources[j] not in merged]
+                        if not keep:
+                            continue
+                        frames, times = frames[keep], times[keep]
+                        var[row:row + len(frames)] = frames
+                        ds.variables['time'][row:row + len(frames)] = times
+                        for k, j in enumerate(keep):
+                            ds.variables['source'][row + k] = sources[j]
+                            ds.variables['position'][row + k] = frame_positions[j]
+                        merged.update(sources[j] for j in keep)
+                        added.append(path.name)
+                if ds is not None:
+                    with NETCDF_LOCK:
+                        ds.sync()
+                    self._write_manifest(merged)
+        finally:
+            # the frames appended before an error are on disk, the manifest must list them
+            if ds is not None:
+                with NETCDF_LOCK:
+                    ds.close()
+                self._write_manifest(merged)
+        logging.info("Merged %d files into %s", len(added), self.out_filename)
+        return added
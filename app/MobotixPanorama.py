@@ -0,0 +1,331 @@
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from MobotixImaging import read_jpeg
+from MobotixNetCDF import DEFAULT_COMPLEVEL, INT16_FILL, INT16_OFFSET, INT16_SCALE, NETCDF_LOCK, NETCDF_PACKINGS
+from MobotixPresets import move_angle
+from MobotixTrace import traced
+
+# horizontal field of view of the thermal sensor (deg), seeds the shift between shots
+DEFAULT_PANORAMA_FOV = 45.0
+
+# fraction of the frame searched for the shift around the expected one
+DEFAULT_PANORAMA_SEARCH = 0.25
+
+# pixels searched across the move axis, for the wobble of the head
+DEFAULT_PANORAMA_DRIFT = 4
+
+# pairs of shots correlating less than this keep the expected shift
+DEFAULT_PANORAMA_MIN_CORRELATION = 0.8
+
+# smallest overlap between shots, as a fraction of the frame, worth correlating
+MIN_OVERLAP = 0.1
+
+# the visible frames are aligned at about this width
+VISIBLE_ALIGN_WIDTH = 320
+
+# (dy, dx) of the next shot in the mosaic, per pixel moved
+MOVE_AXES = {'right': (0, 1), 'left': (0, -1), 'up': (-1, 0), 'down': (1, 0)}
+
+Panorama = namedtuple('Panorama', ['temperature', 'visible', 'positions', 'times', 'metadata', 'fallbacks'])
+
+
+def angle_shift(direction, angle, shape, fov=DEFAULT_PANORAMA_FOV):
+    '''
+    Returns the (dy, dx) pixels between two frames of a `shape` (height,
+    width) sensor with a horizontal field of view of `fov` degrees, when
+    the head turns `angle` degrees in `direction`.
+    '''
+    height, width = shape
+    pixels = angle * width / fov
+    dy, dx = MOVE_AXES[direction]
+    return dy * pixels, dx * pixels
+
+
+def expected_shift(direction, speed, duration, shape, fov=DEFAULT_PANORAMA_FOV, table=None):
+    '''
+    Returns the (dy, dx) pixels between two shots (see `angle_shift`) when
+    the head moves in `direction` at `speed` for `duration` seconds, with
+    the angular velocities of the speed `table` (see `move_angle`).
+    '''
+    return angle_shift(direction, move_angle(direction, speed, duration, table=table), shape, fov=fov)
+
+
+def _fft_size(n):
+    # the next size made of 2, 3, 5 and 7, which numpy transforms quickly
+    while True:
+        m = n
+        for p in (2, 3, 5, 7):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def cross_correlation(first, second):
+    '''
+    Returns the normalized cross-correlation of the frame pairs (`first[i]`,
+    `second[i]`), arrays of (..., height, width), for every shift at once,
+    and the pixels the frames share at each shift. Entry (dy, dx), modulo
+    the size of the result, is the correlation coefficient of the overlap
+    of the pair when `second[y, x]` shows the scene of `first[y + dy, x + dx]`.
+    Each sum over the overlap is a product of zero-padded FFTs, so the
+    correlation only uses the pixels the frames share, whatever the shift.
+    '''
+    first = np.asarray(first, dtype=np.float64)
+    second = np.asarray(second, dtype=np.float64)
+    height, width = first.shape[-2:]
+    shape = (_fft_size(2 * height), _fft_size(2 * width))
+    first = first - first.mean(axis=(-2, -1), keepdims=True)
+    second = second - second.mean(axis=(-2, -1), keepdims=True)
+
+    def correlate(a, b):
+        # sum over x of a[x + d] * b[x] for every shift d
+        return np.fft.irfft2(a * np.conj(b), s=shape)
+
+    ones = np.fft.rfft2(np.ones((height, width)), s=shape)
+    f1, f2 = np.fft.rfft2(first, s=shape), np.fft.rfft2(second, s=shape)
+    overlap = np.rint(correlate(ones, ones))
+    n = np.maximum(overlap, 1)
+    sum1, sum2 = correlate(f1, ones), correlate(ones, f2)
+    var1 = correlate(np.fft.rfft2(first ** 2, s=shape), ones) - sum1 ** 2 / n
+    var2 = correlate(ones, np.fft.rfft2(second ** 2, s=shape)) - sum2 ** 2 / n
+    covariance = correlate(f1, f2) - sum1 * sum2 / n
+    return covariance / np.sqrt(np.maximum(var1 * var2, 1e-12)), overlap
+
+
+def estimate_offsets(frames, prior, search=DEFAULT_PANORAMA_SEARCH, drift=DEFAULT_PANORAMA_DRIFT,
+                     min_correlation=DEFAULT_PANORAMA_MIN_CORRELATION):
+    '''
+    Estimates the (dy, dx) offset of each frame from the one before it: the
+    peak of the normalized cross-correlation of each pair, within `search`
+    of the frame size of the `prior` (dy, dx) along the move axis and
+    `drift` pixels across it, among the shifts leaving enough overlap. The
+    prior is the same for every pair, or one per pair (len(frames) - 1, 2)
+    when the frames are not evenly spaced. All the pairs are correlated at
+    once. Pairs whose peak is below `min_correlation` keep the prior.
+
+    Returns the integer offsets (len(frames) - 1, 2) and a mask of the pairs
+    that fell back to the prior.
+    '''
+    frames = np.asarray(frames, dtype=np.float32)
+    pairs = len(frames) - 1
+    height, width = frames.shape[-2:]
+    if pairs < 1:
+        return np.zeros((0, 2), dtype=int), np.ones(0, dtype=bool)
+    offsets = np.array(np.broadcast_to(np.rint(prior).astype(int), (pairs, 2)))
+
+    correlation, overlap = cross_correlation(frames[:-1], frames[1:])
+    along_y = bool(np.any(offsets[:, 0]))
+    ry = int(search * height) if along_y else drift
+    rx = drift if along_y else int(search * width)
+    # candidate shifts of each pair around its prior
+    dy = offsets[:, :1] + np.arange(-ry, ry + 1)
+    dx = offsets[:, 1:] + np.arange(-rx, rx + 1)
+    iy, ix = (dy % correlation.shape[-2])[:, :, None], (dx % correlation.shape[-1])[:, None, :]
+    valid = (np.abs(dy) < height)[:, :, None] & (np.abs(dx) < width)[:, None, :] & \
+        (overlap[iy, ix] >= MIN_OVERLAP * height * width)
+    window = np.where(valid, correlation[np.arange(pairs)[:, None, None], iy, ix], -1).reshape(pairs, -1)
+    best = window.argmax(axis=1)
+    by, bx = np.unravel_index(best, (dy.shape[1], dx.shape[1]))
+
+    rows = np.arange(pairs)
+    fallback = window[rows, best] < min_correlation
+    found = np.stack([dy[rows, by], dx[rows, bx]], axis=1)
+    offsets[~fallback] = found[~fallback]
+    return offsets, fallback
+
+
+def _ramp(covered, axis):
+    # weight of a new frame over the pixels already in the mosaic: rising
+    # from 0 at the side of the mosaic to 1 at the far end of the overlap
+    lines = covered.any(axis=1 - axis)
+    n = len(lines)
+    lead = int(np.argmin(lines)) if not lines.all() else n
+    trail = int(np.argmin(lines[::-1])) if not lines.all() else 0
+    weight = np.ones(n, dtype=np.float32)
+    if lead:
+        weight[:lead] = np.linspace(0, 1, lead + 2, dtype=np.float32)[1:-1]
+    if trail:
+        weight[n - trail:] = np.linspace(1, 0, trail + 2, dtype=np.float32)[1:-1]
+    weight = weight[:, None] if axis == 0 else weight[None, :]
+    return np.where(covered, weight, 1).astype(np.float32)
+
+
+def blend(frames, positions, axis=1, fill=np.nan):
+    '''
+    Pastes `frames` (height, width[, channels]) at their top-left
+    `positions` (y, x) into one mosaic, in order. Where a frame overlaps the
+    mosaic it fades in linearly along `axis`, the move axis, so the seams do
+    not show. Pixels no frame covers are `fill`.
+    '''
+    positions = np.asarray(positions, dtype=int)
+    positions = positions - positions.min(axis=0)
+    shape = np.max([p + f.shape[:2] for p, f in zip(positions, frames)], axis=0)
+    first = np.asarray(frames[0])
+    mosaic = np.full(tuple(shape) + first.shape[2:], fill, dtype=np.float32)
+    covered = np.zeros(tuple(shape), dtype=bool)
+    for frame, (y, x) in zip(frames, positions):
+        h, w = frame.shape[:2]
+        region = (slice(y, y + h), slice(x, x + w))
+        weight = _ramp(covered[region], axis)
+        if frame.ndim == 3:
+            weight = weight[..., None]
+        old = np.nan_to_num(mosaic[region]) if np.isnan(fill) else mosaic[region]
+        mosaic[region] = old * (1 - weight) + np.asarray(frame, dtype=np.float32) * weight
+        covered[region] = True
+    return mosaic
+
+
+class PanoramaSweep:
+    ''' The shots of one custom-scan sweep, assembled into a panorama.
+
+    Pipeline workers `add` the thermal frame and visible image of each shot
+    as they are converted, in any order. `assemble` then estimates the
+    offset between consecutive thermal frames by normalized
+    cross-correlation, seeded by the shift the move of the head should
+    cause, and blends them into one mosaic. Shots added with the angle the
+    head turned since the start of the sweep, as in a continuous sweep, are
+    seeded by the angle between them. The visible images are aligned the same way on greyscale
+    thumbnails, seeded by the thermal offsets, and blended into a matching
+    visible mosaic.
+
+    Parameters:
+        direction (str): Direction of the move between shots.
+        speed (int): Speed of the move, 1 to 5 as for `MobotixPT.move`.
+        duration (float): Seconds of the move.
+        fov (float): Horizontal field of view of the thermal sensor (deg).
+        search (float): Fraction of the frame searched around the expected shift.
+        table (dict): Angular velocity of each speed, see `MobotixPresets.move_angle`.
+    '''
+    def __init__(self, direction, speed, duration, fov=DEFAULT_PANORAMA_FOV, search=DEFAULT_PANORAMA_SEARCH,
+                 table=None):
+        self.direction = direction
+        self.speed = speed
+        self.duration = duration
+        self.fov = fov
+        self.search = search
+        self.table = table
+        self._lock = threading.Lock()
+        self._thermal = {}
+        self._visible = {}
+
+    def add(self, shot, timestamp, temperature, metadata, angle=None):
+        '''
+        Adds the thermal frame of a shot, the first one when a shot has
+        several, with the `angle` (deg) turned since the start of the sweep
+        when known.
+        '''
+        with self._lock:
+            self._thermal.setdefault(shot, (timestamp, np.array(temperature, dtype=np.float32), dict(metadata),
+                                            angle))
+
+    def add_visible(self, shot, jpeg):
+        '''Adds the visible image (JPEG path) of a shot. An unreadable image leaves the sweep without visible panorama.'''
+        try:
+            image = read_jpeg(jpeg)
+        except Exception as e:
+            logging.warning(f"Cannot read the visible image {jpeg}: {e}")
+            return
+        with self._lock:
+            self._visible.setdefault(shot, image)
+
+    def __len__(self):
+        return len(self._thermal)
+
+    def _visible_mosaic(self, shots, thermal_positions, thermal_shape):
+        images = [self._visible.get(shot) for shot in shots]
+        if any(image is None for image in images) or len({image.shape for image in images}) > 1:
+            logging.warning("Visible images missing or of different sizes, no visible panorama")
+            return None
+        height, width = images[0].shape[:2]
+        scale = np.array([height / thermal_shape[0], width / thermal_shape[1]])
+        step = max(width // VISIBLE_ALIGN_WIDTH, 1)
+        thumbs = np.stack([image[::step, ::step].mean(axis=2) for image in images])
+        prior = np.diff(thermal_positions, axis=0) * scale / step
+        offsets = np.array([estimate_offsets(thumbs[i:i + 2], prior[i], search=self.search)[0][0]
+                            for i in range(len(thumbs) - 1)]).reshape(-1, 2)
+        positions = np.vstack([[0, 0], np.cumsum(offsets * step, axis=0)])
+        mosaic = blend(images, positions, axis=self._axis(), fill=0)
+        return np.clip(np.rint(mosaic), 0, 255).astype(np.uint8)
+
+    def _axis(self):
+        return 0 if MOVE_AXES[self.direction][0] else 1
+
+    @traced('panorama')
+    def assemble(self):
+        '''Returns the `Panorama` of the shots added, None without any.'''
+        with self._lock:
+            shots = sorted(self._thermal)
+        if not shots:
+            return None
+        times = [self._thermal[shot][0] for shot in shots]
+        frames = [self._thermal[shot][1] for shot in shots]
+        metadata = self._thermal[shots[0]][2]
+        if len({frame.shape for frame in frames}) > 1:
+            raise ValueError("The thermal frames of the sweep differ in size")
+
+        angles = [self._thermal[shot][3] for shot in shots]
+        if None in angles:
+            prior = expected_shift(self.direction, self.speed, self.duration, frames[0].shape, fov=self.fov,
+                                   table=self.table)
+        else:
+            prior = np.stack(angle_shift(self.direction, np.diff(angles), frames[0].shape, fov=self.fov), axis=1)
+        offsets, fallback = estimate_offsets(frames, prior, search=self.search)
+        if fallback.any():
+            logging.info("No clear overlap between %d of %d shot pairs, using the expected shift",
+                         fallback.sum(), len(fallback))
+        positions = np.vstack([[0, 0], np.cumsum(offsets, axis=0)]).astype(int)
+        temperature = blend(frames, positions, axis=self._axis())
+        visible = self._visible_mosaic(shots, positions, frames[0].shape)
+        return Panorama(temperature, visible, positions - positions.min(axis=0), times, metadata,
+                        int(fallback.sum()))
+
+
+@traced('convert.netcdf')
+def write_panorama_netcdf(path, panorama, attrs={}, packing='int16', complevel=DEFAULT_COMPLEVEL):
+    '''
+    Writes the thermal mosaic of a `Panorama` as a compressed NetCDF4 file,
+    with the capture time and the mosaic position of every shot.
+    '''
+    if packing not in NETCDF_PACKINGS:
+        raise ValueError(f"Unknown packing '{packing}'. Use {NETCDF_PACKINGS}")
+    import netCDF4
+    height, width = panorama.temperature.shape
+    with NETCDF_LOCK, netCDF4.Dataset(path, 'w', format='NETCDF4') as ds:
+        ds.createDimension('shot', len(panorama.times))
+        ds.createDimension('y', height)
+        ds.createDimension('x', width)
+        ds.createVariable('y', 'i4', ('y',))[:] = np.arange(height)
+        ds.createVariable('x', 'i4', ('x',))[:] = np.arange(width)
+        times = ds.createVariable('time', 'f8', ('shot',))
+        times.units = 'seconds since 1970-01-01 00:00:00 UTC'
+        times[:] = np.asarray(panorama.times) / 1e9
+        ds.createVariable('shot_y', 'i4', ('shot',))[:] = panorama.positions[:, 0]
+        ds.createVariable('shot_x', 'i4', ('shot',))[:] = panorama.positions[:, 1]
+
+        kwargs = dict(zlib=True, shuffle=True, complevel=complevel, chunksizes=(height, min(width, 1024)))
+        data = panorama.temperature
+        if packing == 'int16':
+            var = ds.createVariable('temperature', 'i2', ('y', 'x'), fill_value=INT16_FILL, **kwargs)
+            var.scale_factor = INT16_SCALE
+            var.add_offset = INT16_OFFSET
+            low = INT16_OFFSET + (np.iinfo(np.int16).min + 1) * INT16_SCALE
+            high = INT16_OFFSET + np.iinfo(np.int16).max * INT16_SCALE
+            # netCDF4 packs the values under the mask too
+            uncovered = ~np.isfinite(data)
+            data = np.ma.array(np.where(uncovered, INT16_OFFSET, np.clip(data, low, high)), mask=uncovered)
+        else:
+            var = ds.createVariable('temperature', 'f4', ('y', 'x'), fill_value=np.float32(np.nan), **kwargs)
+        var.units = 'degC'
+        var[:, :] = data
+
+        for key, value in {**panorama.metadata, **attrs}.items():
+            ds.setncattr(key, value)
+        ds.setncattr('width', str(width))
+        ds.setncattr('height', str(height))
+    return path
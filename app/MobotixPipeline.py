@@ -0,0 +1,267 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+# positions waiting for a worker before the scan blocks on submit()
+DEFAULT_MAX_PENDING = 2
+
+
+class ScanPipeline:
+    ''' Runs the conversion and upload of captured positions on worker threads.
+
+    Jobs go through a bounded queue, so at most `max_pending` positions wait
+    on disk while the camera moves on to the next one; when the queue is full
+    `submit` blocks the scan until a worker catches up. With `workers=0` jobs
+    run inline in `submit`, which gives the sequential behaviour.
+
+    Parameters:
+        process (callable): Function run for each submitted job.
+        workers (int): Number of worker threads.
+        max_pending (int): Maximum number of queued jobs.
+    '''
+    def __init__(self, process, workers=1, max_pending=DEFAULT_MAX_PENDING):
+        self.process = process
+        self.workers = workers
+        self._jobs = queue.Queue(maxsize=max(max_pending, 1))
+        self._lock = threading.Lock()
+        self._results = []
+        self._errors = []
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self, job):
+        try:
+            result = self.process(*job)
+        except Exception as e:
+            logging.exception("Pipeline job failed: %s", e)
+            with self._lock:
+                self._errors.append(e)
+        else:
+            with self._lock:
+                self._results.append(result)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                self._run(job)
+            finally:
+                self._jobs.task_done()
+
+    def submit(self, *job):
+        '''Queues a job, blocking while `max_pending` jobs are waiting.'''
+        if not self._threads:
+            self._run(job)
+        else:
+            self._jobs.put(job)
+
+    def join(self):
+        '''
+        Waits for all submitted jobs and returns their results. The first
+        error raised by a job since the last join is re-raised.
+        '''
+        self._jobs.join()
+        with self._lock:
+            results, errors = self._results, self._errors
+            self._results, self._errors = [], []
+        if errors:
+            raise errors[0]
+        return results
+
+    def close(self):
+        '''Stops the workers once the queued jobs are done.'''
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class SharedPipeline:
+    ''' Worker threads shared by the scan pipelines of several cameras.
+
+    Each camera submits its jobs through its own `PipelineClient`, which
+    queues at most `max_pending` of them, so a camera that captures faster
+    than the workers convert blocks on its own backlog only. Workers take
+    the next job from the cameras in turn, so every camera gets a fair share
+    of the workers whatever the length of the other queues. With `workers=0`
+    jobs run inline in `submit`.
+
+    Parameters:
+        workers (int): Number of worker threads.
+        max_pending (int): Maximum number of queued jobs per camera.
+    '''
+    def __init__(self, workers=1, max_pending=DEFAULT_MAX_PENDING):
+        self.max_pending = max(max_pending, 1)
+        self._cond = threading.Condition()
+        self._clients = []
+        self._next = 0
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def client(self, process, name=None):
+        '''Returns a `ScanPipeline` look-alike running `process` on the shared workers.'''
+        client = PipelineClient(self, process, name)
+        with self._cond:
+            self._clients.append(client)
+        return client
+
+    def _remove(self, client):
+        with self._cond:
+            self._clients.remove(client)
+            self._next = 0
+
+    def _take(self):
+        # round robin over the cameras, starting after the last one served
+        for i in range(len(self._clients)):
+            client = self._clients[(self._next + i) % len(self._clients)]
+            if client._queue:
+                self._next = (self._next + i + 1) % len(self._clients)
+                client._running += 1
+                return client, client._queue.popleft()
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                task = self._take()
+                while task is None and not self._closed:
+                    self._cond.wait()
+                    task = self._take()
+                if task is None:
+                    return
+                # a queue slot freed up for submit
+                self._cond.notify_all()
+            client, (job, queued) = task
+            try:
+                client._run(job, queued)
+            finally:
+                with self._cond:
+                    client._running -= 1
+                    self._cond.notify_all()
+
+    def close(self):
+        '''Stops the workers once the queued jobs of every camera are done.'''
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PipelineClient:
+    ''' The pipeline of one camera on a `SharedPipeline`.
+
+    It has the `submit`, `join` and `close` of `ScanPipeline` and also keeps
+    the number of jobs of the camera, the time they waited for a worker and
+    the time workers spent on them.
+    '''
+    def __init__(self, pool, process, name=None):
+        self.pool = pool
+        self.process = process
+        self.name = name
+        self._queue = deque()
+        self._running = 0
+        self._results = []
+        self._errors = []
+        self._jobs = 0
+        self._wait = 0.0
+        self._busy = 0.0
+
+    def _run(self, job, queued):
+        start = time.monotonic()
+        try:
+            result = self.process(*job)
+        except Exception as e:
+            logging.exception("Pipeline job of %s failed: %s", self.name, e)
+            result, error = None, e
+        else:
+            error = None
+        with self.pool._cond:
+            if error is None:
+                self._results.append(result)
+            else:
+                self._errors.append(error)
+            self._jobs += 1
+            self._wait += start - queued
+            self._busy += time.monotonic() - start
+
+    def submit(self, *job):
+        '''Queues a job, blocking while `max_pending` jobs of this camera are waiting.'''
+        if not self.pool._threads:
+            self._run(job, time.monotonic())
+            return
+        with self.pool._cond:
+            while len(self._queue) >= self.pool.max_pending:
+                self.pool._cond.wait()
+            self._queue.append((job, time.monotonic()))
+            self.pool._cond.notify_all()
+
+    def join(self):
+        '''
+        Waits for the jobs of this camera and returns their results. The first
+        error raised by a job since the last join is re-raised.
+        '''
+        with self.pool._cond:
+            while self._queue or self._running:
+                self.pool._cond.wait()
+            results, errors = self._results, self._errors
+            self._results, self._errors = [], []
+        if errors:
+            raise errors[0]
+        return results
+
+    def metrics(self, reset=True):
+        '''Returns the jobs done, and the seconds they waited and ran, since the last reset.'''
+        with self.pool._cond:
+            metrics = {'jobs': self._jobs, 'wait': self._wait, 'busy': self._busy}
+            if reset:
+                self._jobs, self._wait, self._busy = 0, 0.0, 0.0
+        return metrics
+
+    def publish_metrics(self, plugin, meta={}):
+        '''
+        Publishes `pipeline.jobs`, the mean `pipeline.wait.sec` of a job for a
+        worker and the `pipeline.busy.sec` of the workers on this camera.
+        '''
+        metrics = self.metrics()
+        plugin.publish('pipeline.jobs', metrics['jobs'], meta=meta)
+        if metrics['jobs']:
+            plugin.publish('pipeline.wait.sec', metrics['wait'] / metrics['jobs'], meta=meta)
+        plugin.publish('pipeline.busy.sec', metrics['busy'], meta=meta)
+        return metrics
+
+    def close(self):
+        '''Waits for the queued jobs of this camera and leaves the pool.'''
+        with self.pool._cond:
+            while self._queue or self._running:
+                self.pool._cond.wait()
+        self.pool._remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,171 @@
+"""
+Geometry of the 32 camera presets.
+
+The presets form the grid used by `calculate_pt`: 8 compass directions,
+45 degrees apart, each with 4 tilt rows (S, H, B, G). Preset `p` looks at
+direction `(p - 1) // 4` and tilt row `(p - 1) % 4`.
+"""
+
+import numpy as np
+
+NUM_PAN = 8
+NUM_TILT = 4
+
+PAN_STEP_DEG = 360 / NUM_PAN
+TILT_STEP_DEG = 15.0
+
+# approximate PT head speeds when moving between presets (deg/s) and the
+# fixed cost of starting and stopping a move (s)
+DEFAULT_PAN_SPEED = 60.0
+DEFAULT_TILT_SPEED = 30.0
+DEFAULT_MOVE_OVERHEAD = 0.5
+
+# highest Pelco-D speed byte below turbo (0xFF)
+PELCO_MAX_SPEED = 0x3F
+
+# Pelco-D speed byte sent by `MobotixPT.move` for each speed
+MOVE_SPEED_BYTES = {1: 0x01, 2: 0x0F, 3: 0x1F, 4: 0x2F, 5: 0xFF}
+
+# axis turned by each move direction
+MOVE_AXIS = {'right': 'pan', 'left': 'pan', 'up': 'tilt', 'down': 'tilt'}
+
+
+def preset_grid(pt_id):
+    '''Returns the (pan, tilt) grid indices of a preset.'''
+    if not 1 <= pt_id <= NUM_PAN * NUM_TILT:
+        raise ValueError(f"Invalid preset ID {pt_id}.")
+    return (pt_id - 1) // NUM_TILT, (pt_id - 1) % NUM_TILT
+
+
+def angular_distance(from_pt, to_pt):
+    '''Returns the pan and tilt angles (deg) travelled between two presets.'''
+    from_pan, from_tilt = preset_grid(from_pt)
+    to_pan, to_tilt = preset_grid(to_pt)
+    steps = abs(to_pan - from_pan) % NUM_PAN
+    pan_steps = min(steps, NUM_PAN - steps)
+    return pan_steps * PAN_STEP_DEG, abs(to_tilt - from_tilt) * TILT_STEP_DEG
+
+
+def default_speed_table(pan_speed=DEFAULT_PAN_SPEED, tilt_speed=DEFAULT_TILT_SPEED):
+    '''
+    Returns the estimated angular velocity (deg/s) of each `MobotixPT.move`
+    speed (1 to 5) per axis, {'pan': {speed: deg/s}, 'tilt': {...}}, the
+    speed byte scaling the full speed of the head linearly.
+    '''
+    def fraction(value):
+        return 1.0 if value == 0xFF else min(value, PELCO_MAX_SPEED) / PELCO_MAX_SPEED
+    return {axis: {speed: full * fraction(value) for speed, value in MOVE_SPEED_BYTES.items()}
+            for axis, full in (('pan', pan_speed), ('tilt', tilt_speed))}
+
+
+def move_angle(direction, speed, duration, pan_speed=DEFAULT_PAN_SPEED, tilt_speed=DEFAULT_TILT_SPEED, table=None):
+    '''
+    Estimates the degrees turned by a `MobotixPT.move` in `direction` at
+    `speed` (1 to 5) for `duration` seconds, with the angular velocities of
+    a speed `table` (see `default_speed_table`), measured by
+    `MobotixSweep.calibrate_speeds` or estimated from the full speeds.
+    '''
+    table = table or default_speed_table(pan_speed, tilt_speed)
+    return table[MOVE_AXIS[direction]][int(speed)] * duration
+
+
+def travel_time(from_pt, to_pt, pan_speed=DEFAULT_PAN_SPEED, tilt_speed=DEFAULT_TILT_SPEED,
+                overhead=DEFAULT_MOVE_OVERHEAD):
+    '''
+    Estimates the seconds needed to move between two presets. Pan and tilt
+    run at the same time, so the slower axis sets the travel time.
+    '''
+    if from_pt == to_pt:
+        return 0.0
+    pan, tilt = angular_distance(from_pt, to_pt)
+    return max(pan / pan_speed, tilt / tilt_speed) + overhead
+
+
+def travel_matrix(presets, pan_speed=DEFAULT_PAN_SPEED, tilt_speed=DEFAULT_TILT_SPEED,
+                  overhead=DEFAULT_MOVE_OVERHEAD):
+    '''Returns the `travel_time` between every pair of `presets` as an array.'''
+    pan, tilt = np.array([preset_grid(p) for p in presets]).T
+    pan_steps = np.abs(pan[:, None] - pan[None, :]) % NUM_PAN
+    pan_deg = np.minimum(pan_steps, NUM_PAN - pan_steps) * PAN_STEP_DEG
+    tilt_deg = np.abs(tilt[:, None] - tilt[None, :]) * TILT_STEP_DEG
+    times = np.maximum(pan_deg / pan_speed, tilt_deg / tilt_speed) + overhead
+    times[(pan_deg == 0) & (tilt_deg == 0)] = 0
+    return times
+
+
+def tour_time(order, start=None):
+    '''Estimated seconds to visit `order`, starting from preset `start` if known.'''
+    path = ([start] if start is not None else []) + list(order)
+    return sum(travel_time(a, b) for a, b in zip(path, path[1:]))
+
+
+def _path_cost(path, cost):
+    return cost[path[:-1], path[1:]].sum()
+
+
+def _nearest_neighbour(cost, first):
+    path = [first]
+    left = set(range(len(cost))) - {first}
+    while left:
+        nxt = min(left, key=lambda j: cost[path[-1], j])
+        path.append(nxt)
+        left.remove(nxt)
+    return path
+
+
+def _improve(path, cost):
+    '''
+    Local search on an open path: 2-opt segment reversals and or-opt moves of
+    up to 3 consecutive presets, until neither shortens the path. The first
+    node stays in place.
+    '''
+    path = np.array(path)
+    best = _path_cost(path, cost)
+    first = 1
+    improved = True
+    while improved:
+        improved = False
+        for i in range(first, len(path) - 1):
+            for j in range(i + 1, len(path)):
+                candidate = path.copy()
+                candidate[i:j + 1] = candidate[i:j + 1][::-1]
+                candidate_cost = _path_cost(candidate, cost)
+                if candidate_cost < best - 1e-9:
+                    path, best, improved = candidate, candidate_cost, True
+        for length in (1, 2, 3):
+            for i in range(first, len(path) - length + 1):
+                segment = path[i:i + length]
+                rest = np.concatenate([path[:i], path[i + length:]])
+                for k in range(first, len(rest) + 1):
+                    for piece in (segment, segment[::-1]):
+                        candidate = np.concatenate([rest[:k], piece, rest[k:]])
+                        candidate_cost = _path_cost(candidate, cost)
+                        if candidate_cost < best - 1e-9:
+                            path, best, improved = candidate, candidate_cost, True
+                            break
+                    else:
+                        continue
+                    break
+    return list(path)
+
+
+def optimize_order(presets, start=None):
+    '''
+    Reorders `presets` to minimise the estimated PT travel time, with a
+    nearest-neighbour tour improved by 2-opt and or-opt moves. The tour
+    starts next to `start`, the preset where the camera currently is (where
+    the last loop finished); without it the tour starts at the first given
+    preset. The preset IDs themselves are kept.
+    '''
+    presets = list(presets)
+    if len(presets) < 2:
+        return presets
+
+    if start is not None:
+        cost = travel_matrix([start] + presets)
+        path = _improve(_nearest_neighbour(cost, 0), cost)
+        return [presets[i - 1] for i in path[1:]]
+
+    cost = travel_matrix(presets)
+    path = _improve(_nearest_neighbour(cost, 0), cost)
+    return [presets[i] for i in path]
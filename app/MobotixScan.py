@@ -3,18 +3,33 @@ import argparse
 import logging
 import os
 import sys
-import shutil
+import threading
 import time
 import datetime
+from contextlib import ExitStack, closing
+from functools import partial
 from pathlib import Path
 from select import select
 import timeout_decorator
 
-import xarray as xr
 
 from waggle.plugin import Plugin
 
+from MobotixArchive import Archive, parse_size
 from MobotixControl import MobotixPT, MobotixImager
+from MobotixNetCDF import LoopNetCDFWriter, NetCDFMerger
+from MobotixFrameStore import FrameStore
+from MobotixGate import ChangeGate, gate_dir, position_key, visual_hash
+from MobotixImaging import render_thermal, write_jpeg
+from MobotixPanorama import PanoramaSweep, write_panorama_netcdf
+from MobotixStats import ThermalStats, load_rois, parse_thresholds
+from MobotixPipeline import ScanPipeline
+from MobotixPresets import move_angle, optimize_order, tour_time
+from MobotixSchedule import parse_schedule
+from MobotixSettle import SettleDetector
+from MobotixSweep import calibrate_speeds, continuous_sweep, frame_angles, load_speed_table, speed_table_path
+from MobotixTrace import TRACER
+from MobotixUpload import UploadQueue, spool_dir
 
 DEFAULT_SCAN_TIMEOUT =900
 ARCHIVE_DIR = "/archive"
@@ -72,6 +87,236 @@ def parse_string_arg(arg):
     except ValueError:
         raise argparse.ArgumentTypeError("Invalid string argument format. Please provide comma-separated integers only.")
 
+def make_camera(args):
+    '''Creates the PT controller and the imager for the camera described by `args`.'''
+    mobot_pt = MobotixPT(user=args.user, passwd=args.password, ip=args.ip, transport=args.pt_transport)
+    mobot_im = MobotixImager(user=args.user, passwd=args.password, ip=args.ip, workdir=args.workdir, frames=args.frames,
+                             session=args.capture_session, jpeg_backend=args.jpeg_backend,
+                             jpeg_quality=args.jpeg_quality, jpeg_scale=args.jpeg_scale,
+                             preview=args.preview, preview_colorbar=args.preview_colorbar,
+                             sampler=args.sampler, thermal_format=args.thermal_format,
+                             aggregate=args.aggregate)
+    if mobot_im.session is not None:
+        mobot_pt.listeners.append(mobot_im.session)
+    return mobot_pt, mobot_im
+
+def open_archive(args):
+    '''Opens the `ARCHIVE_DIR` archive of custom scans with the budget of `args`.'''
+    return Archive(ARCHIVE_DIR, max_bytes=parse_size(args.archive_max_bytes), max_age=args.archive_max_age * 86400,
+                   compact_after=args.archive_compact * 86400)
+
+def staging_dir(workdir, name):
+    '''Directory next to the workdir holding the frames of one position until upload.'''
+    workdir = Path(workdir)
+    return workdir.with_name(workdir.name + ".pending") / name
+
+def upload_position(uploader, mobot_im, store, meta, writer=None, gate=None, stats=None):
+    '''
+    Converts the frames staged for one preset position and hands them to
+    the `uploader` (a `Plugin` or an `UploadQueue`).
+    With a loop `writer` the thermal frames go to the loop NetCDF file
+    instead of one NetCDF file per frame. With a `ChangeGate` the files
+    are only uploaded when the position changed since its last upload;
+    the difference statistics are published either way. With
+    `ThermalStats` the summary statistics of every thermal frame are
+    published too.
+    Returns the number of visible frames uploaded.
+    '''
+    thermal = []
+    def on_thermal(path, metadata, data):
+        thermal.append(data)
+        if stats is not None:
+            stats.publish(uploader, path, data, meta)
+    mobot_im.convert(store, writer=writer, meta=meta, on_thermal=on_thermal)
+
+    if gate is not None:
+        jpegs = store.find(sensor='visible', kind='jpg')
+        visible = None
+        if jpegs:
+            try:
+                visible = visual_hash(jpegs[-1])
+            except ValueError as e:
+                logging.warning(f"Gating {jpegs[-1]} on the thermal frame only: {e}")
+        upload, gate_stats = gate.check(position_key(meta), thermal=thermal[-1] if thermal else None,
+                                        visible=visible)
+        gate_meta = {**meta, 'reason': gate_stats.pop('reason')}
+        uploader.publish('gate.upload', int(upload), meta=gate_meta)
+        for name, value in gate_stats.items():
+            uploader.publish(f'gate.{name}', value, meta=gate_meta)
+        if not upload:
+            logging.info("Position %s unchanged, not uploading its files", position_key(meta))
+            for tspath in store.paths():
+                tspath.unlink()
+            store.close()
+            return 0
+
+    frames = 0
+    for tspath in store.paths():
+        if tspath.suffix == ".jpg":
+            frames = frames + 1
+
+        timestamp, path = mobot_im.extract_timestamp_and_filename(tspath)
+
+        #add move position to file name
+        path=append_path(path, f"_position{meta.get('direction', meta['position'])}")
+        store.rename(tspath, path)
+
+        logging.debug(path)
+        logging.debug(timestamp)
+
+        uploader.upload_file(path, meta=meta, timestamp=timestamp)
+
+    store.close()
+    return frames
+
+def open_loop_netcdf(args, loop_num, timestamp):
+    '''Creates the NetCDF file collecting the thermal frames of one scan loop.'''
+    path = staging_dir(args.workdir, f"{timestamp}_thermal.celsius_loop{loop_num}.nc")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return LoopNetCDFWriter(path, packing=args.netcdf_packing)
+
+def upload_loop_netcdf(uploader, writer, loop_num, timestamp):
+    '''Closes the loop NetCDF file and uploads it as one object.'''
+    path = writer.close()
+    upload_path = path.with_name(path.name.split("_", 1)[1])
+    os.rename(path, upload_path)
+    uploader.upload_file(upload_path, meta={'loop_num': str(loop_num)}, timestamp=timestamp)
+
+class CameraUploader:
+    ''' Adds the camera name to the meta of everything published or uploaded through `uploader`.
+
+    Parameters:
+        uploader: A `Plugin` or an `UploadQueue`.
+        camera (str): Name of the camera.
+    '''
+    def __init__(self, uploader, camera):
+        self.uploader = uploader
+        self.camera = camera
+
+    def publish(self, name, value, meta={}, timestamp=None):
+        self.uploader.publish(name, value, meta={**meta, 'camera': self.camera}, timestamp=timestamp)
+
+    def upload_file(self, path, meta={}, timestamp=None, **kwargs):
+        self.uploader.upload_file(path, meta={**meta, 'camera': self.camera}, timestamp=timestamp, **kwargs)
+
+
+class ScanSession:
+    ''' The plugin, camera and upload objects shared by the scans of one run.
+
+    A one-off scan opens a session and closes it when done. The resident
+    (daemon) mode keeps one session for all its scans, so the plugin
+    connection, the PT transport, the capture session and the worker
+    threads stay up between scans, and the last preset is remembered for
+    the settle estimate and the preset order.
+
+    In multi-camera mode each camera has its own session on the plugin,
+    upload queue and pipeline workers of a `MultiCameraSession`; whatever
+    it publishes and uploads is tagged with the `camera` name.
+
+    Parameters:
+        args (Namespace): Parsed command line arguments.
+        shared (MultiCameraSession): Session of all the cameras, None for a single camera.
+        camera (str): Name of the camera of a multi-camera session.
+    '''
+    def __init__(self, args, shared=None, camera=None):
+        self.args = args
+        self.camera = camera
+        self.last_pos = None
+        # set to stop the scan of the session before its next position
+        self.stop = threading.Event()
+        self._shared = shared
+        self._pipelines = {}
+        self._stack = ExitStack()
+        try:
+            if shared is None:
+                self.plugin = self._stack.enter_context(Plugin())
+                if args.trace:
+                    TRACER.dump_to(args.trace)
+                    self._stack.callback(TRACER.close)
+            else:
+                self.plugin = CameraUploader(shared.plugin, camera)
+            # Instantiate the Mobotix PT and  camera imager class for movement of the camera
+            self.mobot_pt, self.mobot_im = make_camera(args)
+            self._stack.enter_context(closing(self.mobot_pt))
+            self._stack.enter_context(closing(self.mobot_im))
+            self.settle = SettleDetector(self.mobot_pt.transport, strategy=args.settle,
+                                         threshold=args.settle_threshold)
+            if shared is None:
+                self.uploads = self._stack.enter_context(
+                    UploadQueue(self.plugin, spool_dir(args.workdir), workers=args.upload_workers))
+            else:
+                self.uploads = CameraUploader(shared.uploads, camera)
+            self.gate = ChangeGate(gate_dir(args.workdir), thermal_threshold=args.gate_thermal,
+                                   hash_threshold=args.gate_hash, keyframe_interval=args.gate_keyframe) \
+                if args.gate else None
+            self.stats = ThermalStats(parse_thresholds(args.hot_thresholds), load_rois(args.roi) if args.roi else None) \
+                if args.thermal_stats else None
+            if shared is not None:
+                self.archive = shared.archive
+            else:
+                self.archive = self._stack.enter_context(open_archive(args)) if args.mode == 'custom' else None
+        except BaseException:
+            self._stack.close()
+            raise
+
+    def pipeline(self, process):
+        '''
+        Returns the `ScanPipeline` running `process(uploads, mobot_im, *job)`,
+        created on first use and kept for the session.
+        '''
+        if process not in self._pipelines:
+            process_job = partial(process, self.uploads, self.mobot_im)
+            if self._shared is None:
+                pipeline = ScanPipeline(process_job, workers=self.args.workers)
+            else:
+                pipeline = self._shared.pool.client(process_job, name=self.camera)
+            self._pipelines[process] = self._stack.enter_context(pipeline)
+        return self._pipelines[process]
+
+    def publish_metrics(self, meta={}):
+        '''
+        Publishes the upload and timing metrics since the last call. The
+        sessions of a multi-camera run publish the metrics of their pipeline
+        instead, the multi-camera session those of the shared queue.
+        '''
+        if self._shared is None:
+            self.uploads.publish_metrics(meta=meta)
+            TRACER.publish(self.plugin, meta=meta)
+        else:
+            for pipeline in self._pipelines.values():
+                pipeline.publish_metrics(self.plugin, meta=meta)
+
+    def check_stop(self):
+        '''Ends the scan, as the scans end on errors, once `stop` is set.'''
+        if self.stop.is_set():
+            sys.exit("Scan stopped")
+
+    def reset(self):
+        '''
+        Cleans up after a scan that failed or timed out: waits for the jobs it
+        left in the pipelines and removes the frames left in the workdir.
+        '''
+        for pipeline in self._pipelines.values():
+            try:
+                pipeline.join()
+            except Exception as e:
+                logging.warning(f"Discarding error {e} of the interrupted scan.")
+        workdir = Path(self.args.workdir)
+        if workdir.exists():
+            for path in workdir.iterdir():
+                if path.is_file():
+                    path.unlink()
+
+    def close(self):
+        self._stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._stack.__exit__(exc_type, exc, tb)
+
+
 @timeout_decorator.timeout(DEFAULT_SCAN_TIMEOUT, use_signals=True)
 def scan_presets(args):
     '''
@@ -79,23 +324,34 @@ def scan_presets(args):
     and uploads them to beehive. It loops through a list of preset position, moving the 
     camera to given positions. The number of loops can be specified.
     '''
+    with ScanSession(args) as session:
+        run_presets(session)
+
+def run_presets(session):
+    '''Runs the loops of a preset or direction scan with the objects of `session`.'''
+    args, plugin, uploads = session.args, session.plugin, session.uploads
+    mobot_pt, mobot_im, settle = session.mobot_pt, session.mobot_im, session.settle
+    pipeline = session.pipeline(upload_position)
     loops = 0
 
-    # Instantiate the Mobotix PT and  camera imager class for movement of the camera
-    mobot_pt = MobotixPT(args.user, args.password, args.ip)
-    mobot_im = MobotixImager(args.ip, args.user, args.password, args.workdir, args.frames)
-
-    with Plugin() as plugin:
-        while loop_check(loops, args.loops):
-            loops = loops + 1
-            plugin.publish('loop.num', loops)
-            
-            scan_start = time.time()
-            logging.info(f"Loop {loops} of " + ("infinite" if args.loops < 0 else str(args.loops)))
-            frames = 0
-            presets = parse_string_arg(args.preset) # get a list from string
-
+    while loop_check(loops, args.loops):
+        loops = loops + 1
+        plugin.publish('loop.num', loops)
+        
+        scan_start = time.time()
+        logging.info(f"Loop {loops} of " + ("infinite" if args.loops < 0 else str(args.loops)))
+        presets = parse_string_arg(args.preset) # get a list from string
+        if args.order == 'optimal' and presets[0] != 0:
+            # start from wherever the previous loop left the camera
+            presets = optimize_order(presets, start=session.last_pos)
+            logging.info(f"Optimized preset order {presets}, estimated travel {tour_time(presets, session.last_pos):.1f} s")
+
+        loop_timestamp = time.time_ns()
+        writer = open_loop_netcdf(args, loops, loop_timestamp) if args.netcdf == 'loop' else None
+        # closed on the way out too, when the loop exits on an error
+        try:
             for move_pos in presets:
+                session.check_stop()
                 meta = {'position': str(move_pos), 'loop_num': str(loops)}
                 if args.mode == 'direction':
                     direction = str(args.directions[str(move_pos)])
@@ -113,12 +369,14 @@ def scan_presets(args):
                         plugin.publish('exit.status', 'Scan_Error', meta=meta)
                         sys.exit(-1)
 
-                    time.sleep(3) #For Safety
-                
+                    settle_sec, strategy = settle.wait(session.last_pos, move_pos)
+                    plugin.publish('settle.duration.sec', settle_sec, meta={**meta, 'strategy': strategy})
+                    session.last_pos = move_pos
+            
                 # Run the Mobotix sampler
                 try:
                     capture_start = time.time()
-                    mobot_im.capture()
+                    files = mobot_im.capture(tag=move_pos, convert=False)
                     capture_end = time.time()
                     plugin.publish('capture.duration.sec', capture_end-capture_start)
                 except Exception as e:
@@ -128,51 +386,108 @@ def scan_presets(args):
                     plugin.publish('exit.status', str(e), meta=meta)
                     sys.exit()
 
+                # convert and upload while the camera moves to the next preset
+                store = FrameStore.stage(args.workdir, staging_dir(args.workdir, f"{loops}_{move_pos}"), position=move_pos, files=files)
+                pipeline.submit(store, meta, writer, session.gate, session.stats)
 
-                # upload files
-                for tspath in args.workdir.glob("*"):
-                    if tspath.suffix == ".jpg":
-                        frames = frames + 1
-
-                    timestamp, path = mobot_im.extract_timestamp_and_filename(tspath)
-
-                    #add move position to file name
-                    path=append_path(path, f'_position{direction}')
-                    os.rename(tspath, path)
-
-                    logging.debug(path)
-                    logging.debug(timestamp)
-
-                    
-                    plugin.upload_file(path, meta=meta, timestamp=timestamp)
+            try:
+                frames = sum(pipeline.join())
+                if writer is not None:
+                    upload_loop_netcdf(uploads, writer, loops, loop_timestamp)
+            except Exception as e:
+                logging.warning(f"Unknown exception {e} during conversion and upload.")
+                scan_end = time.time()
+                plugin.publish('scan.duration.sec', scan_end-scan_start)
+                plugin.publish('exit.status', str(e))
+                sys.exit()
+        finally:
+            if writer is not None:
+                writer.close()
 
-            scan_end = time.time()
-            plugin.publish('scan.duration.sec', scan_end-scan_start)
+        scan_end = time.time()
+        plugin.publish('scan.duration.sec', scan_end-scan_start)
+        session.publish_metrics(meta={'loop_num': str(loops)})
 
-            logging.info(f"Processed {frames} frames")
-            if loop_check(loops, args.loops):
-                logging.info(f"Sleeping for {args.loopsleep} seconds between loops")
-                time.sleep(args.loopsleep)
+        logging.info(f"Processed {frames} frames")
+        if loop_check(loops, args.loops):
+            logging.info(f"Sleeping for {args.loopsleep} seconds between loops")
+            time.sleep(args.loopsleep)
 
-        
-        plugin.publish('exit.status', 'Loop_Complete')
+    
+    plugin.publish('exit.status', 'Loop_Complete')
 
 
 
 
 ### Functions for custom scan
 
-def process_and_upload_files(plugin, mobot_im, args, seq_name):
-    if not os.path.exists(ARCHIVE_DIR):
-        os.mkdir(ARCHIVE_DIR)
-
-    for tspath in args.workdir.glob("*"):
+def process_and_upload_files(uploader, mobot_im, store, seq_name, archive, sweep=None, shot=0, angle=None):
+    '''
+    Converts the frames staged for one custom-scan shot, adds them to the
+    `archive` and hands them to the `uploader`. With a `PanoramaSweep` the thermal
+    frame and visible image go to the sweep, as its `shot`, instead of
+    being uploaded. Shots of a continuous sweep carry the `angle` the head
+    had turned, uploaded as `sweep_angle`.
+    '''
+    meta = {} if angle is None else {'sweep_angle': f"{angle:.2f}"}
+    on_thermal = None
+    if sweep is not None:
+        def on_thermal(file_path, metadata, temperature_data):
+            timestamp, _ = mobot_im.extract_timestamp_and_filename(file_path)
+            sweep.add(shot, timestamp, temperature_data, metadata, angle=angle)
+    mobot_im.convert(store, on_thermal=on_thermal)
+
+    for tspath in store.paths():
         timestamp, path = mobot_im.extract_timestamp_and_filename(tspath)
         time_cal = datetime.datetime.fromtimestamp(timestamp/1_000_000_000).strftime('_%Y-%m-%dT%H%M%S')
-        new_name = append_path(path,time_cal+seq_name)
-        os.rename(tspath, Path(new_name))
-        shutil.copy(new_name, os.path.join(ARCHIVE_DIR, os.path.basename(new_name)))
-        plugin.upload_file(new_name, timestamp=timestamp)
+        new_name = store.rename(tspath, append_path(path,time_cal+seq_name))
+        # the archived copy is a hardlink (or reflink) and keeps the capture time in ns for merge_netcdfs
+        archive.add(new_name, f"{timestamp}_{new_name.name}")
+        if sweep is None:
+            uploader.upload_file(new_name, meta=meta, timestamp=timestamp)
+            continue
+        if path.suffix == ".jpg" and not path.stem.endswith("_plot"):
+            sweep.add_visible(shot, new_name)
+        new_name.unlink()
+
+    store.close()
+
+def upload_panorama(uploader, sweep, directory, name, meta={}, packing='int16'):
+    '''
+    Assembles the shots of a `PanoramaSweep` and hands the panorama NetCDF,
+    its thermal preview and the visible mosaic to the `uploader`, with the
+    capture time of the first shot, and publishes the shots assembled and
+    how many of their offsets fell back to the move, with `meta`. Returns
+    the `Panorama`, None when the sweep has no thermal frame.
+    '''
+    panorama = sweep.assemble()
+    if panorama is None:
+        logging.warning(f"No thermal frame in the sweep {name}, no panorama")
+        return None
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    timestamp = panorama.times[0]
+    time_cal = datetime.datetime.fromtimestamp(timestamp/1_000_000_000).strftime('_%Y-%m-%dT%H%M%S')
+    height, width = panorama.temperature.shape
+    base = directory / f"{panorama.metadata.get('sensor', 'left')}_{width}x{height}.thermal.celsius.panorama{time_cal}{name}"
+
+    files = [write_panorama_netcdf(base.with_name(base.name + ".nc"), panorama, packing=packing,
+                                   attrs={'direction': sweep.direction, 'speed': str(sweep.speed),
+                                          'duration': str(sweep.duration)})]
+    plot = base.with_name(base.name + "_plot.jpg")
+    render_thermal(panorama.temperature, plot)
+    files.append(plot)
+    if panorama.visible is not None:
+        height, width = panorama.visible.shape[:2]
+        visible = directory / f"{width}x{height}.panorama{time_cal}{name}.jpg"
+        write_jpeg(panorama.visible, visible)
+        files.append(visible)
+    for path in files:
+        uploader.upload_file(path, timestamp=timestamp)
+
+    uploader.publish('panorama.shots', len(panorama.times), meta=meta, timestamp=timestamp)
+    uploader.publish('panorama.fallbacks', panorama.fallbacks, meta=meta, timestamp=timestamp)
+    return panorama
 
 def generate_imgseq_name(start_pos, image_num, move_direction, move_speed, move_duration):
     duration_ms = int(1000*move_duration)
@@ -180,11 +495,50 @@ def generate_imgseq_name(start_pos, image_num, move_direction, move_speed, move_
     move_string = f"_Pt{start_pos}-{move_direction}-S{move_speed}xD{duration_ms}ms_Img{str(image_num)}"
     return move_string
 
+def record_sweep(session, pipeline, preset, num_shots, direction, speed, duration, table, sweep=None):
+    '''
+    Captures the shots of one custom-scan loop in a single continuous move
+    (`--sweep`): the head turns as far as `num_shots` moves of `duration`
+    seconds would take it, the frames streamed meanwhile are kept every
+    `args.sweep_interval` seconds, and each is submitted to the `pipeline`
+    as a shot, with the angle the head had turned according to the speed
+    `table`. Returns the number of shots.
+    '''
+    args = session.args
+    session.check_stop()
+    try:
+        recording = continuous_sweep(session.mobot_pt, session.mobot_im, direction, speed, num_shots * duration,
+                                     interval=args.sweep_interval,
+                                     tag=generate_sweep_name(preset, num_shots, direction, speed, duration))
+    except Exception as e:
+        logging.warning(f"Exception {e} during capture.")
+        sys.exit(f"Exit error: {str(e)}")
+
+    angles = frame_angles([timestamp for timestamp, _ in recording.frames], recording.start, recording.stop,
+                          move_angle(direction, speed, 1.0, table=table))
+    for img, ((timestamp, files), angle) in enumerate(zip(recording.frames, angles)):
+        seq_name = generate_imgseq_name(preset, img, direction, speed, duration)
+        store = FrameStore.stage(args.workdir, staging_dir(args.workdir, seq_name.lstrip("_")), position=seq_name.lstrip("_"), files=files)
+        pipeline.submit(store, seq_name, session.archive, sweep, img, float(angle))
+    logging.info(f"Kept {len(recording.frames)} frames of the sweep from preset {preset}")
+    return len(recording.frames)
+
+def generate_sweep_name(start_pos, num_shots, move_direction, move_speed, move_duration):
+    '''Name of the panorama of a sweep, like `generate_imgseq_name` with the number of shots.'''
+    duration_ms = int(1000*move_duration)
+    return f"_Pt{start_pos}-{move_direction}-S{move_speed}xD{duration_ms}ms_N{num_shots}"
+
 @timeout_decorator.timeout(DEFAULT_SCAN_TIMEOUT, use_signals=True)
 def scan_custom(args):
-    mobot_pt = MobotixPT(user=args.user, passwd=args.password, ip=args.ip)
-    mobot_im = MobotixImager(user=args.user, passwd=args.password, ip=args.ip, workdir=args.workdir, frames=args.frames)
-    
+    with ScanSession(args) as session:
+        run_custom(session)
+
+def run_custom(session):
+    '''Runs a custom scan with the objects of `session`.'''
+    args, plugin, uploads = session.args, session.plugin, session.uploads
+    mobot_pt, mobot_im, settle = session.mobot_pt, session.mobot_im, session.settle
+    pipeline = session.pipeline(process_and_upload_files)
+
     logging.info('entered the custom function')
 
     presets = parse_string_arg(args.preset) # get a list from string
@@ -193,6 +547,7 @@ def scan_custom(args):
     move_duration = parse_string_arg(args.move_duration) #expect nanosecond and convert to seconds
     move_duration = [i/1000 for i in move_duration]
     move_direction = args.move_direction # only one direction
+    table = load_speed_table(speed_table_path(args.workdir))
 
 
     if presets is not None and presets[0] != 0:
@@ -200,55 +555,150 @@ def scan_custom(args):
             scan_start = time.time()
             status = mobot_pt.move_to_preset(presets[loop])
             logging.info(f'Moving to Preset {presets[loop]}')
-            time.sleep(3)  # For Safety
-
-
-
-            with Plugin() as plugin:
+            # the previous custom loop ended somewhere between presets
+            settle_sec, strategy = settle.wait(to_pt=presets[loop])
+            session.last_pos = None
+            sweep = PanoramaSweep(move_direction, move_speed[loop], move_duration[loop], fov=args.panorama_fov,
+                                  table=table) if args.panorama else None
+
+            if args.sweep:
+                shots = record_sweep(session, pipeline, presets[loop], num_shots[loop], move_direction,
+                                     move_speed[loop], move_duration[loop], table, sweep)
+                plugin.publish('sweep.frames', shots, meta={'position': str(presets[loop])})
+            else:
                 for img in range(0, num_shots[loop]):
+                    session.check_stop()
+                    seq_name = generate_imgseq_name(presets[loop], img, move_direction, move_speed[loop], move_duration[loop])
                     try:
-                        mobot_im.capture()
+                        files = mobot_im.capture(tag=seq_name, convert=False)
                     except Exception as e:
                         logging.warning(f"Exception {e} during capture.")
                         sys.exit(f"Exit error: {str(e)}")
-                    mobot_pt.move(direction=move_direction, speed=move_speed[loop], duration=move_duration[loop])
 
-                    seq_name = generate_imgseq_name(presets[loop], img, move_direction, move_speed[loop], move_duration[loop])
+                    # convert and upload this shot while the camera moves
+                    store = FrameStore.stage(args.workdir, staging_dir(args.workdir, seq_name.lstrip("_")), position=seq_name.lstrip("_"), files=files)
+                    pipeline.submit(store, seq_name, session.archive, sweep, img)
 
-                    process_and_upload_files(plugin, mobot_im, args, seq_name)
+                    mobot_pt.move(direction=move_direction, speed=move_speed[loop], duration=move_duration[loop])
                     logging.info(">>>>Complete "+ str(img) + " in loop for preset " +str(presets[loop]))
 
-                scan_end = time.time()
-                plugin.publish('scan.duration.sec', scan_end-scan_start)
-                plugin.publish('exit.status', 'Loop_Complete')
+            try:
+                pipeline.join()
+                # trim the archive to its budget in the background, once the shots are in
+                session.archive.maintain()
+                if sweep is not None:
+                    upload_panorama(uploads, sweep, staging_dir(args.workdir, "panorama"),
+                                    generate_sweep_name(presets[loop], num_shots[loop], move_direction,
+                                                        move_speed[loop], move_duration[loop]),
+                                    meta={'position': str(presets[loop])}, packing=args.netcdf_packing)
+            except Exception as e:
+                logging.warning(f"Exception {e} during conversion and upload.")
+                sys.exit(f"Exit error: {str(e)}")
+
+            scan_end = time.time()
+            plugin.publish('settle.duration.sec', settle_sec, meta={'position': str(presets[loop]), 'strategy': strategy})
+            plugin.publish('scan.duration.sec', scan_end-scan_start)
+            session.publish_metrics(meta={'position': str(presets[loop])})
+            plugin.publish('exit.status', 'Loop_Complete')
 
     return None
 
 
+SCAN_RUNNERS = {'preset': run_presets, 'direction': run_presets, 'custom': run_custom}
+
+@timeout_decorator.timeout(DEFAULT_SCAN_TIMEOUT, use_signals=True)
+def scan_calibration(args):
+    '''Measures the angular velocity of every move speed, see `--calibrate`.'''
+    with ScanSession(args) as session:
+        return run_calibration(session)
+
+def run_calibration(session):
+    '''
+    Calibrates the move speeds on the axis of `args.move_direction`, each
+    from the first preset of `args.preset` (0 turns from where the camera
+    is), into the speed table of the workdir. Returns the table.
+    '''
+    args, plugin = session.args, session.plugin
+    preset = parse_string_arg(args.preset)[0]
+
+    def start():
+        if preset != 0:
+            session.mobot_pt.move_to_preset(preset)
+            session.settle.wait(to_pt=preset)
+
+    table = calibrate_speeds(session.mobot_pt, session.mobot_im, plugin, speed_table_path(args.workdir),
+                             direction=args.move_direction, fov=args.panorama_fov, start=start)
+    plugin.publish('exit.status', 'Calibration_Complete')
+    return table
+
+def scan_daemon(args, max_runs=None, open_session=ScanSession, runner=None):
+    '''
+    Resident mode: keeps one `ScanSession` open and runs a scan of
+    `args.mode` at every time of the `args.schedule` schedule, each scan
+    limited to `args.scan_timeout` seconds. A scan that fails or times out is
+    reported and the next one runs as scheduled; missed times are skipped.
+    `open_session(args)` and `runner(session)` replace the session and the
+    scan of `args.mode`, as for multiple cameras.
+    '''
+    schedule = parse_schedule(args.schedule)
+    scan = timeout_decorator.timeout(args.scan_timeout, use_signals=True)(runner or SCAN_RUNNERS[args.mode])
+    runs = 0
+
+    with open_session(args) as session:
+        next_run = schedule.next_run(datetime.datetime.now())
+        while max_runs is None or runs < max_runs:
+            logging.info(f"Next scan at {next_run:%Y-%m-%d %H:%M:%S} ({schedule})")
+            time.sleep(max(0, (next_run - datetime.datetime.now()).total_seconds()))
+            runs = runs + 1
+
+            scan_start = time.time()
+            try:
+                scan(session)
+                status = 'Scan_Complete'
+            except timeout_decorator.TimeoutError:
+                logging.error(f"Scan {runs} timed out after {args.scan_timeout} seconds.")
+                status = 'Scan_Timeout'
+                session.reset()
+            except (Exception, SystemExit) as e:
+                logging.error(f"Scan {runs} failed: {e}")
+                status = 'Scan_Error'
+                session.reset()
+            session.plugin.publish('daemon.scan.duration.sec', time.time()-scan_start,
+                                   meta={'run': str(runs), 'status': status})
+
+            next_run = schedule.next_run(max(datetime.datetime.now(), next_run))
+    return runs
+
+
 
 ### Functions for Panorama
 
-def merge_netcdfs(archive_dir, out_filename):
+def merge_netcdfs(archive_dir, out_filename, start=None, end=None, positions=None):
     """
-    Merges multiple NetCDF files in a directory into a single file.
-    
+    Merges the NetCDF files of a directory into a single file, in the order of
+    the timestamps in their names. Files are streamed into the output a few
+    at a time and a manifest next to it lets a later call append only the
+    files archived since. The files are listed from the index of the
+    `Archive`, which includes the daily files it packed.
+
     Args:
-    - directory (str): The directory containing the NetCDF files.
-    - output_filename (str): The name of the merged NetCDF file.
+    - archive_dir (str): The directory containing the NetCDF files.
+    - out_filename (str): The name of the merged NetCDF file.
+    - start, end (int): Only merge files timestamped within [start, end] (ns).
+    - positions (list): Only merge files of these presets or directions.
     """
-
-    # List all .nc files in the directory
-    files = [os.path.join(archive_dir, f) for f in os.listdir(archive_dir) if f.endswith('.nc')]
-
-    # Open all datasets and concatenate along a new dimension (let's call it 'shot')
-    with xr.open_mfdataset(files) as ds:
-        ds.to_netcdf(out_filename)
+    with Archive(archive_dir) as archive:
+        files = archive.files(start=start, end=end, positions=positions, kinds=['nc', 'daily.nc'])
+        added = NetCDFMerger(out_filename).merge(files, start=start, end=end, positions=positions)
+        archive.touch(path for _, path in files)
+    return len(added)
 
 
 @timeout_decorator.timeout(DEFAULT_SCAN_TIMEOUT, use_signals=True)
 def scan_custom_panorama(args):
-    #First scan custom
-    scan_custom(args)
+    '''Runs a custom scan that uploads one panorama per sweep, see `--panorama`.'''
+    with ScanSession(argparse.Namespace(**{**vars(args), 'panorama': True})) as session:
+        run_custom(session)
 
 
 
@@ -0,0 +1,101 @@
+"""
+Schedules for the resident (daemon) mode.
+
+A schedule is either a number of seconds, run at multiples of that interval
+(`300` runs at :00, :05, :10, ...), or a 5-field cron expression
+`minute hour day-of-month month day-of-week` with `*`, `*/n`, `a-b`,
+`a-b/n` and comma-separated lists (`*/10 6-18 * * 1-5`). Times are local.
+"""
+
+import datetime
+
+_CRON_FIELDS = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7)]
+
+
+def _parse_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-'))
+        else:
+            start = end = int(part)
+            if step != 1:
+                end = high
+        if not (low <= start <= end <= high) or step < 1:
+            raise ValueError(f"Invalid cron field '{field}', values are {low}-{high}.")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class IntervalSchedule:
+    ''' Runs every `seconds`, at multiples of the interval since the epoch. '''
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("The schedule interval must be positive.")
+        self.seconds = seconds
+
+    def next_run(self, after):
+        '''Returns the first run time strictly after the datetime `after`.'''
+        slot = (after.timestamp() // self.seconds + 1) * self.seconds
+        return datetime.datetime.fromtimestamp(slot)
+
+    def __repr__(self):
+        return f"every {self.seconds} s"
+
+
+class CronSchedule:
+    ''' Runs at the minutes matching a 5-field cron expression. '''
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression '{expression}', expected 5 fields.")
+        self.expression = expression
+        (self.minutes, self.hours, self.days, self.months, weekdays) = [
+            _parse_field(field, low, high) for field, (_, low, high) in zip(fields, _CRON_FIELDS)]
+        # cron counts weekdays from Sunday (0 or 7), Python from Monday
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, t):
+        day, weekday = t.day in self.days, t.weekday() in self.weekdays
+        # as in cron, a restricted day of month and day of week match either
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_run(self, after):
+        '''Returns the first run time strictly after the datetime `after`.'''
+        t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=5 * 366)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + datetime.timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t = t + datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression '{self.expression}' never matches.")
+
+    def __repr__(self):
+        return f"cron '{self.expression}'"
+
+
+def parse_schedule(spec):
+    '''Returns the schedule described by `spec`, seconds or a cron expression.'''
+    spec = str(spec).strip()
+    try:
+        seconds = float(spec)
+    except ValueError:
+        return CronSchedule(spec)
+    return IntervalSchedule(seconds)
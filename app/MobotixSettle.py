@@ -0,0 +1,139 @@
+import io
+import logging
+import time
+
+import numpy as np
+
+from MobotixControl import TransportError
+from MobotixImaging import load_cv2, load_pillow
+from MobotixPresets import preset_grid, travel_time
+from MobotixTrace import traced
+
+# live image of the camera, a low-cost frame compared to a thermal-raw capture
+SNAPSHOT_PATH = "/record/current.jpg"
+
+# upper bound of the wait after a move, the former fixed sleep (seconds)
+DEFAULT_SETTLE_MAX = 3
+
+# mean absolute difference (0-255 grey levels) under which frames are still
+DEFAULT_SETTLE_THRESHOLD = 2.0
+
+DEFAULT_SETTLE_INTERVAL = 0.2
+
+SETTLE_STRATEGIES = ['auto', 'frames', 'travel', 'fixed']
+
+
+def decode_thumbnail(data):
+    '''Decodes a JPEG into a small greyscale uint8 array.'''
+    cv2 = load_cv2()
+    if cv2 is not None:
+        # libjpeg decodes straight to 1/8 scale, far cheaper than a full decode
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if frame is None:
+            raise ValueError("Could not decode snapshot.")
+        return frame
+    with load_pillow().open(io.BytesIO(data)) as image:
+        image.draft("L", (image.width // 8, image.height // 8))
+        return np.asarray(image.convert("L"))
+
+
+def frame_change(previous, current):
+    '''Mean absolute grey-level difference between two frames.'''
+    if previous.shape != current.shape:
+        return float('inf')
+    return float(np.abs(previous.astype(np.int16) - current).mean())
+
+
+class SettleDetector:
+    ''' Waits for the camera to come to rest after a preset move.
+
+    The `frames` strategy polls low-cost snapshots and returns once
+    `stable_frames` successive snapshots differ by less than `threshold`,
+    after the image has changed or the estimated travel time has passed
+    (with an unknown origin preset only a change counts).
+    The `travel` strategy sleeps for the travel time estimated from the
+    angular distance between the presets. `auto` uses frames and falls back
+    to travel when snapshots are unavailable, `frames` falls back to the
+    fixed wait. Every strategy is capped at `max_wait`, and `fixed` always
+    waits `max_wait`.
+
+    Parameters:
+        transport: Camera transport used to fetch snapshots (see `MobotixPT.transport`).
+        strategy (str): One of `SETTLE_STRATEGIES`.
+        max_wait (float): Longest wait in seconds.
+        threshold (float): Frame difference under which the camera is still.
+        stable_frames (int): Successive still frame pairs required.
+        interval (float): Seconds between snapshots.
+    '''
+    def __init__(self, transport, strategy='auto', max_wait=DEFAULT_SETTLE_MAX, threshold=DEFAULT_SETTLE_THRESHOLD,
+                 stable_frames=2, interval=DEFAULT_SETTLE_INTERVAL):
+        if strategy not in SETTLE_STRATEGIES:
+            raise ValueError(f"Unknown settle strategy '{strategy}'. Use {SETTLE_STRATEGIES}")
+        self.transport = transport
+        self.strategy = strategy
+        self.max_wait = max_wait
+        self.threshold = threshold
+        self.stable_frames = stable_frames
+        self.interval = interval
+        self._snapshots = True
+
+    def _estimate(self, from_pt, to_pt):
+        try:
+            preset_grid(from_pt)
+            preset_grid(to_pt)
+        except (TypeError, ValueError):
+            return None
+        return travel_time(from_pt, to_pt)
+
+    def _wait_frames(self, start, estimate):
+        previous = None
+        changed = False
+        stable = 0
+        while time.monotonic() - start < self.max_wait:
+            frame = decode_thumbnail(self.transport.get(SNAPSHOT_PATH, timeout=self.max_wait))
+            if previous is not None:
+                change = frame_change(previous, frame)
+                logging.debug("Settle frame change %.2f", change)
+                if change >= self.threshold:
+                    changed = True
+                    stable = 0
+                else:
+                    stable += 1
+                # still frames before the head starts moving do not count
+                started = changed or (estimate is not None and time.monotonic() - start >= estimate)
+                if started and stable >= self.stable_frames:
+                    return True
+            previous = frame
+            time.sleep(self.interval)
+        return False
+
+    @traced('settle')
+    def wait(self, from_pt=None, to_pt=None):
+        '''
+        Blocks until the camera has settled after moving from preset `from_pt`
+        to `to_pt`. Returns the seconds waited and the strategy that decided.
+        '''
+        start = time.monotonic()
+        estimate = self._estimate(from_pt, to_pt)
+        strategy = self.strategy
+
+        if strategy == 'auto' and not self._snapshots:
+            strategy = 'travel'
+
+        if strategy in ('auto', 'frames'):
+            try:
+                if self._wait_frames(start, estimate):
+                    return time.monotonic() - start, 'frames'
+                strategy = 'fixed'
+            except (TransportError, ValueError) as e:
+                logging.warning("Settle snapshots unavailable: %s", e)
+                if strategy == 'auto':
+                    self._snapshots = False
+                strategy = 'travel' if strategy == 'auto' else 'fixed'
+
+        if strategy == 'travel' and estimate is not None:
+            time.sleep(max(0, min(estimate, self.max_wait) - (time.monotonic() - start)))
+            return time.monotonic() - start, 'travel'
+
+        time.sleep(max(0, self.max_wait - (time.monotonic() - start)))
+        return time.monotonic() - start, 'fixed'
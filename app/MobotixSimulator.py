@@ -0,0 +1,475 @@
+"""
+Stand-ins for the Mobotix camera, used to exercise the plugin without hardware.
+
+`StubCameraServer` answers the `/control/rcontrol?action=putrs232` requests
+sent by `MobotixPT` with `OK` after a configurable latency, and serves the
+live snapshot used for settle detection from a user supplied callable.
+Given a `SimulatedPT`, the server moves a simulated head with the Pelco-D
+commands it receives, taking as long as the real one between presets, and
+serves snapshots of the scene the head looks at.
+
+    with StubCameraServer(latency=0.01, pt=SimulatedPT()) as camera:
+        MobotixPT('admin', 'meinsm', camera.address).move_to_preset(1)
+
+`FakeSampler` writes synthetic `.rgb` and `.thermal.celsius.csv` frames the
+way the thermal-raw sampler does, and `write_sampler` installs it as an
+executable to pass as `--sampler`. Run as a script, this module serves a
+simulated camera or runs the fake sampler:
+
+    python3 MobotixSimulator.py camera --port 8080
+    python3 MobotixSimulator.py thermal-raw --dir /tmp/data --fps 8
+"""
+
+import argparse
+import base64
+import logging
+import os
+import shlex
+import shutil
+import signal
+import stat
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+import numpy as np
+
+from MobotixImaging import load_cv2, load_pillow
+from MobotixPresets import (DEFAULT_MOVE_OVERHEAD, DEFAULT_PAN_SPEED, DEFAULT_TILT_SPEED, NUM_PAN, PAN_STEP_DEG,
+                            PELCO_MAX_SPEED, TILT_STEP_DEG, preset_grid)
+from MobotixThermal import write_celsius_csv
+
+# Pelco-D commands sent by MobotixPT
+PELCO_STOP = 0x00
+PELCO_RIGHT = 0x02
+PELCO_LEFT = 0x04
+PELCO_UP = 0x08
+PELCO_DOWN = 0x10
+PELCO_GOTO_PRESET = 0x07
+PELCO_RESET = 0x0F
+
+DEFAULT_SIM_WIDTH = 1280
+DEFAULT_SIM_HEIGHT = 960
+DEFAULT_SIM_THERMAL_WIDTH = 336
+DEFAULT_SIM_THERMAL_HEIGHT = 252
+DEFAULT_SIM_FPS = 8
+
+SNAPSHOT_SIZE = (320, 240)
+
+
+def decode_pelco(code):
+    '''
+    Returns the (command, data1, data2) bytes of a percent-encoded Pelco-D
+    message such as `%FF%01%00%07%00%01%09`.
+    '''
+    data = bytes.fromhex(code.replace("%", ""))
+    if len(data) != 7 or data[0] != 0xFF or sum(data[1:6]) % 256 != data[6]:
+        raise ValueError(f"Invalid Pelco-D message '{code}'.")
+    return data[3], data[4], data[5]
+
+
+def encode_jpeg(image):
+    '''Encodes a greyscale uint8 array as JPEG bytes.'''
+    cv2 = load_cv2()
+    if cv2 is not None:
+        return cv2.imencode(".jpg", image)[1].tobytes()
+    import io
+    buffer = io.BytesIO()
+    load_pillow().fromarray(image).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class SimulatedPT:
+    ''' A PT head moved by the Pelco-D commands of `MobotixPT`.
+
+    Moving to a preset takes the time `MobotixPresets.travel_time` estimates
+    for the real head (pan and tilt at the same time, plus a start/stop
+    overhead), and direction commands turn the head at the speed they encode
+    until the next stop. The head starts at preset 1.
+
+    Parameters:
+        pan_speed (float): Pan speed between presets and at full speed (deg/s).
+        tilt_speed (float): Tilt speed between presets and at full speed (deg/s).
+        overhead (float): Seconds added to every preset move.
+        time_scale (float): Multiplies the duration of preset moves, below 1
+            to run scans faster than the real camera.
+    '''
+    def __init__(self, pan_speed=DEFAULT_PAN_SPEED, tilt_speed=DEFAULT_TILT_SPEED, overhead=DEFAULT_MOVE_OVERHEAD,
+                 time_scale=1.0):
+        self.pan_speed = pan_speed
+        self.tilt_speed = tilt_speed
+        self.overhead = overhead
+        self.time_scale = time_scale
+        self.preset = 1
+        # (monotonic time, Pelco-D code) of every command
+        self.history = []
+        self._lock = threading.Lock()
+        # the head moves from `_origin` at `_velocity` deg/s between `_start` and `_end`
+        pan, tilt = self._preset_angles(1)
+        self._origin = (pan, tilt)
+        self._velocity = (0.0, 0.0)
+        self._target = None
+        self._start = self._end = time.monotonic()
+
+    @staticmethod
+    def _preset_angles(pt_id):
+        pan, tilt = preset_grid(pt_id)
+        return pan * PAN_STEP_DEG, tilt * TILT_STEP_DEG
+
+    def _angles(self, now):
+        if self._target is not None and now >= self._end:
+            return self._target
+        t = min(max(now, self._start), self._end) - self._start
+        return tuple(o + v * t for o, v in zip(self._origin, self._velocity))
+
+    def _speed(self, value, full):
+        return full if value == 0xFF else full * min(value, PELCO_MAX_SPEED) / PELCO_MAX_SPEED
+
+    def _goto(self, now, pan, tilt):
+        from_pan, from_tilt = self._angles(now)
+        # pan the short way round
+        d_pan = (pan - from_pan + 180) % 360 - 180
+        d_tilt = tilt - from_tilt
+        duration = 0.0
+        if abs(d_pan) > 1e-6 or abs(d_tilt) > 1e-6:
+            duration = max(abs(d_pan) / self.pan_speed, abs(d_tilt) / self.tilt_speed) + self.overhead
+            duration *= self.time_scale
+        self._origin = (from_pan, from_tilt)
+        self._velocity = (d_pan / duration, d_tilt / duration) if duration else (0.0, 0.0)
+        self._target = (from_pan + d_pan, tilt)
+        self._start, self._end = now, now + duration
+
+    def _turn(self, now, pan_speed, tilt_speed):
+        self._origin = self._angles(now)
+        self._velocity = (pan_speed, tilt_speed)
+        self._target = None
+        self._start, self._end = now, float("inf")
+
+    def command(self, code):
+        '''Applies a percent-encoded Pelco-D command to the head.'''
+        command, data1, data2 = decode_pelco(code)
+        now = time.monotonic()
+        with self._lock:
+            self.history.append((now, code))
+            if command == PELCO_GOTO_PRESET:
+                # MobotixPT writes the preset number in BCD
+                self.preset = int(f"{data2:02x}")
+                self._goto(now, *self._preset_angles(self.preset))
+            elif command == PELCO_RESET:
+                self.preset = 1
+                self._goto(now, *self._preset_angles(1))
+            elif command == PELCO_STOP:
+                self._origin = self._angles(now)
+                self._velocity = (0.0, 0.0)
+                self._target = None
+                self._start = self._end = now
+            elif command in (PELCO_RIGHT, PELCO_LEFT, PELCO_UP, PELCO_DOWN):
+                self.preset = None
+                pan = self._speed(data1, self.pan_speed) * {PELCO_RIGHT: 1, PELCO_LEFT: -1}.get(command, 0)
+                tilt = self._speed(data2, self.tilt_speed) * {PELCO_UP: 1, PELCO_DOWN: -1}.get(command, 0)
+                self._turn(now, pan, tilt)
+            else:
+                logging.warning("Simulated PT ignores Pelco-D command %02x", command)
+
+    def angles(self):
+        '''Returns the current (pan, tilt) of the head in degrees.'''
+        with self._lock:
+            pan, tilt = self._angles(time.monotonic())
+        return pan % (NUM_PAN * PAN_STEP_DEG), tilt
+
+    def moving(self):
+        with self._lock:
+            now = time.monotonic()
+            return self._start <= now < self._end and self._velocity != (0.0, 0.0)
+
+    def snapshot(self):
+        '''Returns a JPEG of the scene in front of the head, it shifts while the head moves.'''
+        pan, tilt = self.angles()
+        width, height = SNAPSHOT_SIZE
+        x = np.arange(width)[None, :] + pan * 8
+        y = np.arange(height)[:, None] + tilt * 8
+        image = 128 + 60 * np.sin(x / 23) * np.cos(y / 17) + 40 * np.sin((x + y) / 41)
+        return encode_jpeg(image.astype(np.uint8))
+
+
+class _CameraRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug("stub camera: " + format, *args)
+
+    def _reply(self, status, body):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        camera = self.server.camera
+        if self.headers.get("Authorization") != camera.authorization:
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", 'Basic realm="camera"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        url = urlparse(self.path)
+        if url.path == "/record/current.jpg":
+            self._reply_snapshot(camera)
+            return
+
+        # keep the percent-encoded RS232 bytes as sent, e.g. %FF%01%00%07...
+        query = dict(p.partition("=")[::2] for p in url.query.split("&"))
+        if url.path != "/control/rcontrol" or query.get("action") != "putrs232":
+            self._reply(404, "Not Found\n")
+            return
+
+        code = query.get("rs232outtext", "")
+        try:
+            camera.record(code)
+        except ValueError as e:
+            self._reply(400, f"{e}\n")
+            return
+        time.sleep(camera.latency)
+        self._reply(200, "OK\n")
+
+    def _reply_snapshot(self, camera):
+        data = camera.snapshot() if camera.snapshot is not None else None
+        if data is None:
+            self._reply(404, "Not Found\n")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+class StubCameraServer:
+    ''' A local HTTP server imitating the camera PT control endpoint.
+
+    Parameters:
+        user (str): Accepted camera user ID.
+        passwd (str): Accepted camera password.
+        latency (float): Seconds each command takes to answer.
+        host (str): Interface to listen on.
+        port (int): Port to listen on, 0 picks a free one.
+        snapshot (callable): Returns the JPEG bytes served as the live image,
+            the endpoint answers 404 when not set.
+        pt (SimulatedPT): Head moved by the commands, its snapshots are
+            served unless `snapshot` is given.
+    '''
+    def __init__(self, user="admin", passwd="meinsm", latency=0.0, host="127.0.0.1", port=0, snapshot=None,
+                 pt=None):
+        token = base64.b64encode(f"{user}:{passwd}".encode()).decode()
+        self.authorization = f"Basic {token}"
+        self.latency = latency
+        self.pt = pt
+        self.snapshot = snapshot if snapshot is not None or pt is None else pt.snapshot
+        self.commands = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _CameraRequestHandler)
+        self._server.daemon_threads = True
+        self._server.camera = self
+        self._thread = None
+
+    @property
+    def address(self):
+        '''`host:port` to pass as the camera IP.'''
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def record(self, code):
+        if self.pt is not None:
+            self.pt.command(code)
+        with self._lock:
+            self.commands.append(code)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info("Stub camera listening on %s", self.address)
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class FakeSampler:
+    ''' Writes synthetic frames into a directory like the thermal-raw sampler.
+
+    For every frame it prints `received video frame #N ts (system): T`, then
+    writes `T_WxH.rgb` (BGRA) and `T_left_wxh_14bit.thermal.celsius.csv` in a
+    temporary directory and renames them into `directory`. Frames are written
+    at `fps` until `frames` have been written, or forever. A few frames are
+    prepared up front and repeated, so the frame rate does not depend on the
+    cost of formatting the CSV. With `atomic` off each file is written in
+    place in two halves, half a frame apart, like a sampler without a
+    temporary directory.
+
+    Parameters:
+        directory (str or Path): Output directory, the `--dir` of thermal-raw.
+        width (int): Width of the visible frames.
+        height (int): Height of the visible frames.
+        thermal_width (int): Width of the thermal frames.
+        thermal_height (int): Height of the thermal frames.
+        fps (float): Frames per second.
+        frames (int): Frames to write before exiting, None to stream.
+        variants (int): Distinct frames prepared and repeated.
+        atomic (bool): Rename complete files into `directory`.
+    '''
+    def __init__(self, directory, width=DEFAULT_SIM_WIDTH, height=DEFAULT_SIM_HEIGHT,
+                 thermal_width=DEFAULT_SIM_THERMAL_WIDTH, thermal_height=DEFAULT_SIM_THERMAL_HEIGHT,
+                 fps=DEFAULT_SIM_FPS, frames=None, variants=4, atomic=True):
+        self.directory = Path(directory)
+        self.width = width
+        self.height = height
+        self.thermal_width = thermal_width
+        self.thermal_height = thermal_height
+        self.fps = fps
+        self.frames = frames
+        self.variants = variants
+        self.atomic = atomic
+
+    def _prepare(self, tmp):
+        rng = np.random.default_rng(0)
+        y, x = np.mgrid[0:self.height, 0:self.width]
+        grey = (x * 255 // max(self.width - 1, 1) + y * 255 // max(self.height - 1, 1)) // 2
+        bgra = np.repeat(grey[:, :, None].astype(np.uint8), 4, axis=2)
+        bgra[:, :, 3] = 255
+        rgb = bgra.tobytes()
+
+        y, x = np.mgrid[0:self.thermal_height, 0:self.thermal_width]
+        scene = 15 + 10 * y / self.thermal_height + 25 * np.exp(
+            -((x - self.thermal_width / 2) ** 2 + (y - self.thermal_height / 3) ** 2) / (2 * 20.0 ** 2))
+        csvs = []
+        for i in range(self.variants):
+            path = Path(tmp) / f"variant{i}.csv"
+            write_celsius_csv(path, (scene + rng.normal(0, 0.1, scene.shape)).astype(np.float32))
+            csvs.append(path.read_bytes())
+            path.unlink()
+        return rgb, csvs
+
+    def run(self, out=sys.stdout):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".thermal-raw-", dir=self.directory.parent)
+        try:
+            rgb, csvs = self._prepare(tmp)
+            rgb_name = f"{self.width}x{self.height}.rgb"
+            csv_name = f"left_{self.thermal_width}x{self.thermal_height}_14bit.thermal.celsius.csv"
+            next_frame = time.monotonic()
+            frame = 0
+            while self.frames is None or frame < self.frames:
+                frame += 1
+                ts = time.time_ns()
+                try:
+                    print(f"received video frame #{frame} ts (system): {ts}", file=out, flush=True)
+                except BrokenPipeError:
+                    # the plugin stopped reading, as thermal-raw exits on SIGPIPE
+                    break
+                for name, data in ((rgb_name, rgb), (csv_name, csvs[frame % len(csvs)])):
+                    if self.atomic:
+                        path = os.path.join(tmp, f"{ts}_{name}")
+                        with open(path, "wb") as f:
+                            f.write(data)
+                        os.rename(path, self.directory / f"{ts}_{name}")
+                    else:
+                        with open(self.directory / f"{ts}_{name}", "wb") as f:
+                            f.write(data[:len(data) // 2])
+                            f.flush()
+                            time.sleep(0.5 / self.fps)
+                            f.write(data[len(data) // 2:])
+                next_frame += 1 / self.fps
+                time.sleep(max(0.0, next_frame - time.monotonic()))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def write_sampler(path, **options):
+    '''
+    Writes an executable at `path` that runs `FakeSampler` with `options`
+    (its keyword arguments) and takes the thermal-raw command line. Returns
+    the path, to use as `--sampler`.
+    '''
+    path = Path(path)
+    flags = " ".join(f"--{name.replace('_', '-')} {shlex.quote(str(value))}" for name, value in options.items())
+    path.write_text("#!/bin/sh\n"
+                    f"exec {shlex.quote(sys.executable)} {shlex.quote(str(Path(__file__).resolve()))} "
+                    f"thermal-raw {flags} \"$@\"\n")
+    path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def _serve_camera(args):
+    pt = SimulatedPT(pan_speed=args.pan_speed, tilt_speed=args.tilt_speed, time_scale=args.time_scale)
+    with StubCameraServer(args.user, args.password, latency=args.latency, host=args.host, port=args.port,
+                          pt=pt) as camera:
+        print(f"Simulated camera on {camera.address}, stop with Ctrl-C", flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+def _run_sampler(args):
+    # terminate() from CaptureSession.stop should still remove the temporary directory
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    FakeSampler(args.dir, width=args.width, height=args.height, thermal_width=args.thermal_width,
+                thermal_height=args.thermal_height, fps=args.fps, frames=args.frames).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated Mobotix camera and thermal-raw sampler.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    camera = commands.add_parser("camera", help="Serve the PT control and snapshot endpoints.")
+    camera.add_argument("--host", default="127.0.0.1")
+    camera.add_argument("--port", type=int, default=8080)
+    camera.add_argument("--user", default="admin")
+    camera.add_argument("--password", default="meinsm")
+    camera.add_argument("--latency", type=float, default=0.0, help="Seconds each command takes to answer.")
+    camera.add_argument("--pan-speed", type=float, default=DEFAULT_PAN_SPEED, help="deg/s")
+    camera.add_argument("--tilt-speed", type=float, default=DEFAULT_TILT_SPEED, help="deg/s")
+    camera.add_argument("--time-scale", type=float, default=1.0, help="Multiplies the preset travel times.")
+    camera.set_defaults(func=_serve_camera)
+
+    sampler = commands.add_parser("thermal-raw", help="Write synthetic frames like the thermal-raw sampler.")
+    # thermal-raw options, the camera ones are accepted and ignored
+    sampler.add_argument("--url")
+    sampler.add_argument("--user")
+    sampler.add_argument("--password")
+    sampler.add_argument("--dir", required=True)
+    sampler.add_argument("--width", type=int, default=DEFAULT_SIM_WIDTH)
+    sampler.add_argument("--height", type=int, default=DEFAULT_SIM_HEIGHT)
+    sampler.add_argument("--thermal-width", type=int, default=DEFAULT_SIM_THERMAL_WIDTH)
+    sampler.add_argument("--thermal-height", type=int, default=DEFAULT_SIM_THERMAL_HEIGHT)
+    sampler.add_argument("--fps", type=float, default=DEFAULT_SIM_FPS)
+    sampler.add_argument("--frames", type=int, default=None, help="Exit after this many frames.")
+    sampler.set_defaults(func=_run_sampler)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
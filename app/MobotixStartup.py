@@ -0,0 +1,83 @@
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# modules imported by app.py before it parses its arguments
+STARTUP_MODULES = [
+    'numpy',
+    'timeout_decorator',
+    'waggle.plugin',
+    'MobotixThermal',
+    'MobotixTrace',
+    'MobotixImaging',
+    'MobotixWatcher',
+    'MobotixControl',
+    'MobotixNetCDF',
+    'MobotixArchive',
+    'MobotixPanorama',
+    'MobotixPipeline',
+    'MobotixPresets',
+    'MobotixSettle',
+    'MobotixSweep',
+    'MobotixUpload',
+    'MobotixGate',
+    'MobotixStats',
+    'MobotixScan',
+    'MobotixMulti',
+]
+
+# dependencies imported on first use by the imaging, thermal, NetCDF and plot paths
+LAZY_MODULES = [
+    'PIL.Image',
+    'cv2',
+    'netCDF4',
+    'xarray',
+    'matplotlib.pyplot',
+]
+
+_MEASURE = '''
+import importlib, json, sys, time
+sys.path.insert(0, sys.argv[1])
+costs = []
+for name in sys.argv[2:]:
+    start = time.perf_counter()
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        costs.append((name, None))
+        continue
+    costs.append((name, time.perf_counter() - start))
+print(json.dumps(costs))
+'''
+
+
+def measure_imports(modules=STARTUP_MODULES + LAZY_MODULES):
+    '''
+    Imports `modules` one after the other in a fresh interpreter and returns
+    (module, seconds) pairs, None for modules that are not installed. Each
+    cost is what the module adds on top of the modules before it.
+    '''
+    app_dir = str(Path(__file__).resolve().parent)
+    result = subprocess.run([sys.executable, '-c', _MEASURE, app_dir, *modules],
+                            check=True, capture_output=True, text=True)
+    return [tuple(cost) for cost in json.loads(result.stdout)]
+
+
+def measure_call(func, *args, **kwargs):
+    '''Returns the result of `func` and the seconds it took.'''
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(costs, title):
+    '''Logs a table of (name, seconds) costs and returns their total.'''
+    total = sum(seconds for _, seconds in costs if seconds is not None)
+    logging.info(title)
+    for name, seconds in costs:
+        logging.info("  %-20s %s", name, "not installed" if seconds is None else f"{seconds * 1000:8.1f} ms")
+    logging.info("  %-20s %8.1f ms", "total", total * 1000)
+    return total
@@ -0,0 +1,121 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from MobotixGate import position_key
+from MobotixTrace import traced
+from MobotixWatcher import frame_timestamp
+
+# temperatures (degC) above which pixels are counted as hot
+DEFAULT_HOT_THRESHOLDS = "40,60"
+
+# percentiles published besides the minimum, mean and maximum
+STATS_PERCENTILES = [5, 50, 95]
+
+
+def parse_thresholds(arg):
+    '''Parses comma-separated temperatures, an empty string gives none.'''
+    return [float(t) for t in str(arg).split(',') if t.strip()]
+
+
+def load_rois(path):
+    '''
+    Reads the regions of interest of each position from a JSON file:
+
+        {"5": {"roof": [0, 0, 80, 336]}, "7_SS": {"stack": "stack_mask.npy"}}
+
+    Positions are keyed as the preset, or the preset and direction in
+    direction scans. A region is a [top, left, bottom, right] box in
+    thermal pixels or a boolean .npy mask of the frame size, relative to
+    the JSON file. Returns {position: {name: box or mask}}.
+    '''
+    path = Path(path)
+    with open(path) as f:
+        config = json.load(f)
+    rois = {}
+    for key, regions in config.items():
+        rois[str(key)] = {}
+        for name, region in regions.items():
+            if isinstance(region, str):
+                rois[str(key)][name] = np.load(path.parent / region).astype(bool)
+            elif len(region) == 4:
+                rois[str(key)][name] = tuple(int(v) for v in region)
+            else:
+                raise ValueError(f"Region {name} of position {key} in {path} is not a box or a mask file")
+    return rois
+
+
+def frame_stats(values, thresholds=()):
+    '''
+    Returns the minimum, mean, percentiles (see `STATS_PERCENTILES`), maximum
+    and hot-pixel counts above each of the `thresholds` of `values`, in a
+    few vectorized passes over the pixels. NaN pixels are ignored.
+    '''
+    values = np.asarray(values, dtype=np.float32).ravel()
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return {}
+    quantiles = np.percentile(values, [0, *STATS_PERCENTILES, 100])
+    stats = {'min': float(quantiles[0]), 'mean': float(values.mean(dtype=np.float64)), 'max': float(quantiles[-1])}
+    for q, value in zip(STATS_PERCENTILES, quantiles[1:-1]):
+        stats[f'p{q}'] = float(value)
+    if len(thresholds):
+        hot = np.count_nonzero(values > np.asarray(thresholds, dtype=np.float32)[:, None], axis=1)
+        stats['hot'] = {t: int(count) for t, count in zip(thresholds, hot)}
+    return stats
+
+
+class ThermalStats:
+    ''' Publishes summary statistics of every thermal frame of a scan.
+
+    For the whole frame and each region of interest of the position, the
+    minimum, mean, percentiles and maximum are published as `thermal.<stat>`
+    and the pixels above each hot threshold as `thermal.hot.count`, tagged
+    with the scan meta, the region (`roi`, `frame` for the whole frame) and
+    the `threshold`. Dashboards chart these without downloading the frames.
+
+    Parameters:
+        thresholds (list of float): Hot-pixel temperatures in degC.
+        rois (dict): Regions of interest per position, see `load_rois`.
+    '''
+    def __init__(self, thresholds=(), rois=None):
+        self.thresholds = list(thresholds)
+        self.rois = rois or {}
+
+    def regions(self, meta):
+        '''Returns the regions of interest of the position described by `meta`.'''
+        key = position_key(meta)
+        if key in self.rois:
+            return self.rois[key]
+        return self.rois.get(str(meta['position']), {})
+
+    @traced('stats')
+    def compute(self, data, meta):
+        '''Returns {roi: stats} of the frame `data` taken at the position of `meta`.'''
+        result = {'frame': frame_stats(data, self.thresholds)}
+        for name, region in self.regions(meta).items():
+            if isinstance(region, tuple):
+                top, left, bottom, right = region
+                values = data[top:bottom, left:right]
+            elif region.shape == data.shape:
+                values = data[region]
+            else:
+                logging.warning("Mask of region %s is %s, the frame is %s, skipping it", name, region.shape, data.shape)
+                continue
+            result[name] = frame_stats(values, self.thresholds)
+        return result
+
+    def publish(self, uploader, path, data, meta):
+        '''Publishes the statistics of the frame `data` read from `path` with the `uploader`.'''
+        timestamp = frame_timestamp(path)
+        for roi, stats in self.compute(data, meta).items():
+            roi_meta = {**meta, 'roi': roi}
+            for name, value in stats.items():
+                if name == 'hot':
+                    for threshold, count in value.items():
+                        uploader.publish('thermal.hot.count', count, meta={**roi_meta, 'threshold': f'{threshold:g}'},
+                                         timestamp=timestamp)
+                else:
+                    uploader.publish(f'thermal.{name}', value, meta=roi_meta, timestamp=timestamp)
@@ -0,0 +1,178 @@
+import datetime
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from MobotixPanorama import DEFAULT_PANORAMA_FOV, MOVE_AXES, angle_shift, estimate_offsets
+from MobotixPresets import MOVE_AXIS, MOVE_SPEED_BYTES, default_speed_table
+from MobotixThermal import read_celsius_csv
+from MobotixTrace import traced
+from MobotixWatcher import frame_timestamp
+
+# seconds between the frames kept from a continuous sweep, 0 keeps every frame
+DEFAULT_SWEEP_INTERVAL = 0.5
+
+# seconds the head turns at each speed while calibrating
+DEFAULT_CALIBRATION_DURATION = 2.0
+
+# fraction of the frame searched around the expected shift while calibrating,
+# the real speeds may be far from the estimated ones
+CALIBRATION_SEARCH = 0.5
+
+SweepRecording = namedtuple('SweepRecording', ['frames', 'start', 'stop'])
+
+
+def speed_table_path(workdir):
+    '''File next to the workdir keeping the calibrated speeds between runs.'''
+    workdir = Path(workdir)
+    return workdir.with_name(workdir.name + ".speeds.json")
+
+
+def _read_speed_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logging.warning(f"Ignoring the speed table {path}: {e}")
+        return {}
+
+
+def load_speed_table(path):
+    '''
+    Returns the speed table of `MobotixPresets.default_speed_table` with
+    the angular velocities calibrated in the JSON file `path`, if any:
+
+        {"pan": {"1": 0.93, "3": 28.7}, "fov": 45.0, "calibrated": "2024-05-02T10:11:12"}
+    '''
+    table = default_speed_table()
+    saved = _read_speed_file(path)
+    for axis in table:
+        table[axis].update({int(speed): float(velocity) for speed, velocity in saved.get(axis, {}).items()})
+    return table
+
+
+def save_speed_table(path, velocities, fov):
+    '''
+    Adds the measured `velocities` ({axis: {speed: deg/s}}) to the speed
+    table file `path`, with the field of view they were measured with.
+    '''
+    path = Path(path)
+    saved = _read_speed_file(path)
+    for axis, speeds in velocities.items():
+        saved.setdefault(axis, {}).update({str(speed): velocity for speed, velocity in speeds.items()})
+    saved.update(fov=fov, calibrated=datetime.datetime.now().isoformat(timespec='seconds'))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, 'w') as f:
+        json.dump(saved, f, indent=1)
+    os.replace(tmp, path)
+
+
+def group_frames(files):
+    '''Groups the files of a stream by frame, as (timestamp, files) sorted by time.'''
+    frames = {}
+    for path in files:
+        timestamp = frame_timestamp(path)
+        if timestamp is not None:
+            frames.setdefault(timestamp, []).append(Path(path))
+    return sorted(frames.items())
+
+
+def frame_angles(timestamps, start, stop, velocity):
+    '''
+    Estimates the degrees the head had turned at each of `timestamps` (ns)
+    when it turned at `velocity` deg/s from `start` to `stop` (ns).
+    '''
+    elapsed = np.clip(np.asarray(timestamps, dtype=np.int64) - start, 0, stop - start) / 1e9
+    return velocity * elapsed
+
+
+@traced('sweep')
+def continuous_sweep(mobot_pt, mobot_im, direction, speed, duration, interval=DEFAULT_SWEEP_INTERVAL, tag=None):
+    '''
+    Turns the head in `direction` at `speed` for `duration` seconds in one
+    move while the imager keeps a frame of its stream every `interval`
+    seconds, from a frame before the move to a frame after it. Returns a
+    `SweepRecording` of the frames, as (timestamp, files), and of the start
+    and stop times of the move (ns).
+    '''
+    mobot_im.start_stream(tag=tag, interval=interval)
+    try:
+        start = time.time_ns()
+        if mobot_pt.start_move(direction, speed) is None:
+            raise ValueError(f"Invalid move speed {speed}")
+        time.sleep(duration)
+        mobot_pt.stop()
+        stop = time.time_ns()
+    finally:
+        files = mobot_im.stop_stream()
+    return SweepRecording(group_frames(files), start, stop)
+
+
+def estimate_velocity(frames, timestamps, direction, velocity, fov=DEFAULT_PANORAMA_FOV, search=CALIBRATION_SEARCH):
+    '''
+    Measures the angular velocity (deg/s) of the head from the thermal
+    `frames` taken at `timestamps` (ns) while it turned in `direction`: the
+    pixels between consecutive frames, found by `estimate_offsets` around
+    the shift expected at `velocity` deg/s, over the seconds between them.
+    Returns None when no pair of frames could be aligned.
+    '''
+    frames = np.asarray(frames, dtype=np.float32)
+    if len(frames) < 2:
+        return None
+    seconds = np.diff(np.asarray(timestamps, dtype=np.int64)) / 1e9
+    prior = np.stack(angle_shift(direction, velocity * seconds, frames.shape[-2:], fov=fov), axis=1)
+    offsets, fallback = estimate_offsets(frames, prior, search=search)
+    if fallback.all():
+        return None
+    moved = offsets[~fallback] @ np.array(MOVE_AXES[direction])
+    return float(moved.sum() / seconds[~fallback].sum()) * fov / frames.shape[-1]
+
+
+def calibrate_speeds(mobot_pt, mobot_im, uploader, path, direction='right', speeds=tuple(MOVE_SPEED_BYTES),
+                     duration=DEFAULT_CALIBRATION_DURATION, fov=DEFAULT_PANORAMA_FOV, start=None):
+    '''
+    Measures the angular velocity of each of `speeds` on the axis of
+    `direction`: the head turns at the speed for `duration` seconds while
+    every frame is kept, and `estimate_velocity` runs on the thermal frames
+    taken during the move. `start()`, e.g. a move back to a preset, runs
+    before each speed. The velocities are published as
+    `calibration.velocity` and saved to the speed table file `path`;
+    speeds that could not be measured keep their previous value. Returns
+    the speed table.
+    '''
+    table = load_speed_table(path)
+    axis = MOVE_AXIS[direction]
+    measured = {}
+    for speed in speeds:
+        if start is not None:
+            start()
+        recording = continuous_sweep(mobot_pt, mobot_im, direction, speed, duration, interval=0,
+                                     tag=f"calibrate-S{speed}")
+        times, frames = [], []
+        for timestamp, files in recording.frames:
+            thermal = [name for name in files if name.name.endswith('.thermal.celsius.csv')]
+            if thermal and recording.start <= timestamp <= recording.stop:
+                times.append(timestamp)
+                frames.append(read_celsius_csv(thermal[0])[1])
+            for name in files:
+                name.unlink(missing_ok=True)
+
+        velocity = estimate_velocity(frames, times, direction, table[axis][speed], fov=fov)
+        if velocity is None:
+            logging.warning(f"Cannot measure the {axis} velocity of speed {speed} from {len(frames)} frames")
+            continue
+        logging.info(f"Speed {speed} turns {velocity:.2f} deg/s ({axis}), {table[axis][speed]:.2f} before")
+        table[axis][speed] = measured[speed] = velocity
+        uploader.publish('calibration.velocity', velocity, meta={'axis': axis, 'speed': str(speed)})
+
+    if measured:
+        save_speed_table(path, {axis: measured}, fov)
+    return table
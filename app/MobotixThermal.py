@@ -0,0 +1,231 @@
+import json
+import logging
+import struct
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from MobotixNetCDF import INT16_OFFSET, INT16_SCALE
+
+# compact thermal frame: magic, header length, JSON header, zero padding to
+# THERMAL_ALIGN bytes, then the little-endian frame in row-major order
+THERMAL_MAGIC = b"MTXTHRM1"
+THERMAL_SUFFIX = ".tfr"
+THERMAL_ALIGN = 64
+_THERMAL_PREFIX = struct.Struct("<8sI")
+
+
+def read_celsius_header(f):
+    '''
+    Reads the `key;value` header of a thermal-raw CSV from an open binary file.
+    The header ends at the first blank line, the file is left positioned on the
+    first row of data.
+    '''
+    metadata = {}
+    for line in f:
+        line = line.strip()
+        if not line:
+            break
+        key, value = line.decode().split(';')
+        metadata[key] = value
+    return metadata
+
+
+def _parse_rows(lines, out):
+    # numpy's C text reader (numpy >= 1.23) parses the rows without creating
+    # intermediate Python floats, into an array of its own that is then
+    # copied into `out`. It is about twice as fast as np.fromstring on the
+    # body bytes, which allocates as much.
+    values = np.loadtxt(lines, delimiter=';', dtype=out.dtype, ndmin=2)
+    if values.shape != out.shape:
+        raise ValueError(f"Expected {out.shape} values, found {values.shape}.")
+    out[...] = values
+
+
+def read_celsius_csv(file_path, chunk_rows=None, out=None, dtype=np.float32):
+    '''
+    Reads a `*.thermal.celsius.csv` file written by the thermal-raw sampler,
+    or with `dtype=np.uint16` a `*.thermal.uint.csv` file of sensor counts.
+
+    The numeric body is parsed by numpy's C reader and copied into an array
+    of `dtype` and shape (height, width). With `chunk_rows` the body is
+    parsed that many rows at a time, which keeps the parsed temporary small
+    for large sensors. A preallocated `out` array can be passed to reuse the
+    result array from frame to frame.
+
+    Returns:
+        (metadata, temperature_data)
+    '''
+    file_path = Path(file_path)
+    with file_path.open('rb') as f:
+        metadata = read_celsius_header(f)
+        height, width = int(metadata['height']), int(metadata['width'])
+
+        if out is None:
+            out = np.empty((height, width), dtype=dtype)
+        elif out.shape != (height, width):
+            raise ValueError(f"Output array shape {out.shape} does not match {height}x{width}.")
+
+        try:
+            if chunk_rows is None:
+                _parse_rows(f, out)
+            else:
+                for row in range(0, height, chunk_rows):
+                    rows = out[row:row + chunk_rows]
+                    _parse_rows(islice(f, rows.shape[0]), rows)
+        except ValueError as e:
+            logging.error(f"Malformed celsius CSV {file_path}: {e}")
+            raise
+
+    return metadata, out
+
+
+def write_celsius_csv(file_path, temperature_data, sensor='left'):
+    '''
+    Writes a temperature grid in the same layout as the thermal-raw sampler,
+    used to produce synthetic frames for tests and benchmarks.
+    '''
+    height, width = temperature_data.shape
+    header = (
+        f"sensor;{sensor}\n"
+        "bit depth;14 bit\n"
+        f"width;{width}\n"
+        f"height;{height}\n"
+        "resolution;high\n"
+        "advanced radiometry support;yes\n"
+        "unit;degrees Celsius\n"
+        "\n"
+    )
+    with Path(file_path).open('w') as f:
+        f.write(header)
+        np.savetxt(f, temperature_data, fmt='%.6g', delimiter=';')
+
+
+def write_thermal_frame(file_path, data, metadata, kind='celsius'):
+    '''
+    Writes a frame in the compact thermal format. `celsius` frames are stored
+    as int16 centi-degrees, with the `scale_factor` and `add_offset` of the
+    int16 NetCDF packing (-77.67 to 577.67 degC, values outside are clipped);
+    `counts` frames as the uint16 sensor counts. The CSV header is kept in
+    the JSON header of the file. Returns the path written.
+    '''
+    if kind == 'celsius':
+        low = INT16_OFFSET + (np.iinfo(np.int16).min + 1) * INT16_SCALE
+        high = INT16_OFFSET + np.iinfo(np.int16).max * INT16_SCALE
+        packed = np.rint((np.clip(data, low, high) - INT16_OFFSET) / INT16_SCALE).astype('<i2')
+        scale, offset, units = INT16_SCALE, INT16_OFFSET, 'degrees Celsius'
+    elif kind == 'counts':
+        packed = np.asarray(data).astype('<u2')
+        scale, offset, units = 1, 0, 'counts'
+    else:
+        raise ValueError(f"Unknown thermal frame kind '{kind}'.")
+
+    header = json.dumps({
+        'kind': kind,
+        'dtype': packed.dtype.str,
+        'shape': list(packed.shape),
+        'scale_factor': scale,
+        'add_offset': offset,
+        'units': units,
+        'metadata': metadata,
+    }).encode()
+    start = _THERMAL_PREFIX.size + len(header)
+    padding = -start % THERMAL_ALIGN
+    with Path(file_path).open('wb') as f:
+        f.write(_THERMAL_PREFIX.pack(THERMAL_MAGIC, len(header) + padding))
+        f.write(header + b" " * padding)
+        f.write(packed.tobytes())
+    return Path(file_path)
+
+
+def read_thermal_frame(file_path, mmap=True):
+    '''
+    Reads a compact thermal frame. Returns its header, with the CSV header
+    under `metadata`, and the stored int16/uint16 array, memory-mapped
+    read-only unless `mmap` is False. `thermal_values` decodes it.
+    '''
+    with Path(file_path).open('rb') as f:
+        magic, length = _THERMAL_PREFIX.unpack(f.read(_THERMAL_PREFIX.size))
+        if magic != THERMAL_MAGIC:
+            raise ValueError(f"{file_path} is not a compact thermal frame.")
+        header = json.loads(f.read(length))
+        offset = _THERMAL_PREFIX.size + length
+        dtype, shape = np.dtype(header['dtype']), tuple(header['shape'])
+        if mmap:
+            data = np.memmap(f, dtype=dtype, mode='r', offset=offset, shape=shape)
+        else:
+            data = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return header, data
+
+
+def thermal_values(header, data):
+    '''Returns the frame of `read_thermal_frame` in its units, degrees Celsius or counts, as float32.'''
+    if header['kind'] == 'counts':
+        return data.astype(np.float32)
+    # float64 arithmetic, so every value rounds to the nearest 0.01 degC
+    return (data * np.float64(header['scale_factor']) + header['add_offset']).astype(np.float32)
+
+
+class FrameAccumulator:
+    ''' Per-pixel running statistics of the thermal frames of one position.
+
+    Frames are folded in as they are read with Welford's update, vectorized
+    over the frame, into float32 arrays allocated for the first frame: the
+    memory used stays at a few frames whatever the number of frames. `read`
+    parses celsius CSVs into a buffer reused for every frame.
+
+    Attributes:
+        count (int): Frames added.
+        start, end (float): Times of the first and last frames, in seconds since the epoch.
+        mean, minimum, maximum (np.ndarray): Per-pixel statistics of the frames.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.start = self.end = None
+        self.mean = self.minimum = self.maximum = None
+        self._m2 = self._delta = self._scratch = self._frame = None
+
+    def add(self, data, time=None):
+        '''Adds the temperature grid `data` taken at `time` (seconds since the epoch).'''
+        data = np.asarray(data, dtype=np.float32)
+        if time is not None:
+            self.start = time if self.start is None else min(self.start, time)
+            self.end = time if self.end is None else max(self.end, time)
+        if self.count == 0:
+            self.mean = data.copy()
+            self.minimum = data.copy()
+            self.maximum = data.copy()
+            self._m2 = np.zeros_like(self.mean)
+            self._delta = np.empty_like(self.mean)
+            self._scratch = np.empty_like(self.mean)
+            self.count = 1
+            return
+        if data.shape != self.mean.shape:
+            raise ValueError(f"Frame of shape {data.shape} does not match {self.mean.shape}.")
+        self.count += 1
+        # mean += (x - mean) / n, m2 += (x - mean_before) * (x - mean_after)
+        np.subtract(data, self.mean, out=self._delta)
+        np.multiply(self._delta, np.float32(1 / self.count), out=self._scratch)
+        self.mean += self._scratch
+        np.subtract(data, self.mean, out=self._scratch)
+        self._scratch *= self._delta
+        self._m2 += self._scratch
+        np.minimum(self.minimum, data, out=self.minimum)
+        np.maximum(self.maximum, data, out=self.maximum)
+
+    def read(self, file_path, time=None, chunk_rows=None):
+        '''Reads a celsius CSV (see `read_celsius_csv`) and adds its frame. Returns the CSV header.'''
+        metadata, self._frame = read_celsius_csv(file_path, chunk_rows=chunk_rows, out=self._frame)
+        self.add(self._frame, time)
+        return metadata
+
+    def variance(self, ddof=1):
+        '''Per-pixel variance of the frames, zero with fewer than `ddof` + 1 frames.'''
+        if self.count <= ddof:
+            return np.zeros_like(self.mean)
+        return self._m2 / np.float32(self.count - ddof)
+
+    def std(self, ddof=1):
+        '''Per-pixel standard deviation of the frames.'''
+        return np.sqrt(self.variance(ddof))
@@ -0,0 +1,142 @@
+"""
+Timing spans of the scan pipeline.
+
+Steps are timed with the `span` context manager or the `traced` decorator
+of the module `TRACER`:
+
+    with span('settle', position='5'):
+        settle.wait(4, 5)
+
+    @traced('convert.jpeg')
+    def convert_rgb_to_jpg(self, fname_rgb):
+        ...
+
+Spans add up until `TRACER.publish` is called once per loop, which publishes
+the count, median, 95th percentile and maximum of each step. With a dump
+file, every span is also written to it in the Chrome trace event format,
+which chrome://tracing and https://ui.perfetto.dev open as a timeline.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+TRACE_STATS = ['p50', 'p95', 'max']
+
+
+class Tracer:
+    ''' Collects the duration of the spans of each pipeline step.
+
+    Recording a span costs two clock reads and a list append; dump events
+    are kept in memory and written out by `publish`, `flush` or `close`.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._events = []
+        self._dump = None
+        # maps perf_counter readings to wall-clock microseconds for the dump
+        self._wall_offset = time.time() - time.perf_counter()
+
+    def dump_to(self, path):
+        '''Also writes every span to `path`, appending to a previous dump.'''
+        self.close()
+        self._dump = open(path, 'a')
+        if self._dump.tell() == 0:
+            # the JSON array format of trace events may be left unterminated
+            self._dump.write('[\n')
+
+    def record(self, name, start, seconds, meta=None):
+        '''Adds a span of `seconds` that started at `start` (time.perf_counter).'''
+        with self._lock:
+            self._durations.setdefault(name, []).append(seconds)
+            if self._dump is not None:
+                self._events.append((name, start, seconds, threading.get_ident(), meta))
+
+    @contextmanager
+    def span(self, name, **meta):
+        '''Times the `with` block as a span of step `name`.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start, meta)
+
+    def traced(self, name):
+        '''Decorator timing every call of a function as a span of step `name`.'''
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, start, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def summary(self, reset=True):
+        '''
+        Returns {step: {'count', 'total', 'p50', 'p95', 'max'}} in seconds for
+        the spans recorded since the last reset.
+        '''
+        with self._lock:
+            durations = self._durations
+            if reset:
+                self._durations = {}
+        stats = {}
+        for name, seconds in sorted(durations.items()):
+            p50, p95 = np.percentile(seconds, [50, 95])
+            stats[name] = {'count': len(seconds), 'total': float(np.sum(seconds)),
+                           'p50': float(p50), 'p95': float(p95), 'max': float(np.max(seconds))}
+        return stats
+
+    def publish(self, plugin, meta={}):
+        '''
+        Publishes `trace.count` and `trace.<stat>.sec` of every step, with the
+        step in the `span` meta, and starts a new summary. Returns the stats.
+        '''
+        stats = self.summary()
+        logging.info("%-16s %6s %8s %8s %8s %8s", "span", "count", "total", "p50", "p95", "max")
+        for name, s in stats.items():
+            logging.info("%-16s %6d %8.3f %8.3f %8.3f %8.3f", name, s['count'], s['total'], s['p50'], s['p95'], s['max'])
+            span_meta = {**meta, 'span': name}
+            plugin.publish('trace.count', s['count'], meta=span_meta)
+            for stat in TRACE_STATS:
+                plugin.publish(f'trace.{stat}.sec', s[stat], meta=span_meta)
+        self.flush()
+        return stats
+
+    def flush(self):
+        '''Writes the pending spans to the dump file.'''
+        with self._lock:
+            events, self._events = self._events, []
+            dump = self._dump
+        if dump is None:
+            return
+        pid = os.getpid()
+        for name, start, seconds, tid, meta in events:
+            event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round((start + self._wall_offset) * 1e6), 'dur': round(seconds * 1e6)}
+            if meta:
+                event['args'] = meta
+            dump.write(json.dumps(event) + ',\n')
+        dump.flush()
+
+    def close(self):
+        '''Writes the pending spans and closes the dump file.'''
+        self.flush()
+        if self._dump is not None:
+            self._dump.close()
+            self._dump = None
+
+
+TRACER = Tracer()
+span = TRACER.span
+traced = TRACER.traced
@@ -0,0 +1,182 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from MobotixTrace import traced
+
+DEFAULT_UPLOAD_WORKERS = 2
+
+# files waiting in memory for a worker before upload_file blocks the scan
+DEFAULT_UPLOAD_PENDING = 64
+
+DEFAULT_UPLOAD_RETRIES = 5
+DEFAULT_UPLOAD_BACKOFF = 1.0
+
+_ENTRY_META = "entry.json"
+
+
+def spool_dir(workdir):
+    '''Directory next to the workdir holding files until they are uploaded.'''
+    workdir = Path(workdir)
+    return workdir.with_name(workdir.name + ".uploads")
+
+
+class UploadQueue:
+    ''' Uploads files through `plugin.upload_file` on worker threads.
+
+    `upload_file` takes the same arguments as `Plugin.upload_file`, so it can
+    stand in for the plugin wherever files are uploaded. Each file is moved
+    into its own directory of the on-disk spool, with its meta and timestamp
+    beside it, before it is queued; files still in the spool when the queue
+    is created again (after a restart or a killed scan) are uploaded first.
+    Failed uploads are retried with exponential backoff and left in the
+    spool for the next run once the retries are used up. With `workers=0`
+    files are uploaded inline.
+
+    Parameters:
+        plugin (Plugin): Plugin uploading the files.
+        spool (str or Path): Spool directory, created if needed.
+        workers (int): Number of upload threads.
+        max_pending (int): Maximum number of queued files.
+        retries (int): Attempts per file.
+        backoff (float): Seconds before the first retry, doubled for each retry.
+    '''
+    def __init__(self, plugin, spool, workers=DEFAULT_UPLOAD_WORKERS, max_pending=DEFAULT_UPLOAD_PENDING,
+                 retries=DEFAULT_UPLOAD_RETRIES, backoff=DEFAULT_UPLOAD_BACKOFF):
+        self.plugin = plugin
+        self.spool = Path(spool)
+        self.spool.mkdir(parents=True, exist_ok=True)
+        self.retries = max(retries, 1)
+        self.backoff = backoff
+        self._jobs = queue.Queue(maxsize=max(max_pending, 1))
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._uploaded = 0
+        self._uploaded_bytes = 0
+        self._failed = 0
+        self._since = time.monotonic()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        self._recover()
+
+    def _recover(self):
+        entries = sorted(p for p in self.spool.iterdir() if (p / _ENTRY_META).exists())
+        if entries:
+            logging.info("Resuming %d uploads left in %s", len(entries), self.spool)
+        for entry in entries:
+            self._submit(entry)
+        # directories of entries interrupted before their meta was written
+        for entry in self.spool.iterdir():
+            if entry.is_dir() and not (entry / _ENTRY_META).exists() and not any(entry.iterdir()):
+                entry.rmdir()
+
+    def _submit(self, entry):
+        if self._threads:
+            self._jobs.put(entry)
+        else:
+            self._upload(entry)
+
+    @traced('upload')
+    def _upload(self, entry):
+        with open(entry / _ENTRY_META) as f:
+            job = json.load(f)
+        path = entry / job['name']
+        size = path.stat().st_size if path.exists() else 0
+
+        for attempt in range(self.retries):
+            try:
+                self.plugin.upload_file(path, meta=job['meta'], timestamp=job['timestamp'])
+                break
+            except Exception as e:
+                if attempt + 1 == self.retries:
+                    logging.error("Upload of %s failed, keeping it in %s: %s", path.name, entry, e)
+                    with self._lock:
+                        self._failed += 1
+                    return False
+                delay = self.backoff * 2 ** attempt
+                logging.warning("Upload of %s failed (%s), retrying in %.1f s", path.name, e, delay)
+                time.sleep(delay)
+
+        shutil.rmtree(entry, ignore_errors=True)
+        with self._lock:
+            self._uploaded += 1
+            self._uploaded_bytes += size
+        return True
+
+    def _work(self):
+        while True:
+            entry = self._jobs.get()
+            try:
+                if entry is None:
+                    return
+                self._upload(entry)
+            except Exception as e:
+                logging.exception("Upload worker failed on %s: %s", entry, e)
+            finally:
+                self._jobs.task_done()
+
+    @traced('upload.spool')
+    def upload_file(self, path, meta={}, timestamp=None):
+        '''
+        Moves `path` into the spool and queues its upload, blocking while
+        `max_pending` files are waiting.
+        '''
+        path = Path(path)
+        entry = self.spool / f"{time.time_ns()}-{next(self._counter):06d}"
+        entry.mkdir()
+        shutil.move(str(path), entry / path.name)
+        tmp = entry / (_ENTRY_META + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({'name': path.name, 'meta': dict(meta), 'timestamp': timestamp}, f)
+        os.replace(tmp, entry / _ENTRY_META)
+        self._submit(entry)
+
+    def depth(self):
+        '''Number of files in the spool waiting for upload.'''
+        return sum(1 for _ in self.spool.iterdir())
+
+    def publish(self, *args, **kwargs):
+        '''Publishes a measurement through the uploading plugin, as `Plugin.publish`.'''
+        self.plugin.publish(*args, **kwargs)
+
+    def publish_metrics(self, plugin=None, meta={}):
+        '''
+        Publishes the spool depth and the upload throughput since the last
+        call, through `plugin` or the uploading plugin.
+        '''
+        plugin = plugin or self.plugin
+        now = time.monotonic()
+        with self._lock:
+            elapsed = max(now - self._since, 1e-9)
+            uploaded, uploaded_bytes, failed = self._uploaded, self._uploaded_bytes, self._failed
+            self._uploaded = self._uploaded_bytes = self._failed = 0
+            self._since = now
+        plugin.publish('upload.queue.depth', self.depth(), meta=meta)
+        plugin.publish('upload.files', uploaded, meta=meta)
+        plugin.publish('upload.failed', failed, meta=meta)
+        plugin.publish('upload.throughput.bps', uploaded_bytes / elapsed, meta=meta)
+
+    def join(self):
+        '''Waits until every queued file has been uploaded or has failed.'''
+        self._jobs.join()
+
+    def close(self):
+        '''Stops the workers once the queued files are done.'''
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
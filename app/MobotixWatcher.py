@@ -0,0 +1,164 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+
+_EVENT = struct.Struct("iIII")
+
+DEFAULT_POLL_INTERVAL = 0.1
+
+WATCH_BACKENDS = ['auto', 'inotify', 'poll']
+
+_libc = None
+
+
+def _inotify():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def frame_timestamp(path):
+    '''Returns the nanosecond timestamp a sampler file name starts with, or None.'''
+    prefix = Path(path).name.split("_", 1)[0]
+    return int(prefix) if prefix.isdigit() else None
+
+
+class DirectoryWatcher:
+    ''' Reports the files that become complete in a directory.
+
+    The thermal-raw sampler writes each file in a temporary directory and
+    renames it into its output directory, so a file is complete when it
+    appears. With inotify, `poll` reads the rename (and close-after-write)
+    events queued since the last call, so the work done per file does not
+    depend on how many files the directory holds. Without inotify the
+    directory is scanned every `interval`; a file is reported when it
+    appears if writers rename complete files into the directory (`atomic`),
+    otherwise once its size has not changed for `interval`. Hidden files are
+    ignored. A file can be reported twice after an inotify queue overflow.
+
+    Parameters:
+        directory (str or Path): Directory to watch, created if needed.
+        backend (str): 'inotify', 'poll', or 'auto' for inotify when available.
+        interval (float): Seconds between scans of the polling backend.
+        atomic (bool): Files appear complete, as the sampler writes them.
+    '''
+    def __init__(self, directory, backend='auto', interval=DEFAULT_POLL_INTERVAL, atomic=True):
+        if backend not in WATCH_BACKENDS:
+            raise ValueError(f"Unknown watch backend '{backend}'. Use {WATCH_BACKENDS}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        self.atomic = atomic
+        self._fd = None
+        self._sizes = {}
+        self._reported = set()
+        if backend in ('auto', 'inotify'):
+            try:
+                self._fd = self._open_inotify()
+            except OSError as e:
+                if backend == 'inotify':
+                    raise
+                logging.info("inotify unavailable (%s), polling %s", e, self.directory)
+        self.backend = 'inotify' if self._fd is not None else 'poll'
+        if self.backend == 'poll':
+            # files already there are not new
+            self._reported = {entry.name for entry in os.scandir(self.directory)}
+
+    def _open_inotify(self):
+        libc = _inotify()
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, str(self.directory).encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, f"inotify_add_watch failed on {self.directory}")
+        return fd
+
+    def _read_events(self):
+        paths = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return paths
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0").decode()
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    logging.warning("inotify queue overflow on %s, rescanning", self.directory)
+                    paths.extend(self._rescan())
+                elif name and not name.startswith("."):
+                    paths.append(self.directory / name)
+
+    def _rescan(self):
+        paths = []
+        present = set()
+        now = time.monotonic()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                present.add(entry.name)
+                if entry.name in self._reported or entry.name.startswith(".") or not entry.is_file():
+                    continue
+                size = None if self.atomic else entry.stat().st_size
+                # (size, first seen at that size), polls can come closer together than `interval`
+                seen = self._sizes.get(entry.name)
+                if self.backend == 'inotify' or self.atomic or (
+                        seen is not None and seen[0] == size and now - seen[1] >= self.interval):
+                    self._sizes.pop(entry.name, None)
+                    self._reported.add(entry.name)
+                    paths.append(Path(entry.path))
+                elif seen is None or seen[0] != size:
+                    self._sizes[entry.name] = (size, now)
+        # forget files that were moved away, their names can come back
+        self._reported &= present
+        self._sizes = {name: size for name, size in self._sizes.items() if name in present}
+        return paths
+
+    def poll(self, timeout=0):
+        '''
+        Returns the files completed since the last call, waiting up to
+        `timeout` seconds for at least one.
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.backend == 'inotify':
+                paths = self._read_events()
+            else:
+                paths = self._rescan()
+            remaining = deadline - time.monotonic()
+            if paths or remaining <= 0:
+                return paths
+            if self.backend == 'inotify':
+                select.select([self._fd], [], [], remaining)
+            else:
+                time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError as e:
+                if e.errno != errno.EBADF:
+                    raise
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -20,13 +20,54 @@ from select import select
 import timeout_decorator
 
 from waggle.plugin import Plugin
-from MobotixScan import scan_custom, scan_presets, calculate_pt
+from MobotixScan import DEFAULT_SCAN_TIMEOUT, scan_calibration, scan_custom, scan_daemon, scan_presets, calculate_pt, make_camera
+from MobotixArchive import DEFAULT_ARCHIVE_COMPACT, DEFAULT_ARCHIVE_MAX_AGE, DEFAULT_ARCHIVE_MAX_BYTES
+from MobotixControl import DEFAULT_SAMPLER, THERMAL_FORMATS
+from MobotixGate import DEFAULT_GATE_HASH, DEFAULT_GATE_KEYFRAME, DEFAULT_GATE_THERMAL
+from MobotixStats import DEFAULT_HOT_THRESHOLDS
+from MobotixImaging import DEFAULT_JPEG_QUALITY, JPEG_BACKENDS, PREVIEW_MODES
+from MobotixMulti import camera_args, camera_daemon, load_cameras, scan_cameras
+from MobotixPanorama import DEFAULT_PANORAMA_FOV
+from MobotixSettle import DEFAULT_SETTLE_THRESHOLD, SETTLE_STRATEGIES
+from MobotixStartup import LAZY_MODULES, STARTUP_MODULES, measure_call, measure_imports, report
+from MobotixSweep import DEFAULT_SWEEP_INTERVAL
+from MobotixUpload import DEFAULT_UPLOAD_WORKERS
 
 
 
+def resolve_directions(args):
+    '''Converts the directions of `--mode direction` into presets, keeping the direction of each preset.'''
+    directions_clean = args.preset.replace(' ', '')
+    directions_list = directions_clean.split(',')
+
+    args.preset=calculate_pt(args.south, args.preset)
+    presets_list = args.preset.replace(' ', '').split(',')
+    args.directions = dict(zip(presets_list, directions_list))
+
+    logging.info(args.preset)
+
+
 def main(args):
+    if args.cameras:
+        main_cameras(args)
+        return
     with Plugin() as plugin:
-        if args.mode == "preset":
+        if args.calibrate:
+            try:
+                scan_calibration(args)
+            except timeout_decorator.TimeoutError:
+                logging.error(f"Unknown_Timeout")
+                plugin.publish('exit.status', 'Unknown_Timeout')
+                sys.exit("Exit error while calibrating: Unknown_Timeout")
+        elif args.daemon:
+            try:
+                if args.mode == 'direction':
+                    resolve_directions(args)
+            except ValueError as e:
+                plugin.publish('exit.status', "Unknown_Direction.")
+                raise(e)
+            scan_daemon(args)
+        elif args.mode == "preset":
             try:
                 scan_presets(args)
             except timeout_decorator.TimeoutError:
@@ -42,14 +83,7 @@ def main(args):
                 sys.exit("Exit error while scanning custom: Unknown_Timeout")
         elif args.mode == 'direction':
             try:
-                directions_clean = args.preset.replace(' ', '')
-                directions_list = directions_clean.split(',')
-
-                args.preset=calculate_pt(args.south, args.preset)
-                presets_list = args.preset.replace(' ', '').split(',')
-                args.directions = dict(zip(presets_list, directions_list))
-
-                logging.info(args.preset)
+                resolve_directions(args)
                 scan_presets(args)
             except timeout_decorator.TimeoutError:
                 logging.error(f"Unknown_Timeout")
@@ -63,6 +97,53 @@ def main(args):
             sys.exit(-1)
 
 
+def main_cameras(args):
+    '''Scans the cameras of the `--cameras` file at once, in one plugin.'''
+    with Plugin() as plugin:
+        try:
+            cameras = camera_args(args, load_cameras(args.cameras))
+            for camera in cameras:
+                if camera.mode == 'direction':
+                    resolve_directions(camera)
+        except (OSError, ValueError, KeyError) as e:
+            plugin.publish('exit.status', "Invalid_Camera_Config.")
+            raise(e)
+        if args.daemon:
+            camera_daemon(args, cameras)
+        else:
+            try:
+                scan_cameras(args, cameras)
+            except timeout_decorator.TimeoutError:
+                logging.error(f"Unknown_Timeout")
+                plugin.publish('exit.status', 'Unknown_Timeout')
+                sys.exit("Exit error while scanning cameras: Unknown_Timeout")
+
+
+def profile_startup(args):
+    '''
+    Reports what a cold start costs, the import time of each module and the
+    time to set up the plugin and the camera, logs it and publishes it as
+    `startup.import.sec` and `startup.init.sec`. No scan is run.
+    '''
+    imports = measure_imports()
+    report([c for c in imports if c[0] in STARTUP_MODULES], "Import costs at startup, each on top of the modules above:")
+    report([c for c in imports if c[0] in LAZY_MODULES], "Import costs on first use:")
+
+    plugin, plugin_sec = measure_call(Plugin)
+    with plugin:
+        (mobot_pt, mobot_im), camera_sec = measure_call(make_camera, args)
+        mobot_pt.close()
+        mobot_im.close()
+        inits = [('Plugin', plugin_sec), ('camera', camera_sec)]
+        report(inits, "Init costs:")
+
+        for name, seconds in imports:
+            if seconds is not None:
+                plugin.publish('startup.import.sec', seconds, meta={'module': name})
+        for name, seconds in inits:
+            plugin.publish('startup.init.sec', seconds, meta={'step': name})
+
+
 def default_preset():
     '''Creating comma separated string of ints for default movement.'''
     int_list = [i for j in range(4) for i in range(j+1, 33, 4)]
@@ -75,13 +156,26 @@ if __name__ == "__main__":
         description="The plugin runs Mobotix sampler and collects raw thermal data."
     )
     parser.add_argument("--debug", action="store_true", help="enable debug logs")
+    parser.add_argument(
+        "--profile-startup",
+        dest="profile_startup",
+        action="store_true",
+        help="Report the import and init costs of each module and exit without scanning.",
+    )
     parser.add_argument(
         "--ip",
-        required=True,
         type=str,
         dest="ip",
         default=os.getenv("CAMERA_IP", ""),
-        help="Camera IP or URL",
+        help="Camera IP or URL, required unless --cameras is given.",
+    )
+    parser.add_argument(
+        "--cameras",
+        dest="cameras",
+        type=str,
+        default=os.getenv("CAMERAS_FILE", ""),
+        help="""JSON file listing several cameras to scan at once, each with the options it changes,
+        sharing the conversion and upload workers.""",
     )
     parser.add_argument(
     "--mode",
@@ -101,6 +195,28 @@ if __name__ == "__main__":
         Values are of the form XS, XH, XB, and XG, where X = N,S,E,W,NE,SW,SE,NW.
         (0-for non-scanning mode.)"""
     )
+    parser.add_argument(
+        "--daemon",
+        dest="daemon",
+        action="store_true",
+        help="""Stay resident and run a scan at every time of --schedule, keeping the plugin,
+        camera connection and capture session open between scans.""",
+    )
+    parser.add_argument(
+        "--schedule",
+        dest="schedule",
+        type=str,
+        default=os.getenv("SCAN_SCHEDULE", "300"),
+        help="""Daemon schedule: seconds between scans (run at multiples of the interval),
+        or a cron expression such as '*/10 6-18 * * *'.""",
+    )
+    parser.add_argument(
+        "--scantimeout",
+        dest="scan_timeout",
+        type=int,
+        default=os.getenv("SCAN_TIMEOUT", DEFAULT_SCAN_TIMEOUT),
+        help="Daemon mode: seconds after which a scan is abandoned.",
+    )
     parser.add_argument(
         "-u",
         "--user",
@@ -192,7 +308,264 @@ if __name__ == "__main__":
         help="""A Camera preset value that points the camera toward the south."""
     )
 
+    parser.add_argument(
+        "--pttransport",
+        dest="pt_transport",
+        type=str,
+        choices=["http", "curl"],
+        default=os.getenv("PT_TRANSPORT", "http"),
+        help="How PT commands reach the camera: 'http' keeps connections open, 'curl' forks curl per command.",
+    )
+
+    parser.add_argument(
+        "--session",
+        dest="capture_session",
+        action="store_true",
+        help="Keep one sampler running for the whole scan instead of starting it for every capture.",
+    )
+
+    parser.add_argument(
+        "--sampler",
+        dest="sampler",
+        type=str,
+        default=os.getenv("SAMPLER", DEFAULT_SAMPLER),
+        help="Path of the thermal-raw sampler executable.",
+    )
+
+    parser.add_argument(
+        "--trace",
+        dest="trace",
+        type=str,
+        default=os.getenv("TRACE_FILE", ""),
+        help="Also write every timing span to this file (Chrome trace event JSON) for offline profiling.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=os.getenv("PIPELINE_WORKERS", 2),
+        help="Threads converting and uploading a position while the camera moves on (0 to run inline).",
+    )
+    parser.add_argument(
+        "--uploadworkers",
+        dest="upload_workers",
+        type=int,
+        default=os.getenv("UPLOAD_WORKERS", DEFAULT_UPLOAD_WORKERS),
+        help="Threads uploading files from the on-disk spool while the scan goes on (0 to upload inline).",
+    )
+
+    parser.add_argument(
+        "--jpegbackend",
+        dest="jpeg_backend",
+        type=str,
+        choices=JPEG_BACKENDS,
+        default=os.getenv("JPEG_BACKEND", "auto"),
+        help="Encoder for the visible frames: in-process 'opencv' or 'pillow', or 'ffmpeg'. 'auto' picks the first installed.",
+    )
+    parser.add_argument(
+        "--jpegquality",
+        dest="jpeg_quality",
+        type=int,
+        default=os.getenv("JPEG_QUALITY", DEFAULT_JPEG_QUALITY),
+        help="JPEG quality (1-100) of the visible frames for the in-process encoders.",
+    )
+    parser.add_argument(
+        "--jpegscale",
+        dest="jpeg_scale",
+        type=float,
+        default=os.getenv("JPEG_SCALE", 1),
+        help="Downscale factor of the visible frames, e.g. 0.5 halves the resolution.",
+    )
+
+    parser.add_argument(
+        "--preview",
+        dest="preview",
+        type=str,
+        choices=PREVIEW_MODES,
+        default=os.getenv("PREVIEW_MODE", "fast"),
+        help="Thermal plot of each frame: 'fast' turbo-coloured image, or 'publication' matplotlib figure with axes.",
+    )
+    parser.add_argument(
+        "--previewcolorbar",
+        dest="preview_colorbar",
+        action="store_true",
+        help="Add a colour strip to the fast thermal plots.",
+    )
+
+    parser.add_argument(
+        "--settle",
+        dest="settle",
+        type=str,
+        choices=SETTLE_STRATEGIES,
+        default=os.getenv("SETTLE", "auto"),
+        help="""How to wait for the camera after a preset move: 'frames' until live snapshots stop changing,
+        'travel' for the time estimated from the preset distance, 'fixed' for 3 seconds.
+        'auto' uses frames and falls back to travel. The wait never exceeds 3 seconds.""",
+    )
+    parser.add_argument(
+        "--settlethreshold",
+        dest="settle_threshold",
+        type=float,
+        default=os.getenv("SETTLE_THRESHOLD", DEFAULT_SETTLE_THRESHOLD),
+        help="Mean grey-level difference between snapshots under which the camera is considered still.",
+    )
+
+    parser.add_argument(
+        "--order",
+        dest="order",
+        type=str,
+        choices=["given", "optimal"],
+        default=os.getenv("PRESET_ORDER", "given"),
+        help="Order to visit presets: as 'given', or 'optimal' to minimise the estimated PT travel time.",
+    )
+
+    parser.add_argument(
+        "--netcdf",
+        dest="netcdf",
+        type=str,
+        choices=["frame", "loop"],
+        default=os.getenv("NETCDF_MODE", "frame"),
+        help="Thermal NetCDF output of preset scans: one file per 'frame', or one compressed file per scan 'loop'.",
+    )
+    parser.add_argument(
+        "--netcdfpacking",
+        dest="netcdf_packing",
+        type=str,
+        choices=["int16", "float32"],
+        default=os.getenv("NETCDF_PACKING", "int16"),
+        help="Storage of temperatures in the loop NetCDF file: int16 in 0.01 degC steps, or float32.",
+    )
+    parser.add_argument(
+        "--thermalformat",
+        dest="thermal_format",
+        type=str,
+        choices=THERMAL_FORMATS,
+        default=os.getenv("THERMAL_FORMAT", "netcdf"),
+        help="Thermal frames uploaded: the CSVs with a NetCDF file per frame, or compact binary frames.",
+    )
+    parser.add_argument(
+        "--aggregate",
+        dest="aggregate",
+        action="store_true",
+        help="""Fold the --frames thermal frames of each capture into one NetCDF file of their per-pixel mean,
+        min, max and standard deviation, instead of uploading every frame.""",
+    )
+
+    parser.add_argument(
+        "--gate",
+        dest="gate",
+        action="store_true",
+        help="""Only upload the files of a preset position when it changed since its last upload.
+        The change statistics are published for every capture.""",
+    )
+    parser.add_argument(
+        "--gatethermal",
+        dest="gate_thermal",
+        type=float,
+        default=os.getenv("GATE_THERMAL", DEFAULT_GATE_THERMAL),
+        help="Change in degC of the block-averaged thermal frame that makes a position changed.",
+    )
+    parser.add_argument(
+        "--gatehash",
+        dest="gate_hash",
+        type=int,
+        default=os.getenv("GATE_HASH", DEFAULT_GATE_HASH),
+        help="Distance in bits (of 64) of the visible image hash that makes a position changed.",
+    )
+    parser.add_argument(
+        "--gatekeyframe",
+        dest="gate_keyframe",
+        type=int,
+        default=os.getenv("GATE_KEYFRAME", DEFAULT_GATE_KEYFRAME),
+        help="Upload at least one capture of a position in this many, changed or not.",
+    )
+
+    parser.add_argument(
+        "--thermalstats",
+        dest="thermal_stats",
+        action="store_true",
+        help="Publish the min, mean, percentiles, max and hot-pixel counts of every thermal frame.",
+    )
+    parser.add_argument(
+        "--hotthresholds",
+        dest="hot_thresholds",
+        type=str,
+        default=os.getenv("HOT_THRESHOLDS", DEFAULT_HOT_THRESHOLDS),
+        help="Comma-separated temperatures in degC above which pixels are counted by --thermalstats.",
+    )
+    parser.add_argument(
+        "--roi",
+        dest="roi",
+        type=str,
+        default=os.getenv("ROI_FILE", ""),
+        help="JSON file of regions of interest per position, also summarised by --thermalstats.",
+    )
+
+    parser.add_argument(
+        "--archivemaxbytes",
+        dest="archive_max_bytes",
+        type=str,
+        default=os.getenv("ARCHIVE_MAX_BYTES", DEFAULT_ARCHIVE_MAX_BYTES),
+        help="Size budget of the custom-scan archive, e.g. 500M or 20G, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--archivemaxage",
+        dest="archive_max_age",
+        type=float,
+        default=os.getenv("ARCHIVE_MAX_AGE", DEFAULT_ARCHIVE_MAX_AGE),
+        help="Days after which archived files are removed, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--archivecompact",
+        dest="archive_compact",
+        type=float,
+        default=os.getenv("ARCHIVE_COMPACT_DAYS", DEFAULT_ARCHIVE_COMPACT),
+        help="Days after which archived NetCDF frames are packed into daily files, 0 to never pack.",
+    )
+    parser.add_argument(
+        "--panorama",
+        dest="panorama",
+        action="store_true",
+        help="""Custom scans assemble the shots of each sweep into one panorama and upload it
+        instead of the shots.""",
+    )
+    parser.add_argument(
+        "--panoramafov",
+        dest="panorama_fov",
+        type=float,
+        default=os.getenv("PANORAMA_FOV", DEFAULT_PANORAMA_FOV),
+        help="Horizontal field of view of the thermal sensor in degrees, seeds the panorama alignment.",
+    )
+    parser.add_argument(
+        "--sweep",
+        dest="sweep",
+        action="store_true",
+        help="""Custom scans turn the camera in one continuous move per loop while one sampler stream
+        keeps the frames, instead of stopping for every shot.""",
+    )
+    parser.add_argument(
+        "--sweepinterval",
+        dest="sweep_interval",
+        type=float,
+        default=os.getenv("SWEEP_INTERVAL", DEFAULT_SWEEP_INTERVAL),
+        help="Seconds between the frames kept from a continuous sweep, 0 keeps every frame.",
+    )
+    parser.add_argument(
+        "--calibrate",
+        dest="calibrate",
+        action="store_true",
+        help="""Measure the angular velocity of each move speed from the thermal frames, keep it next to
+        the workdir for --sweep and --panorama, and exit without scanning.""",
+    )
+
     args = parser.parse_args()
+    if not args.ip and not args.cameras:
+        parser.error("the following arguments are required: --ip (or --cameras)")
+    if args.calibrate and args.cameras:
+        parser.error("--calibrate calibrates one camera, give its --ip instead of --cameras")
+    if args.aggregate and args.thermal_format == 'compact':
+        parser.error("--aggregate writes NetCDF statistics, it cannot be combined with --thermalformat compact")
 
     logging.basicConfig(
         level=logging.DEBUG if args.debug else logging.INFO,
@@ -200,4 +573,7 @@ if __name__ == "__main__":
         datefmt="%Y/%m/%d %H:%M:%S",
     )
 
-    main(args)
+    if args.profile_startup:
+        profile_startup(args)
+    else:
+        main(args)
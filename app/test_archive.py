@@ -0,0 +1,224 @@
+import errno
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import xarray as xr
+
+import MobotixFrameStore
+from MobotixArchive import INDEX_NAME, Archive, archive_kind, parse_size
+from MobotixFrameStore import link_file
+from MobotixNetCDF import archive_timestamp
+from MobotixScan import merge_netcdfs
+
+METADATA = {'sensor': 'left', 'width': '6', 'height': '4', 'unit': 'degrees Celsius'}
+
+# 2023-11-14T22:13:20Z
+T0 = 1700000000 * 1_000_000_000
+
+
+def write_frame(path, value, time):
+    ds = xr.Dataset({'temperature': (['time', 'y', 'x'], np.full((1, 4, 6), value, dtype=np.float32))},
+                    coords={'time': [time], 'y': np.arange(4), 'x': np.arange(6)}, attrs=METADATA)
+    ds.to_netcdf(path)
+
+
+class TestHelpers(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size("0"), 0)
+        self.assertEqual(parse_size("500"), 500)
+        self.assertEqual(parse_size("2k"), 2048)
+        self.assertEqual(parse_size("1.5G"), 3 * 1024 ** 3 // 2)
+        self.assertEqual(parse_size("20GB"), 20 * 1024 ** 3)
+        with self.assertRaises(ValueError):
+            parse_size("lots")
+
+    def test_archive_kind(self):
+        self.assertEqual(archive_kind("1700000000000000000_left_336x252_Pt1.nc"), 'nc')
+        self.assertEqual(archive_kind("1699920000000000000_daily_2023-11-14.nc"), 'daily.nc')
+        self.assertEqual(archive_kind("1700000000000000000_336x252_Pt1.jpg"), 'jpg')
+
+    def test_link_file_fallback(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = Path(tmp) / "src.tfr"
+            src.write_bytes(b"frame")
+            # no hardlinks nor reflinks, e.g. across filesystems: the file is copied
+            with mock.patch.object(os, 'link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')), \
+                    mock.patch.object(MobotixFrameStore, 'reflink_file', return_value=False):
+                link_file(src, Path(tmp) / "copy.tfr")
+            self.assertEqual((Path(tmp) / "copy.tfr").read_bytes(), b"frame")
+            self.assertNotEqual(os.stat(src).st_ino, os.stat(Path(tmp) / "copy.tfr").st_ino)
+
+
+class SlowStamp:
+    '''A `time.monotonic` stamp of long ago that takes a while to subtract.'''
+    def __rsub__(self, now):
+        time.sleep(0.05)
+        return float('inf')
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.dir = self.root / "archive"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, archive, timestamp, position, size=100, suffix='jpg'):
+        src = self.root / f"{position}.{suffix}"
+        src.write_bytes(b"x" * size)
+        return archive.add(src, f"{timestamp}_frame_Pt{position}.{suffix}")
+
+    def test_index(self):
+        with Archive(self.dir) as archive:
+            self.add(archive, T0 + 2, 1)
+            self.add(archive, T0 + 1, 5)
+            self.add(archive, T0 + 3, 5, suffix='nc')
+            self.assertEqual(archive.size(), 300)
+            self.assertEqual([p.name[:19] for _, p in archive.files()], [str(T0 + 1), str(T0 + 2), str(T0 + 3)])
+            self.assertEqual(len(archive.files(positions=[5])), 2)
+            self.assertEqual(len(archive.files(start=T0 + 2, end=T0 + 2)), 1)
+            self.assertEqual(len(archive.files(kinds=['nc'])), 1)
+
+        # the index is read back, not the directory
+        (self.dir / "stray.jpg").write_bytes(b"x")
+        with Archive(self.dir) as archive:
+            self.assertEqual(len(archive.files()), 3)
+
+        # and rebuilt from the directory when missing
+        (self.dir / INDEX_NAME).unlink()
+        with Archive(self.dir) as archive:
+            self.assertEqual(len(archive.files()), 4)
+
+    def test_evict(self):
+        now = T0 / 1e9 + 10 * 86400
+        with Archive(self.dir, max_age=5 * 86400) as archive:
+            self.add(archive, T0, 1)
+            self.add(archive, T0 + 8 * 86400 * 10 ** 9, 1)
+            self.assertEqual(archive.evict(now), (1, 100))
+            self.assertEqual(len(archive.files()), 1)
+            self.assertEqual(len(list(self.dir.glob("*.jpg"))), 1)
+
+        with Archive(self.dir, max_bytes=250) as archive:
+            old = self.add(archive, T0 + 1, 5)
+            self.add(archive, T0 + 2, 9)
+            # merging a file makes it the most recently used
+            archive.touch([old])
+            self.assertEqual(archive.evict(now), (1, 100))
+            self.assertEqual([p for _, p in archive.files()], [old, self.dir / f"{T0 + 2}_frame_Pt9.jpg"])
+
+        # the removals are in the index
+        with Archive(self.dir) as archive:
+            self.assertEqual(archive.size(), 200)
+
+    def test_compact(self):
+        day = 86400 * 10 ** 9
+        names = [f"{T0 + 1}_left_6x4_Pt1.nc", f"{T0 + 2}_left_6x4_Pt5.nc", f"{T0 + day}_left_6x4_Pt1.nc"]
+        with Archive(self.dir, compact_after=2 * 86400) as archive:
+            for value, name in enumerate(names):
+                write_frame(self.root / "frame.nc", value, archive_timestamp(name) / 1e9)
+                archive.add(self.root / "frame.nc", name)
+                (self.root / "frame.nc").unlink()
+            self.add(archive, T0 + 1, 1)
+
+            # only the frames of the first day are old enough
+            self.assertEqual(archive.compact(now=T0 / 1e9 + 2.5 * 86400), 2)
+            kinds = sorted(archive_kind(p.name) for _, p in archive.files())
+            self.assertEqual(kinds, ['daily.nc', 'jpg', 'nc'])
+            daily = archive.files(kinds=['daily.nc'])[0][1]
+            self.assertEqual(daily.name, "1699920000000000000_daily_2023-11-14.nc")
+            with xr.open_dataset(daily, decode_times=False) as ds:
+                self.assertEqual(list(ds.position.values), ['1', '5'])
+                self.assertEqual(list(ds.temperature.values[:, 0, 0]), [0, 1])
+            self.assertFalse((self.dir / names[0]).exists())
+
+        # merge_netcdfs reads the frames of the daily file at the positions asked
+        out = self.root / "merged.nc"
+        self.assertEqual(merge_netcdfs(self.dir, out, positions=[1]), 2)
+        with xr.open_dataset(out, decode_times=False) as ds:
+            self.assertEqual(list(ds.temperature.values[:, 0, 0]), [0, 2])
+            self.assertEqual(list(ds.position.values), ['1', '1'])
+
+    def test_compact_skipped_files(self):
+        names = [f"{T0 + 1}_left_6x4_Pt1.nc", f"{T0 + 2}_left_8x4_Pt1.nc", f"{T0 + 3}_left_6x4_Pt1.nc"]
+        with Archive(self.dir, compact_after=86400) as archive:
+            for value, name in enumerate(names):
+                write_frame(self.root / "frame.nc", value, archive_timestamp(name) / 1e9)
+                archive.add(self.root / "frame.nc", name)
+                (self.root / "frame.nc").unlink()
+            # a frame of another resolution, and one cut short
+            ds = xr.Dataset({'temperature': (['time', 'y', 'x'], np.ones((1, 4, 8), dtype=np.float32))},
+                            coords={'time': [archive_timestamp(names[1]) / 1e9]}, attrs=METADATA)
+            ds.to_netcdf(self.dir / names[1])
+            (self.dir / names[2]).write_bytes(b"CDF")
+
+            # neither is packed, nor removed
+            self.assertEqual(archive.compact(now=T0 / 1e9 + 2 * 86400), 1)
+            self.assertEqual(sorted(p.name for _, p in archive.files(kinds=['nc'])), names[1:])
+            self.assertTrue(all((self.dir / name).exists() for name in names[1:]))
+
+    def test_merge_compact_merge(self):
+        names = [f"{T0 + i}_left_6x4_Pt1.nc" for i in range(1, 4)]
+        out = self.root / "merged.nc"
+        with Archive(self.dir, compact_after=86400) as archive:
+            for value, name in enumerate(names):
+                write_frame(self.root / "frame.nc", value, archive_timestamp(name) / 1e9)
+                archive.add(self.root / "frame.nc", name)
+                (self.root / "frame.nc").unlink()
+        self.assertEqual(merge_netcdfs(self.dir, out), 3)
+
+        with Archive(self.dir, compact_after=86400) as archive:
+            self.assertEqual(archive.compact(now=T0 / 1e9 + 2 * 86400), 3)
+        # the frames are in the daily file now, they were merged already
+        self.assertEqual(merge_netcdfs(self.dir, out), 0)
+        with xr.open_dataset(out, decode_times=False) as ds:
+            self.assertEqual(list(ds.temperature.values[:, 0, 0]), [0, 1, 2])
+            self.assertEqual(list(ds.source.values), names)
+
+    def test_maintain(self):
+        with Archive(self.dir, max_bytes=150, interval=3600) as archive:
+            self.add(archive, T0 + 1, 1)
+            self.add(archive, T0 + 2, 1)
+            archive.maintain()
+            archive._thread.join()
+            self.assertEqual(archive.size(), 100)
+            # rate limited until the interval is over
+            self.add(archive, T0 + 3, 1)
+            archive.maintain()
+            self.assertEqual(archive.size(), 200)
+        with open(self.dir / INDEX_NAME) as f:
+            self.assertEqual([json.loads(line)['op'] for line in f], ['add', 'add', 'remove', 'add'])
+
+    def test_maintain_once(self):
+        # the pipeline workers of a scan call maintain at the same time
+        runs = []
+        with Archive(self.dir, interval=3600) as archive:
+            def compact():
+                runs.append(threading.current_thread().name)
+                time.sleep(0.1)
+            archive.compact = compact
+            # a run long ago, slow to compare with, widens the window between the check and the start
+            archive._last_maintain = SlowStamp()
+            barrier = threading.Barrier(8)
+
+            def maintain():
+                barrier.wait()
+                archive.maintain()
+            workers = [threading.Thread(target=maintain) for _ in range(8)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(runs, ['archive'])
+
+
+if __name__ == '__main__':
+    unittest.main()
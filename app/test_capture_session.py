@@ -0,0 +1,178 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from MobotixControl import CaptureSession, MobotixImager
+from MobotixSimulator import write_sampler
+from MobotixWatcher import frame_timestamp
+
+FRAME_FILES = ["1280x960.rgb", "left_336x252_14bit.thermal.celsius.csv"]
+
+
+class StubWatcher:
+    '''Reports the files written since the last poll, like `DirectoryWatcher`.'''
+    def __init__(self):
+        self.new = []
+
+    def poll(self, timeout=0):
+        new, self.new = self.new, []
+        return new
+
+
+class RunningSampler:
+    '''A sampler process that never exits.'''
+    def poll(self):
+        return None
+
+
+class TestCaptureWindow(unittest.TestCase):
+    ''' The window logic, fed frame by frame as `_read_output` would.'''
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.workdir = Path(self.tmp.name) / "data"
+        self.session = CaptureSession("127.0.0.1", "admin", "meinsm", self.workdir, frames=2, skip=1)
+        self.session.spool.mkdir(parents=True)
+        self.session._watcher = StubWatcher()
+        self.session._process = RunningSampler()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def frame(self, timestamp, complete=True):
+        for name in FRAME_FILES:
+            path = self.session.spool / f"{timestamp}_{name}"
+            path.write_bytes(b"frame")
+            self.session._watcher.new.append(path)
+        if complete:
+            self.session._frame_complete(timestamp)
+
+    def test_skip_and_frames(self):
+        self.frame(time.time_ns())
+        self.session.open_window("1")
+        start = self.session._window['start']
+        for i in range(1, 6):
+            self.frame(start + i)
+        files = self.session.wait_window(timeout=0)
+
+        # the frame before the window and the skipped one are dropped, then two frames kept
+        self.assertEqual(sorted({frame_timestamp(path) for path in files}), [start + 2, start + 3])
+        self.assertEqual(sorted(files), sorted(self.workdir.iterdir()))
+        self.assertEqual(self.session.discarded, 4)
+        self.assertEqual(list(self.session.spool.iterdir()), [])
+
+    def test_camera_moving(self):
+        self.session.open_window("1")
+        start = self.session._window['start']
+        self.frame(start + 1)
+        self.frame(start + 2)
+        self.session.camera_moving()
+        self.frame(start + 3)
+        # the frame kept before the move stays in the workdir
+        self.assertEqual(sorted(path.name for path in self.workdir.iterdir()),
+                         sorted(f"{start + 2}_{name}" for name in FRAME_FILES))
+        self.assertEqual(self.session.discarded, 2)
+        with self.assertRaisesRegex(Exception, "No capture window"):
+            self.session.wait_window(timeout=0)
+        # the frames streamed during the move are deleted
+        self.assertEqual(list(self.session.spool.iterdir()), [])
+
+    def test_timeout(self):
+        self.session.open_window("1")
+        self.frame(self.session._window['start'] + 1)
+        with self.assertRaisesRegex(Exception, "Camera timeout"):
+            self.session.wait_window(timeout=0.05)
+
+    def test_stale_files(self):
+        self.session.open_window("1")
+        start = self.session._window['start']
+        # a frame whose completion was never announced, and a file without a timestamp
+        self.frame(start + 1, complete=False)
+        stray = self.session.spool / "sampler.log"
+        stray.write_bytes(b"")
+        self.session._watcher.new.append(stray)
+        self.frame(start + 2)
+        self.assertEqual(list(self.session.spool.iterdir()), [])
+
+    def test_stream_window(self):
+        self.session.skip = 0
+        self.session.open_window("sweep", stream=True, interval=0.05)
+        start = self.session._window['start']
+        for i in range(8):
+            self.frame(start + i * 20_000_000)
+            # a move does not close a stream window
+            self.session.camera_moving()
+        files = self.session.close_window()
+        # one frame in every 50 ms of the 20 ms frames, more than `frames`
+        self.assertEqual(sorted({frame_timestamp(path) for path in files}),
+                         [start, start + 60_000_000, start + 120_000_000])
+        self.assertIsNone(self.session._window)
+
+
+class TestCaptureSession(unittest.TestCase):
+    ''' Sessions streaming from the simulated sampler.'''
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        self.sampler = write_sampler(root / "thermal-raw", width=32, height=24, thermal_width=16, thermal_height=12,
+                                     fps=50)
+        self.workdir = root / "data"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_window_files(self):
+        for watch in ['inotify', 'poll']:
+            with self.subTest(watch=watch):
+                try:
+                    session = CaptureSession("127.0.0.1", "admin", "meinsm", self.workdir, frames=3,
+                                             skip=1, sampler=str(self.sampler), watch=watch)
+                    session.start()
+                except OSError:
+                    self.skipTest("inotify not available")
+                try:
+                    session.open_window("1")
+                    files = session.wait_window(timeout=10)
+                    session.camera_moving()
+                finally:
+                    session.stop()
+
+                self.assertEqual(len(files), 3 * len(FRAME_FILES))
+                self.assertEqual(sorted(files), sorted(self.workdir.iterdir()))
+                self.assertEqual(len({frame_timestamp(path) for path in files}), 3)
+                self.assertEqual(list(session.spool.iterdir()), [])
+                for path in files:
+                    path.unlink()
+
+    def test_stream_window(self):
+        imager = MobotixImager("127.0.0.1", "admin", "meinsm", self.workdir, frames=1, sampler=str(self.sampler))
+        # without a capture session the imager streams from a session of its own
+        imager.start_stream("sweep", interval=0.05)
+        try:
+            self.assertIsNotNone(imager._stream)
+            time.sleep(0.3)
+        finally:
+            files = imager.stop_stream()
+        self.assertIsNone(imager._stream)
+
+        timestamps = sorted({frame_timestamp(path) for path in files})
+        self.assertEqual(len(files), len(timestamps) * len(FRAME_FILES))
+        self.assertGreaterEqual(len(timestamps), 3)
+        self.assertGreaterEqual(min(b - a for a, b in zip(timestamps, timestamps[1:])), 50_000_000)
+        self.assertEqual(sorted(files), sorted(self.workdir.iterdir()))
+
+    def test_capture_without_session(self):
+        self.workdir.mkdir()
+        stale = 1700000000000000000
+        (self.workdir / f"{stale}_32x24.rgb").write_bytes(b"stale")
+        imager = MobotixImager("127.0.0.1", "admin", "meinsm", self.workdir, frames=2, sampler=str(self.sampler))
+        files = imager.capture(convert=False)
+
+        # frames 1 and 2, not the stale file nor the frame announced last
+        self.assertEqual(len(files), 2 * len(FRAME_FILES))
+        self.assertEqual(len({frame_timestamp(path) for path in files}), 2)
+        self.assertNotIn(stale, {frame_timestamp(path) for path in files})
+
+
+if __name__ == '__main__':
+    unittest.main()
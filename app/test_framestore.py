@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from MobotixFrameStore import FrameStore, link_file, parse_frame_name
+
+TS = 1700000000000000000
+
+
+class TestFrameStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.workdir = self.root / "data"
+        self.workdir.mkdir()
+        for name in (f"{TS}_1280x960.rgb", f"{TS}_left_336x252_14bit.thermal.raw",
+                     f"{TS}_left_336x252_14bit.thermal.celsius.csv"):
+            (self.workdir / name).write_bytes(b"frame")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse_frame_name(self):
+        self.assertEqual(parse_frame_name(f"{TS}_1280x960.rgb"), (TS, 'visible', 'rgb'))
+        self.assertEqual(parse_frame_name(f"{TS}_left_336x252_14bit.thermal.celsius.csv"),
+                         (TS, 'left', 'thermal.celsius.csv'))
+        self.assertEqual(parse_frame_name("left_336x252_14bit.thermal.celsius_plot.jpg"),
+                         (None, 'left', 'thermal.celsius_plot.jpg'))
+
+    def test_stage_and_index(self):
+        store = FrameStore.stage(self.workdir, self.root / "data.pending" / "1_5", position=5)
+        self.assertEqual(list(self.workdir.iterdir()), [])
+        self.assertEqual(len(store), 3)
+        rgb = store.find(sensor='visible', kind='rgb')[0]
+        self.assertEqual(store.key(rgb).position, 5)
+
+        jpg = rgb.with_suffix(".jpg")
+        os.rename(rgb, jpg)
+        store.replace(rgb, jpg)
+        self.assertEqual(store.find(kind='jpg'), [jpg])
+
+        renamed = store.rename(jpg, self.root / "data.pending" / "1_5" / "1280x960_position5.jpg")
+        self.assertTrue(renamed.exists())
+        self.assertEqual(store.find(sensor='visible'), [renamed])
+
+    def test_link_shares_bytes(self):
+        store = FrameStore.stage(self.workdir, self.root / "staged")
+        archive = self.root / "archive"
+        archive.mkdir()
+        src = store.find(kind='thermal.raw')[0]
+        dst = store.link(src, archive)
+        self.assertEqual(os.stat(src).st_ino, os.stat(dst).st_ino)
+        self.assertTrue(link_file(src, archive / "other.raw"))
+
+    def test_close_keeps_unmoved_files(self):
+        store = FrameStore.stage(self.workdir, self.root / "staged")
+        store.close()
+        self.assertTrue(store.directory.exists())
+        for path in store:
+            path.unlink()
+        store.close()
+        self.assertFalse(store.directory.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from MobotixControl import MobotixImager
+from MobotixFrameStore import FrameStore
+from MobotixGate import ChangeGate, gate_dir, position_key, thermal_signature, visual_hash
+from MobotixScan import upload_position
+from MobotixSimulator import encode_jpeg
+from MobotixThermal import write_celsius_csv
+
+
+def scene(offset=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:252, 0:336]
+    # sensor noise well under the threshold once averaged over blocks
+    return (20 + 10 * y / 252 + offset + rng.normal(0, 0.3, (252, 336))).astype(np.float32)
+
+
+class TestChangeGate(unittest.TestCase):
+    def test_decisions(self):
+        gate = ChangeGate(thermal_threshold=1.0, keyframe_interval=3)
+        upload, stats = gate.check('1', thermal=scene())
+        self.assertEqual((upload, stats['reason']), (True, 'first'))
+
+        upload, stats = gate.check('1', thermal=scene(seed=1))
+        self.assertEqual((upload, stats['reason']), (False, 'unchanged'))
+        self.assertLess(stats['thermal.max'], 1.0)
+        self.assertLessEqual(stats['thermal.mean'], stats['thermal.p95'])
+
+        # a hot spot over one block
+        hot = scene(seed=2)
+        hot[100:120, 100:120] += 5
+        upload, stats = gate.check('1', thermal=hot)
+        self.assertEqual((upload, stats['reason']), (True, 'changed'))
+        self.assertGreater(stats['thermal.max'], 4)
+
+        # one capture in three goes up unchanged
+        reasons = [gate.check('1', thermal=hot)[1]['reason'] for _ in range(4)]
+        self.assertEqual(reasons, ['unchanged', 'unchanged', 'keyframe', 'unchanged'])
+        # positions are compared with their own reference
+        self.assertEqual(gate.check('2', thermal=hot)[1]['reason'], 'first')
+
+    def test_visible_hash(self):
+        y, x = np.mgrid[0:240, 0:320]
+        image = 128 + 60 * np.sin(x / 23) * np.cos(y / 17)
+        still = visual_hash(encode_jpeg(image.astype(np.uint8)))
+        # JPEG noise and a small brightness change keep the hash
+        self.assertEqual(visual_hash(encode_jpeg((image + 5).astype(np.uint8))), still)
+        moved = visual_hash(encode_jpeg(np.roll(image, 40, axis=1).astype(np.uint8)))
+
+        gate = ChangeGate(hash_threshold=10)
+        gate.check('1', visible=still)
+        upload, stats = gate.check('1', visible=still)
+        self.assertEqual((upload, stats['visible.distance']), (False, 0))
+        upload, stats = gate.check('1', visible=moved)
+        self.assertTrue(upload)
+        self.assertGreaterEqual(stats['visible.distance'], 10)
+
+    def test_references_persist(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state = gate_dir(Path(tmp) / "data")
+            self.assertEqual(state, Path(tmp) / "data.gate")
+            ChangeGate(state).check('5_SS', thermal=scene(), visible=0x0F0F)
+            gate = ChangeGate(state)
+            upload, stats = gate.check('5_SS', thermal=scene(seed=1), visible=0x0F0F)
+            self.assertEqual((upload, stats['reason']), (False, 'unchanged'))
+            self.assertEqual(stats['visible.distance'], 0)
+
+    def test_keys_and_signature(self):
+        self.assertEqual(position_key({'position': '5', 'loop_num': '2'}), '5')
+        self.assertEqual(position_key({'position': '5', 'direction': 'SS'}), '5_SS')
+        self.assertEqual(thermal_signature(np.ones((252, 336))).shape, (31, 42))
+        self.assertEqual(thermal_signature(np.ones((4, 4))).shape, (1, 1))
+
+    def test_unreadable_jpeg(self):
+        # a visible frame that does not decode leaves the thermal frame to gate on
+        published = []
+
+        class Plugin:
+            def publish(self, name, value, meta={}, timestamp=None):
+                published.append((name, value, meta))
+
+            def upload_file(self, path, meta={}, timestamp=None):
+                pass
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = FrameStore(tmp, position=1)
+            csv = Path(tmp) / "1700000000000000000_left_336x252_14bit.thermal.celsius.csv"
+            write_celsius_csv(csv, scene())
+            jpeg = Path(tmp) / "1700000000000000000_1280x960.jpg"
+            jpeg.write_bytes(b"not a jpeg")
+            for path in (csv, jpeg):
+                store.add(path)
+            imager = MobotixImager("127.0.0.1", "admin", "meinsm", tmp, frames=1, thermal_format='compact')
+            with self.assertLogs(level='WARNING'):
+                upload_position(Plugin(), imager, store, {'position': '1', 'loop_num': '1'}, gate=ChangeGate())
+
+        self.assertIn(('gate.upload', 1, {'position': '1', 'loop_num': '1', 'reason': 'first'}), published)
+        self.assertNotIn('gate.visible.distance', [name for name, _, _ in published])
+
+
+if __name__ == '__main__':
+    unittest.main()
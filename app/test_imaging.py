@@ -0,0 +1,72 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import MobotixImaging
+from MobotixImaging import TURBO_LUT, bgra_to_jpeg, colorize, render_thermal, robust_limits
+
+
+class TestBgraToJpeg(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fname_rgb = Path(self.tmp.name) / "1700000000000000000_64x48.rgb"
+        frame = np.zeros((48, 64, 4), dtype=np.uint8)
+        frame[..., 0] = 200  # blue
+        frame[..., 3] = 255
+        frame.tofile(self.fname_rgb)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_backend(self, backend):
+        fname_jpg = self.fname_rgb.with_suffix(".jpg")
+        bgra_to_jpeg(self.fname_rgb, fname_jpg, 64, 48, backend=backend)
+        with Image.open(fname_jpg) as image:
+            self.assertEqual(image.size, (64, 48))
+            r, g, b = image.convert("RGB").getpixel((10, 10))
+        self.assertGreater(b, 180)
+        self.assertLess(r, 30)
+
+        bgra_to_jpeg(self.fname_rgb, fname_jpg, 64, 48, scale=0.5, backend=backend)
+        with Image.open(fname_jpg) as image:
+            self.assertEqual(image.size, (32, 24))
+
+    @unittest.skipIf(MobotixImaging.cv2 is None, "opencv not installed")
+    def test_opencv(self):
+        self.check_backend('opencv')
+
+    def test_pillow(self):
+        self.check_backend('pillow')
+
+
+class TestThermalPreview(unittest.TestCase):
+    def test_turbo_matches_matplotlib(self):
+        import matplotlib
+        reference = matplotlib.colormaps['turbo'](np.linspace(0, 1, 256))[:, :3]
+        np.testing.assert_array_equal(TURBO_LUT, np.round(reference * 255).astype(np.uint8))
+
+    def test_robust_limits(self):
+        data = np.random.default_rng(0).normal(20, 5, (252, 336)).astype(np.float32)
+        data[0, :10] = np.nan
+        expected = np.nanpercentile(data, [2, 98])
+        np.testing.assert_allclose(robust_limits(data), expected, rtol=1e-5)
+
+    def test_colorize_clips(self):
+        rgb = colorize(np.array([[-10.0, 0.0, 50.0, 100.0, np.nan]]), 0.0, 100.0)
+        np.testing.assert_array_equal(rgb[0, :4], TURBO_LUT[[0, 0, 127, 255]])
+
+    def test_render_thermal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fname_jpg = Path(tmp) / "plot.jpg"
+            data = np.tile(np.linspace(0, 40, 64, dtype=np.float32), (48, 1))
+            vmin, vmax = render_thermal(data, fname_jpg, scale=2, colorbar=True)
+            self.assertLess(vmin, vmax)
+            with Image.open(fname_jpg) as image:
+                self.assertEqual(image.size, (128 + 8 + 32, 96))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from MobotixControl import HTTPTransport, MobotixPT, TransportError
+from MobotixSimulator import StubCameraServer
+
+
+class TestHTTPTransport(unittest.TestCase):
+    def setUp(self):
+        self.camera = StubCameraServer().start()
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def test_commands_reuse_connection(self):
+        mobot_pt = MobotixPT('admin', 'meinsm', self.camera.address)
+        self.assertEqual(mobot_pt.move_to_preset(1).strip(), 'OK')
+        conn = mobot_pt.transport._pool.queue[-1]
+        mobot_pt.stop()
+        self.assertIs(mobot_pt.transport._pool.queue[-1], conn)
+        self.assertEqual(self.camera.commands, [mobot_pt.presets[1], '%FF%01%00%00%00%00%01'])
+        mobot_pt.close()
+
+    def test_invalid_credentials(self):
+        mobot_pt = MobotixPT('admin', 'wrong', self.camera.address)
+        with self.assertRaises(Exception):
+            mobot_pt.move_to_preset(1)
+
+    def test_retries_then_fails(self):
+        transport = HTTPTransport('admin', 'meinsm', '127.0.0.1:1', retries=2, backoff=0)
+        with self.assertRaises(TransportError):
+            transport.post('/control/rcontrol?action=putrs232')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from waggle.plugin import Plugin
+
+import MobotixScan
+from MobotixArchive import Archive
+from MobotixMulti import camera_args, camera_daemon, load_cameras, scan_cameras
+from MobotixSimulator import SimulatedPT, StubCameraServer, write_sampler
+
+
+def make_args(workdir, **options):
+    # the app.py defaults
+    return argparse.Namespace(**{
+        'ip': '', 'user': 'admin', 'password': 'meinsm', 'workdir': Path(workdir), 'frames': 1, 'mode': 'preset',
+        'preset': '1', 'south': '1', 'loops': 1, 'loopsleep': 0, 'num_shots': '1', 'move_direction': 'right',
+        'move_speed': '1', 'move_duration': '1', 'daemon': False, 'schedule': '300', 'scan_timeout': 900,
+        'pt_transport': 'http', 'capture_session': False, 'sampler': '/thermal-raw', 'trace': '', 'workers': 2,
+        'upload_workers': 2, 'jpeg_backend': 'auto', 'jpeg_quality': 90, 'jpeg_scale': 1, 'preview': 'fast',
+        'preview_colorbar': False, 'settle': 'frames', 'settle_threshold': 2.0, 'order': 'given',
+        'netcdf': 'frame', 'netcdf_packing': 'int16', 'thermal_format': 'compact', 'gate': False,
+        'gate_thermal': 1.0, 'gate_hash': 10, 'gate_keyframe': 12, 'thermal_stats': False,
+        'hot_thresholds': '40,60', 'roi': '', 'cameras': '', 'archive_max_bytes': '10G', 'archive_max_age': 0,
+        'archive_compact': 1, 'panorama': False, 'panorama_fov': 45.0, 'sweep': False, 'sweep_interval': 0.5,
+        'calibrate': False, 'aggregate': False, **options})
+
+
+class TestCameraArgs(unittest.TestCase):
+    def test_camera_args(self):
+        args = make_args('/data', ip='10.0.0.1', frames=2)
+        north, south = camera_args(args, [{'name': 'north', 'ip': '10.0.0.2', 'preset': '1,5'},
+                                          {'ip': '10.0.0.3', 'workdir': '/scratch/south'}])
+        self.assertEqual((north.camera, north.ip, north.preset, north.frames), ('north', '10.0.0.2', '1,5', 2))
+        self.assertEqual(north.workdir, Path('/data/north'))
+        self.assertEqual((south.camera, south.workdir), ('10.0.0.3', '/scratch/south'))
+        # the command line arguments are left alone
+        self.assertEqual((args.ip, args.workdir), ('10.0.0.1', Path('/data')))
+
+        with self.assertRaises(ValueError):
+            camera_args(args, [{'name': 'a'}, {'name': 'a'}])
+        with self.assertRaises(ValueError):
+            camera_args(args, [{'name': 'a', 'workers': 4}])
+        with self.assertRaises(ValueError):
+            camera_args(args, [{'name': 'a', 'zoom': 2}])
+
+    def test_load_cameras(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "cameras.json"
+            path.write_text('[{"name": "north", "ip": "10.0.0.2"}]')
+            self.assertEqual(load_cameras(path), [{'name': 'north', 'ip': '10.0.0.2'}])
+            path.write_text('{"ip": "10.0.0.2"}')
+            with self.assertRaises(ValueError):
+                load_cameras(path)
+
+
+class TestScanCameras(unittest.TestCase):
+    def test_concurrent_scan(self):
+        published = []
+
+        def publish(self, name, value, meta={}, timestamp=None):
+            published.append((name, value, meta))
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                StubCameraServer(pt=SimulatedPT(time_scale=0.05)) as north, \
+                StubCameraServer(pt=SimulatedPT(time_scale=0.05)) as south, \
+                mock.patch.dict(os.environ, {'WAGGLE_PLUGIN_UPLOAD_PATH': str(Path(tmp) / "uploads")}), \
+                mock.patch.object(Plugin, 'publish', publish), \
+                mock.patch.object(MobotixScan, 'ARCHIVE_DIR', str(Path(tmp) / "archive")):
+            sampler = write_sampler(Path(tmp) / "thermal-raw", width=32, height=24, thermal_width=16,
+                                    thermal_height=12, fps=50)
+            args = make_args(Path(tmp) / "data", sampler=str(sampler))
+            cameras = camera_args(args, [{'name': 'north', 'ip': north.address, 'preset': '1,5'},
+                                         {'name': 'south', 'ip': south.address, 'mode': 'custom', 'num_shots': '2'}])
+            statuses = scan_cameras(args, cameras)
+
+            self.assertEqual(statuses, {'north': 'Scan_Complete', 'south': 'Scan_Complete'})
+            self.assertEqual([c for c in north.commands if c.startswith('%FF%01%00%07')], [
+                '%FF%01%00%07%00%01%09', '%FF%01%00%07%00%05%0D'])
+            self.assertEqual(len(south.commands), 5)
+            labels = [json.loads(meta.read_text())['labels'] for meta in (Path(tmp) / "uploads").glob("*/meta")]
+            jpegs = sorted(label['camera'] for label in labels if label['filename'].endswith(".jpg") and '_plot' not in label['filename'])
+            self.assertEqual(jpegs, ['north', 'north', 'south', 'south'])
+            # the custom scan indexes its shots in the archive: image, thermal frame and plot
+            with Archive(Path(tmp) / "archive") as archive:
+                self.assertEqual(len(archive.files()), 6)
+                self.assertEqual(len(archive.files(kinds=['tfr'])), 2)
+
+        jobs = {meta['camera']: value for name, value, meta in published if name == 'pipeline.jobs'}
+        self.assertEqual(jobs, {'north': 2, 'south': 2})
+        durations = {meta['camera']: meta['status'] for name, value, meta in published
+                     if name == 'camera.scan.duration.sec'}
+        self.assertEqual(durations, {'north': 'Scan_Complete', 'south': 'Scan_Complete'})
+        self.assertTrue(all('camera' in meta for name, value, meta in published if name == 'exit.status'))
+
+    def test_daemon(self):
+        published = []
+
+        def publish(self, name, value, meta={}, timestamp=None):
+            published.append((name, value, meta))
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                StubCameraServer(pt=SimulatedPT(time_scale=0.05)) as north, \
+                StubCameraServer(pt=SimulatedPT(time_scale=0.05)) as south, \
+                mock.patch.dict(os.environ, {'WAGGLE_PLUGIN_UPLOAD_PATH': str(Path(tmp) / "uploads")}), \
+                mock.patch.object(Plugin, 'publish', publish):
+            sampler = write_sampler(Path(tmp) / "thermal-raw", width=32, height=24, thermal_width=16,
+                                    thermal_height=12, fps=50)
+            args = make_args(Path(tmp) / "data", sampler=str(sampler), daemon=True, schedule='1')
+            cameras = camera_args(args, [{'name': 'north', 'ip': north.address},
+                                         {'name': 'south', 'ip': south.address}])
+            self.assertEqual(camera_daemon(args, cameras, max_runs=2), 2)
+            # preset 1 once per run
+            self.assertEqual([c for c in north.commands if c.startswith('%FF%01%00%07')], ['%FF%01%00%07%00%01%09'] * 2)
+
+        runs = [meta for name, value, meta in published if name == 'daemon.scan.duration.sec']
+        self.assertEqual([(meta['run'], meta['status']) for meta in runs], [('1', 'Scan_Complete'), ('2', 'Scan_Complete')])
+        statuses = sorted((meta['camera'], meta['status']) for name, value, meta in published
+                          if name == 'camera.scan.duration.sec')
+        self.assertEqual(statuses, [('north', 'Scan_Complete')] * 2 + [('south', 'Scan_Complete')] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
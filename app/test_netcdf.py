@@ -0,0 +1,190 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import xarray as xr
+
+from waggle.plugin import Plugin
+
+import MobotixScan
+from MobotixNetCDF import NETCDF_LOCK, LoopNetCDFWriter, NetCDFMerger, archive_timestamp, list_archive
+from MobotixScan import open_loop_netcdf, scan_presets
+from MobotixSimulator import SimulatedPT, StubCameraServer, write_sampler
+from test_multi import make_args
+
+METADATA = {'sensor': 'left', 'width': '6', 'height': '4', 'unit': 'degrees Celsius'}
+
+
+class TestLoopNetCDFWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "loop.nc"
+        rng = np.random.default_rng(0)
+        self.frames = rng.uniform(-40, 550, (3, 2, 4, 6)).astype(np.float32)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, packing):
+        with LoopNetCDFWriter(self.path, packing=packing) as writer:
+            for t in range(2):
+                for p, position in enumerate(('5', '1', '9')):
+                    writer.append(position, METADATA, self.frames[p, t], 1700000000.0 + 10 * p + t,
+                                  direction=f"D{position}")
+
+    def test_int16_roundtrip(self):
+        self.write('int16')
+        with xr.open_dataset(self.path, decode_times=False) as ds:
+            self.assertEqual(ds.temperature.shape, (3, 2, 4, 6))
+            self.assertEqual(list(ds.position.values), [5, 1, 9])
+            self.assertEqual(list(ds.direction.values), ['D5', 'D1', 'D9'])
+            self.assertEqual(ds.attrs['sensor'], 'left')
+            self.assertEqual(ds.temperature.encoding['dtype'], np.int16)
+            self.assertTrue(ds.temperature.encoding['zlib'])
+            np.testing.assert_allclose(ds.temperature.values, self.frames, atol=0.0051)
+            self.assertEqual(ds.time.values[2, 1], 1700000000.0 + 21)
+
+    def test_float32(self):
+        self.write('float32')
+        with xr.open_dataset(self.path) as ds:
+            np.testing.assert_array_equal(ds.temperature.values, self.frames)
+
+    def test_concurrent_writers(self):
+        # the loop files of several cameras and the per-frame files of the
+        # shared pipeline are written at once, netCDF-C sees one at a time
+        root = Path(self.tmp.name)
+        writers = [LoopNetCDFWriter(root / f"camera{i}.nc") for i in range(2)]
+        errors = []
+
+        def append(writer):
+            try:
+                for t in range(20):
+                    writer.append('1', METADATA, self.frames[0, 0], 1700000000.0 + t)
+            except Exception as e:
+                errors.append(e)
+
+        def write_frames():
+            try:
+                for t in range(20):
+                    with NETCDF_LOCK:
+                        write_frame(root / f"{t}.nc", t, 1700000000.0 + t)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=append, args=(writer,)) for writer in writers]
+        threads.append(threading.Thread(target=write_frames))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for writer in writers:
+            self.assertIs(writer._lock, NETCDF_LOCK)
+            writer.close()
+        self.assertEqual(errors, [])
+        with xr.open_dataset(root / "camera1.nc", decode_times=False) as ds:
+            self.assertEqual(ds.temperature.shape, (1, 20, 4, 6))
+
+    def test_loop_scan_uploads(self):
+        root = Path(self.tmp.name)
+        with StubCameraServer(pt=SimulatedPT(time_scale=0.05)) as camera, \
+                mock.patch.dict(os.environ, {'WAGGLE_PLUGIN_UPLOAD_PATH': str(root / "uploads")}), \
+                mock.patch.object(Plugin, 'publish'):
+            sampler = write_sampler(root / "thermal-raw", width=32, height=24, thermal_width=16,
+                                    thermal_height=12, fps=50)
+            args = make_args(root / "data", ip=camera.address, sampler=str(sampler), preset='1,5', loops=2,
+                             netcdf='loop', thermal_format='netcdf')
+            scan_presets(args)
+            names = [json.loads(meta.read_text())['labels']['filename'] for meta in (root / "uploads").glob("*/meta")]
+
+        # per loop the image and plot of each preset and the loop file, which holds the celsius frames
+        self.assertEqual(len(names), 2 * 5)
+        self.assertEqual(sorted(name for name in names if name.endswith(".nc")),
+                         ["thermal.celsius_loop1.nc", "thermal.celsius_loop2.nc"])
+        self.assertFalse([name for name in names if name.endswith(".csv")])
+
+    def test_closed_when_scan_fails(self):
+        root = Path(self.tmp.name)
+        writers = []
+
+        def open_loop(*args):
+            writers.append(open_loop_netcdf(*args))
+            return writers[-1]
+
+        with StubCameraServer(pt=SimulatedPT(time_scale=0.05)) as camera, \
+                mock.patch.dict(os.environ, {'WAGGLE_PLUGIN_UPLOAD_PATH': str(root / "uploads")}), \
+                mock.patch.object(Plugin, 'publish'), \
+                mock.patch.object(MobotixScan, 'open_loop_netcdf', open_loop):
+            # no sampler to capture with, the scan exits after the first move
+            args = make_args(root / "data", ip=camera.address, netcdf='loop', sampler=str(root / "missing"))
+            with self.assertRaises(SystemExit):
+                scan_presets(args)
+        self.assertEqual(len(writers), 1)
+        self.assertFalse(writers[0]._ds.isopen())
+
+
+def write_frame(path, value, time):
+    ds = xr.Dataset({'temperature': (['time', 'y', 'x'], np.full((1, 4, 6), value, dtype=np.float32))},
+                    coords={'time': [time], 'y': np.arange(4), 'x': np.arange(6)}, attrs=METADATA)
+    ds.to_netcdf(path)
+
+
+class TestNetCDFMerger(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.archive = Path(self.tmp.name) / "archive"
+        self.archive.mkdir()
+        self.out = Path(self.tmp.name) / "merged.nc"
+        # written out of order, one of them at another preset
+        for value, name in [(3, "1700000003000000000_position2.nc"),
+                            (1, "1700000001000000000_position1.nc"),
+                            (2, "1700000002000000000_position1.nc")]:
+            write_frame(self.archive / name, value, archive_timestamp(name) / 1e9)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_archive_timestamp(self):
+        self.assertEqual(archive_timestamp("1700000001000000000_left_336x252.nc"), 1700000001000000000)
+        self.assertIsNotNone(archive_timestamp("left.thermal.celsius_2024-05-01T120000_Pt1-right-S3xD500ms_Img0.nc"))
+        self.assertIsNone(archive_timestamp("merged.nc"))
+
+    def test_merge_sorted_and_filtered(self):
+        files = list_archive(self.archive, positions=[1])
+        self.assertEqual(NetCDFMerger(self.out, chunk=1).merge(files), [p.name for _, p in files])
+        with xr.open_dataset(self.out, decode_times=False) as ds:
+            self.assertEqual(ds.temperature.shape, (2, 4, 6))
+            self.assertEqual(list(ds.temperature.values[:, 0, 0]), [1, 2])
+            self.assertEqual(list(ds.position.values), ['1', '1'])
+
+        files = list_archive(self.archive, start=1700000002000000000)
+        self.assertEqual([p.name[:10] for _, p in files], ['1700000002', '1700000003'])
+
+    def test_resume(self):
+        merger = NetCDFMerger(self.out)
+        self.assertEqual(len(merger.merge(list_archive(self.archive, end=1700000002000000000))), 2)
+        self.assertEqual(merger.merge(list_archive(self.archive)), ["1700000003000000000_position2.nc"])
+        self.assertEqual(merger.merge(list_archive(self.archive)), [])
+        with xr.open_dataset(self.out, decode_times=False) as ds:
+            self.assertEqual(list(ds.temperature.values[:, 0, 0]), [1, 2, 3])
+            self.assertEqual(list(ds.time.values), [1700000001.0, 1700000002.0, 1700000003.0])
+
+    def test_unreadable_file(self):
+        bad = self.archive / "1700000002500000000_position1.nc"
+        write_frame(bad, 9, 1700000002.5)
+        bad.write_bytes(bad.read_bytes()[:200])
+        merger = NetCDFMerger(self.out, chunk=2)
+        # the truncated file is skipped, run after run, and the others merged once
+        for _ in range(3):
+            merger.merge(list_archive(self.archive))
+            with xr.open_dataset(self.out, decode_times=False) as ds:
+                self.assertEqual(list(ds.time.values), [1700000001.0, 1700000002.0, 1700000003.0])
+        self.assertNotIn(bad.name, json.loads(merger.manifest_path.read_text())['files'])
+
+
+if __name__ == '__main__':
+    unittest.main()
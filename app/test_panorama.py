@@ -0,0 +1,157 @@
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from MobotixImaging import write_jpeg
+from MobotixPanorama import PanoramaSweep, blend, estimate_offsets, expected_shift, write_panorama_netcdf
+from MobotixPresets import move_angle
+from MobotixScan import upload_panorama
+
+METADATA = {'sensor': 'left', 'width': '96', 'height': '72', 'unit': 'degrees Celsius'}
+
+
+def landscape(height, width, seed=0):
+    # smooth random temperatures, like a thermal scene
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft2(rng.normal(size=(height, width)))
+    ky = np.fft.fftfreq(height)[:, None]
+    kx = np.fft.rfftfreq(width)[None, :]
+    field = np.fft.irfft2(spectrum * np.exp(-(kx ** 2 + ky ** 2) / (2 * 0.05 ** 2)), s=(height, width))
+    return (20 + 5 * field / field.std()).astype(np.float32)
+
+
+class FakeUploader:
+    def __init__(self):
+        self.files = []
+        self.published = []
+
+    def upload_file(self, path, meta={}, timestamp=None):
+        self.files.append(Path(path).name)
+
+    def publish(self, name, value, meta={}, timestamp=None):
+        self.published.append((name, value, meta))
+
+
+class TestAlignment(unittest.TestCase):
+    def test_expected_shift(self):
+        self.assertEqual(move_angle('right', 5, 0.5), 30.0)
+        self.assertAlmostEqual(move_angle('up', 3, 1.0), 30.0 * 31 / 63)
+        dy, dx = expected_shift('right', 5, 0.5, (252, 336), fov=45)
+        self.assertEqual((dy, dx), (0, 224.0))
+        self.assertEqual(expected_shift('left', 5, 0.5, (252, 336), fov=45), (0, -224.0))
+        self.assertLess(expected_shift('up', 5, 0.5, (252, 336))[0], 0)
+
+    def test_offsets(self):
+        scene = landscape(200, 1000)
+        for step, prior in ((60, 50), (40, 45), (-70, -60)):
+            xs = 300 + step * np.arange(5) + np.array([0, 3, -4, 6, 0])
+            ys = 40 + np.array([0, 1, -1, 0, 2])
+            frames = [scene[y:y + 72, x:x + 96] for y, x in zip(ys, xs)]
+            offsets, fallback = estimate_offsets(frames, (0, prior))
+            np.testing.assert_array_equal(offsets, np.diff(np.stack([ys, xs], axis=1), axis=0))
+            self.assertFalse(fallback.any())
+
+        # vertical sweeps search along y
+        scene = scene.T
+        frames = [scene[40 + 30 * i:112 + 30 * i, 50:146] for i in range(4)]
+        offsets, fallback = estimate_offsets(frames, (25, 0))
+        np.testing.assert_array_equal(offsets, [[30, 0]] * 3)
+
+    def test_fallback(self):
+        rng = np.random.default_rng(0)
+        # nothing to correlate on a uniform sky
+        flat = [20 + rng.normal(0, 0.05, (72, 96)).astype(np.float32) for _ in range(4)]
+        offsets, fallback = estimate_offsets(flat, (0, 40))
+        self.assertTrue(fallback.all())
+        np.testing.assert_array_equal(offsets, [[0, 40]] * 3)
+        # shots that hardly overlap keep the move
+        offsets, fallback = estimate_offsets(flat, (0, 95))
+        self.assertTrue(fallback.all())
+
+
+class TestBlend(unittest.TestCase):
+    def test_feathered_seam(self):
+        frames = [np.full((4, 10), 10.0), np.full((4, 10), 20.0)]
+        mosaic = blend(frames, [(0, 0), (1, 6)])
+        self.assertEqual(mosaic.shape, (5, 16))
+        # corners no frame covers
+        self.assertTrue(np.isnan(mosaic[0, 12]) and np.isnan(mosaic[4, 0]))
+        # the overlap goes from the first frame to the second
+        seam = mosaic[2, 5:11]
+        self.assertEqual(seam[0], 10)
+        self.assertTrue(np.all(np.diff(seam) > 0))
+        self.assertTrue(np.all((seam[1:5] > 10) & (seam[1:5] < 20)))
+        self.assertEqual(mosaic[2, 12], 20)
+
+    def test_colour_frames(self):
+        frames = [np.zeros((4, 6, 3), np.uint8), np.full((4, 6, 3), 200, np.uint8)]
+        mosaic = blend(frames, [(0, 4), (0, 0)], fill=0)
+        self.assertEqual(mosaic.shape, (4, 10, 3))
+        self.assertEqual(mosaic[0, 0, 0], 200)
+        self.assertEqual(mosaic[0, 9, 0], 0)
+
+
+class TestPanoramaSweep(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.scene = landscape(100, 600)
+        # the visible camera sees the same scene at twice the resolution
+        visible = np.repeat(np.repeat(self.scene, 2, axis=0), 2, axis=1)
+        grey = np.clip((visible - 5) * 8, 0, 255).astype(np.uint8)
+        self.visible = np.repeat(grey[..., None], 3, axis=2)
+        # speed 3 for 0.5 s turns 14.8 deg, 79 pixels of an 18 deg field of view
+        self.xs = [10, 85, 168, 250]
+        self.sweep = PanoramaSweep('right', 3, 0.5, fov=18.0)
+        # shots come back from the workers in any order
+        for shot in (2, 0, 3, 1):
+            x = self.xs[shot]
+            self.sweep.add(shot, 1_700_000_000_000_000_000 + shot * 10 ** 9, self.scene[10:82, x:x + 96], METADATA)
+            jpeg = write_jpeg(self.visible[20:164, 2 * x:2 * x + 192], self.root / f"{shot}.jpg")
+            self.sweep.add_visible(shot, jpeg)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_assemble(self):
+        panorama = self.sweep.assemble()
+        self.assertEqual(panorama.fallbacks, 0)
+        np.testing.assert_array_equal(panorama.positions[:, 1], np.array(self.xs) - 10)
+        self.assertEqual(panorama.temperature.shape, (72, 336))
+        np.testing.assert_allclose(panorama.temperature, self.scene[10:82, 10:346], atol=1e-4)
+        self.assertEqual(panorama.visible.shape, (144, 672, 3))
+        # JPEG artefacts only
+        error = np.abs(panorama.visible.astype(int) - self.visible[20:164, 20:692])
+        self.assertLess(error.mean(), 3)
+        self.assertEqual(len(panorama.times), 4)
+        self.assertEqual(panorama.metadata['sensor'], 'left')
+
+    def test_netcdf(self):
+        panorama = self.sweep.assemble()
+        path = write_panorama_netcdf(self.root / "panorama.nc", panorama, attrs={'direction': 'right'})
+        with xr.open_dataset(path, decode_times=False) as ds:
+            self.assertEqual(ds.temperature.shape, (72, 336))
+            np.testing.assert_allclose(ds.temperature.values, panorama.temperature, atol=0.0051)
+            self.assertEqual(list(ds.shot_x.values), [0, 75, 158, 240])
+            self.assertEqual(ds.time.values[1], 1700000001.0)
+            self.assertEqual((ds.attrs['direction'], ds.attrs['width']), ('right', '336'))
+
+    def test_upload(self):
+        uploader = FakeUploader()
+        upload_panorama(uploader, self.sweep, self.root / "pending", "_Pt1-right-S3xD500ms_N4", meta={'position': '1'})
+        # named after the local time of the first shot, like the single shots
+        name = datetime.datetime.fromtimestamp(1_700_000_000).strftime('_%Y-%m-%dT%H%M%S') + "_Pt1-right-S3xD500ms_N4"
+        self.assertEqual(uploader.files, [f"left_336x72.thermal.celsius.panorama{name}.nc",
+                                          f"left_336x72.thermal.celsius.panorama{name}_plot.jpg",
+                                          f"672x144.panorama{name}.jpg"])
+        self.assertEqual(uploader.published, [('panorama.shots', 4, {'position': '1'}),
+                                              ('panorama.fallbacks', 0, {'position': '1'})])
+        self.assertIsNone(upload_panorama(uploader, PanoramaSweep('right', 3, 0.5), self.root, "_empty"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+
+from MobotixPipeline import ScanPipeline, SharedPipeline
+
+
+class TestScanPipeline(unittest.TestCase):
+    def test_inline(self):
+        calls = []
+        with ScanPipeline(lambda x: calls.append(x) or x * 2, workers=0) as pipeline:
+            pipeline.submit(1)
+            self.assertEqual(calls, [1])
+            self.assertEqual(pipeline.join(), [2])
+
+    def test_workers_return_results(self):
+        with ScanPipeline(lambda x: x * 2, workers=2) as pipeline:
+            for i in range(10):
+                pipeline.submit(i)
+            self.assertEqual(sorted(pipeline.join()), [i * 2 for i in range(10)])
+            self.assertEqual(pipeline.join(), [])
+
+    def test_submit_blocks_when_full(self):
+        release = threading.Event()
+        pipeline = ScanPipeline(lambda x: release.wait(), workers=1, max_pending=1)
+        pipeline.submit(0)  # taken by the worker
+        pipeline.submit(1)  # fills the queue
+        blocked = threading.Thread(target=pipeline.submit, args=(2,))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+        release.set()
+        blocked.join()
+        pipeline.join()
+        pipeline.close()
+
+    def test_error_is_raised_on_join(self):
+        def process(x):
+            if x == 3:
+                raise ValueError("bad frame")
+            return x
+
+        with ScanPipeline(process, workers=2) as pipeline:
+            for i in range(5):
+                pipeline.submit(i)
+            with self.assertRaises(ValueError):
+                pipeline.join()
+            pipeline.close()
+
+
+class TestSharedPipeline(unittest.TestCase):
+    def test_cameras_are_served_in_turn(self):
+        order = []
+        release = threading.Event()
+        with SharedPipeline(workers=1, max_pending=8) as pool:
+            busy = pool.client(lambda x: release.wait(), name='busy')
+            north = pool.client(lambda x: order.append(('north', x)), name='north')
+            south = pool.client(lambda x: order.append(('south', x)), name='south')
+            busy.submit(0)  # holds the only worker
+            time.sleep(0.05)
+            for i in range(4):
+                north.submit(i)
+            for i in range(2):
+                south.submit(i)
+            release.set()
+            north.join()
+            south.join()
+            busy.join()
+        # the long north backlog does not hold up the south camera
+        self.assertEqual(order[:4], [('north', 0), ('south', 0), ('north', 1), ('south', 1)])
+        self.assertEqual(len(order), 6)
+
+    def test_join_and_metrics_per_camera(self):
+        def process(x):
+            if x < 0:
+                raise ValueError("bad frame")
+            time.sleep(0.01)
+            return x
+
+        with SharedPipeline(workers=2) as pool:
+            with pool.client(process, name='north') as north, pool.client(process, name='south') as south:
+                for i in range(5):
+                    north.submit(i)
+                south.submit(-1)
+                self.assertEqual(sorted(north.join()), [0, 1, 2, 3, 4])
+                with self.assertRaises(ValueError):
+                    south.join()
+                metrics = north.metrics()
+                self.assertEqual(metrics['jobs'], 5)
+                self.assertGreaterEqual(metrics['busy'], 0.05)
+                self.assertEqual(north.metrics()['jobs'], 0)
+
+    def test_submit_blocks_per_camera(self):
+        release = threading.Event()
+        pool = SharedPipeline(workers=1, max_pending=1)
+        slow = pool.client(lambda x: release.wait())
+        slow.submit(0)  # taken by the worker
+        slow.submit(1)  # fills the queue of the camera
+        blocked = threading.Thread(target=slow.submit, args=(2,))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+        # other cameras can still queue
+        other = pool.client(lambda x: x)
+        other.submit(0)
+        release.set()
+        blocked.join()
+        slow.close()
+        self.assertEqual(other.join(), [0])
+        pool.close()
+
+    def test_inline(self):
+        with SharedPipeline(workers=0) as pool:
+            client = pool.client(lambda x: x * 2)
+            client.submit(3)
+            self.assertEqual(client.join(), [6])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from MobotixPresets import angular_distance, optimize_order, preset_grid, tour_time, travel_time
+
+
+class TestPresets(unittest.TestCase):
+    def test_grid(self):
+        self.assertEqual(preset_grid(1), (0, 0))
+        self.assertEqual(preset_grid(32), (7, 3))
+        with self.assertRaises(ValueError):
+            preset_grid(33)
+
+    def test_pan_wraps_around(self):
+        self.assertEqual(angular_distance(1, 29), (45.0, 0.0))
+        self.assertEqual(angular_distance(1, 17)[0], 180.0)
+        self.assertEqual(travel_time(5, 5), 0.0)
+        self.assertLess(travel_time(1, 5), travel_time(1, 17))
+
+
+class TestOptimizeOrder(unittest.TestCase):
+    def setUp(self):
+        self.presets = [i for j in range(4) for i in range(j + 1, 33, 4)]
+
+    def test_keeps_preset_ids(self):
+        order = optimize_order(self.presets)
+        self.assertEqual(sorted(order), sorted(self.presets))
+        self.assertEqual(order[0], self.presets[0])
+
+    def test_shorter_than_interleaved(self):
+        self.assertLess(tour_time(optimize_order(self.presets)), tour_time(self.presets))
+
+    def test_starts_next_to_last_position(self):
+        order = optimize_order(self.presets, start=17)
+        self.assertEqual(order[0], 17)
+        self.assertLessEqual(tour_time(order, start=17), tour_time(self.presets, start=17))
+
+    def test_short_lists(self):
+        self.assertEqual(optimize_order([]), [])
+        self.assertEqual(optimize_order([7]), [7])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import argparse
+import datetime
+import sys
+import time
+import unittest
+
+from MobotixSchedule import CronSchedule, IntervalSchedule, parse_schedule
+from MobotixScan import scan_daemon
+
+
+class TestSchedule(unittest.TestCase):
+    def test_interval(self):
+        schedule = parse_schedule("300")
+        self.assertIsInstance(schedule, IntervalSchedule)
+        after = datetime.datetime(2024, 5, 1, 12, 3, 10)
+        run = schedule.next_run(after)
+        self.assertEqual(run.timestamp() % 300, 0)
+        self.assertTrue(0 < (run - after).total_seconds() <= 300)
+
+    def test_cron_steps_and_ranges(self):
+        schedule = parse_schedule("*/10 6-18 * * *")
+        self.assertIsInstance(schedule, CronSchedule)
+        self.assertEqual(schedule.next_run(datetime.datetime(2024, 5, 1, 12, 3, 10)),
+                         datetime.datetime(2024, 5, 1, 12, 10))
+        self.assertEqual(schedule.next_run(datetime.datetime(2024, 5, 1, 18, 55)),
+                         datetime.datetime(2024, 5, 2, 6, 0))
+
+    def test_cron_weekdays_and_months(self):
+        # 2024-05-03 is a Friday, 0 and 7 are both Sunday
+        self.assertEqual(CronSchedule("30 2 * * 0").next_run(datetime.datetime(2024, 5, 3, 9, 0)),
+                         datetime.datetime(2024, 5, 5, 2, 30))
+        self.assertEqual(CronSchedule("0 0 * * 7").next_run(datetime.datetime(2024, 5, 3, 9, 0)),
+                         datetime.datetime(2024, 5, 5, 0, 0))
+        self.assertEqual(CronSchedule("0 0 1 1,7 *").next_run(datetime.datetime(2024, 5, 3)),
+                         datetime.datetime(2024, 7, 1))
+
+    def test_invalid(self):
+        for spec in ("0", "-5", "61 * * * *", "* * *", "0 0 31 2 *"):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_schedule(spec).next_run(datetime.datetime(2024, 1, 1))
+
+
+
+class StubSession:
+    '''Stands in for a `ScanSession`: records what the daemon publishes and its resets.'''
+    def __init__(self, args):
+        self.published = []
+        self.resets = 0
+        self.closed = False
+        self.plugin = self
+
+    def publish(self, name, value, meta={}, timestamp=None):
+        self.published.append((name, value, meta))
+
+    def reset(self):
+        self.resets += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.closed = True
+
+
+class TestScanDaemon(unittest.TestCase):
+    def test_failures_and_skipped_times(self):
+        sessions, starts = [], []
+
+        def open_session(args):
+            sessions.append(StubSession(args))
+            return sessions[-1]
+
+        def runner(session):
+            starts.append(time.time())
+            run = len(starts)
+            if run == 1:
+                raise RuntimeError("camera unreachable")
+            if run == 2:
+                # past --scantimeout and the scheduled time after it
+                time.sleep(5)
+            if run == 3:
+                sys.exit("Exit error")
+
+        args = argparse.Namespace(schedule="1", scan_timeout=2, mode='preset')
+        self.assertEqual(scan_daemon(args, max_runs=4, open_session=open_session, runner=runner), 4)
+
+        session, = sessions
+        self.assertTrue(session.closed)
+        self.assertEqual([(meta['run'], meta['status']) for name, value, meta in session.published], [
+            ('1', 'Scan_Error'), ('2', 'Scan_Timeout'), ('3', 'Scan_Error'), ('4', 'Scan_Complete')])
+        self.assertEqual(session.resets, 3)
+        self.assertAlmostEqual(session.published[1][1], 2, delta=0.5)
+        # every run on a scheduled second, the ones missed during the timed out run skipped
+        for start in starts:
+            self.assertLess(start % 1, 0.3)
+        gaps = [round(b - a) for a, b in zip(starts, starts[1:])]
+        self.assertEqual(gaps, [1, 3, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import io
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from MobotixControl import HTTPTransport
+from MobotixPresets import travel_time
+from MobotixSettle import SettleDetector
+from MobotixSimulator import StubCameraServer
+
+
+def jpeg(level):
+    buf = io.BytesIO()
+    Image.fromarray(np.full((64, 64), level, dtype=np.uint8)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+class TestSettleDetector(unittest.TestCase):
+    def setUp(self):
+        self.frames = iter([jpeg(0), jpeg(120), jpeg(240)])
+        self.camera = StubCameraServer(snapshot=lambda: next(self.frames, jpeg(240))).start()
+        self.transport = HTTPTransport('admin', 'meinsm', self.camera.address)
+
+    def tearDown(self):
+        self.transport.close()
+        self.camera.stop()
+
+    def test_frames_settle_after_change(self):
+        settle = SettleDetector(self.transport, strategy='frames', max_wait=3, interval=0.01)
+        seconds, strategy = settle.wait(1, 5)
+        self.assertEqual(strategy, 'frames')
+        self.assertLess(seconds, 1)
+
+    def test_auto_falls_back_to_travel(self):
+        self.camera.snapshot = None
+        settle = SettleDetector(self.transport, strategy='auto', max_wait=3)
+        seconds, strategy = settle.wait(1, 2)
+        self.assertEqual(strategy, 'travel')
+        self.assertAlmostEqual(seconds, travel_time(1, 2), delta=0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
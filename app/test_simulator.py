@@ -0,0 +1,86 @@
+import subprocess
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from MobotixControl import MobotixPT
+from MobotixPresets import travel_time
+from MobotixSettle import SettleDetector
+from MobotixSimulator import FakeSampler, SimulatedPT, StubCameraServer, decode_pelco, write_sampler
+from MobotixThermal import read_celsius_csv
+
+
+class TestSimulatedPT(unittest.TestCase):
+    def test_decode_pelco(self):
+        self.assertEqual(decode_pelco("%FF%01%00%07%00%10%18"), (0x07, 0x00, 0x10))
+        with self.assertRaises(ValueError):
+            decode_pelco("%FF%01%00%07%00%10%19")
+
+    def test_preset_moves_take_travel_time(self):
+        pt = SimulatedPT(time_scale=0.1)
+        with StubCameraServer(pt=pt) as camera:
+            mobot_pt = MobotixPT('admin', 'meinsm', camera.address)
+            try:
+                mobot_pt.move_to_preset(17)
+                start = time.monotonic()
+                self.assertTrue(pt.moving())
+                self.assertEqual(pt.preset, 17)
+                while pt.moving():
+                    time.sleep(0.01)
+                self.assertAlmostEqual(time.monotonic() - start, 0.1 * travel_time(1, 17), delta=0.05)
+                self.assertEqual(pt.angles(), (180.0, 0.0))
+
+                mobot_pt.move('left', 5, 0.1)
+                self.assertFalse(pt.moving())
+                self.assertIsNone(pt.preset)
+                self.assertLess(pt.angles()[0], 180.0)
+            finally:
+                mobot_pt.close()
+
+    def test_settle_on_simulated_snapshots(self):
+        pt = SimulatedPT(time_scale=0.2)
+        with StubCameraServer(pt=pt) as camera:
+            mobot_pt = MobotixPT('admin', 'meinsm', camera.address)
+            try:
+                settle = SettleDetector(mobot_pt.transport, interval=0.05)
+                mobot_pt.move_to_preset(5)
+                seconds, strategy = settle.wait(1, 5)
+            finally:
+                mobot_pt.close()
+        self.assertEqual(strategy, 'frames')
+        self.assertFalse(pt.moving())
+        self.assertLess(seconds, 3)
+
+
+class TestFakeSampler(unittest.TestCase):
+    def test_sampler_executable(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sampler = write_sampler(Path(tmp) / "thermal-raw", width=8, height=6, thermal_width=12,
+                                    thermal_height=9, fps=50, frames=3)
+            out = subprocess.run([str(sampler), "--url", "127.0.0.1", "--user", "admin", "--password",
+                                  "meinsm", "--dir", str(Path(tmp) / "data")],
+                                 check=True, capture_output=True, text=True).stdout
+            self.assertEqual(out.count("received video frame #"), 3)
+
+            files = sorted((Path(tmp) / "data").iterdir())
+            self.assertEqual(len(files), 6)
+            rgb = [f for f in files if f.name.endswith("_8x6.rgb")]
+            self.assertEqual(rgb[0].stat().st_size, 8 * 6 * 4)
+            csv = [f for f in files if f.name.endswith("_left_12x9_14bit.thermal.celsius.csv")]
+            metadata, data = read_celsius_csv(csv[0])
+            self.assertEqual(data.shape, (9, 12))
+            # nothing left besides the output directory and the executable
+            self.assertEqual(sorted(p.name for p in Path(tmp).iterdir()), ["data", "thermal-raw"])
+
+    def test_frame_rate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.monotonic()
+            with open(Path(tmp) / "out.txt", "w") as out:
+                FakeSampler(Path(tmp) / "data", width=8, height=6, fps=20, frames=5).run(out=out)
+            self.assertGreaterEqual(time.monotonic() - start, 4 / 20)
+            self.assertEqual(len(list((Path(tmp) / "data").iterdir())), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
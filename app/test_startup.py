@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+from MobotixStartup import LAZY_MODULES, measure_imports
+
+APP_DIR = Path(__file__).resolve().parent
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_entry_point_skips_heavy_modules(self):
+        code = "import sys, app; print(','.join(m for m in sys.argv[1:] if m in sys.modules))"
+        result = subprocess.run([sys.executable, '-c', code, *LAZY_MODULES], cwd=APP_DIR,
+                                check=True, capture_output=True, text=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_measure_imports(self):
+        costs = measure_imports(['json', 'no_such_module'])
+        self.assertEqual([name for name, _ in costs], ['json', 'no_such_module'])
+        self.assertGreaterEqual(costs[0][1], 0)
+        self.assertIsNone(costs[1][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
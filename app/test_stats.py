@@ -0,0 +1,107 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from MobotixControl import MobotixImager
+from MobotixFrameStore import FrameStore
+from MobotixGate import ChangeGate
+from MobotixScan import upload_position
+from MobotixStats import ThermalStats, frame_stats, load_rois, parse_thresholds
+from MobotixThermal import write_celsius_csv
+
+
+class RecordingPlugin:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, name, value, meta={}, timestamp=None):
+        self.published.append((name, value, meta, timestamp))
+
+    def upload_file(self, path, meta={}, timestamp=None):
+        pass
+
+
+class TestFrameStats(unittest.TestCase):
+    def test_stats(self):
+        values = np.arange(101, dtype=np.float32).reshape(1, 101)
+        stats = frame_stats(values, thresholds=[50, 90.5])
+        self.assertEqual(stats['min'], 0)
+        self.assertEqual(stats['max'], 100)
+        self.assertAlmostEqual(stats['mean'], 50)
+        self.assertEqual((stats['p5'], stats['p50'], stats['p95']), (5, 50, 95))
+        self.assertEqual(stats['hot'], {50: 50, 90.5: 10})
+
+    def test_nan_and_empty(self):
+        stats = frame_stats(np.array([[np.nan, 1.0], [3.0, np.nan]]))
+        self.assertEqual((stats['min'], stats['mean'], stats['max']), (1, 2, 3))
+        self.assertNotIn('hot', stats)
+        self.assertEqual(frame_stats(np.full((2, 2), np.nan)), {})
+
+    def test_parse_thresholds(self):
+        self.assertEqual(parse_thresholds("40, 60.5"), [40, 60.5])
+        self.assertEqual(parse_thresholds(""), [])
+
+
+class TestThermalStats(unittest.TestCase):
+    def test_publish_with_rois(self):
+        data = np.full((252, 336), 20, dtype=np.float32)
+        data[:80] = 45
+        with tempfile.TemporaryDirectory() as tmp:
+            mask = np.zeros((252, 336), dtype=bool)
+            mask[200:, 300:] = True
+            np.save(Path(tmp) / "corner.npy", mask)
+            (Path(tmp) / "rois.json").write_text(json.dumps({
+                "5": {"roof": [0, 0, 80, 336]},
+                "5_SS": {"corner": "corner.npy"},
+            }))
+            stats = ThermalStats([40], load_rois(Path(tmp) / "rois.json"))
+
+        plugin = RecordingPlugin()
+        path = Path("1700000000000000000_left_336x252_14bit.thermal.celsius.csv")
+        stats.publish(plugin, path, data, {'position': '5', 'loop_num': '1'})
+        published = {(name, meta['roi'], meta.get('threshold')): (value, meta, timestamp)
+                     for name, value, meta, timestamp in plugin.published}
+
+        self.assertEqual(published[('thermal.max', 'frame', None)][0], 45)
+        self.assertEqual(published[('thermal.hot.count', 'frame', '40')][0], 80 * 336)
+        self.assertEqual(published[('thermal.min', 'roof', None)][0], 45)
+        value, meta, timestamp = published[('thermal.mean', 'roof', None)]
+        self.assertEqual(meta, {'position': '5', 'loop_num': '1', 'roi': 'roof'})
+        self.assertEqual(timestamp, 1700000000000000000)
+
+        # direction scans use the regions of the direction, then of the preset
+        rois = stats.compute(data, {'position': '5', 'direction': 'SS'})
+        self.assertEqual(sorted(rois), ['corner', 'frame'])
+        self.assertEqual(rois['corner']['max'], 20)
+        self.assertEqual(sorted(stats.compute(data, {'position': '5', 'direction': 'NB'})), ['frame', 'roof'])
+        self.assertEqual(sorted(stats.compute(data, {'position': '9'})), ['frame'])
+
+    def test_bad_region(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "rois.json").write_text(json.dumps({"5": {"roof": [0, 80]}}))
+            with self.assertRaises(ValueError):
+                load_rois(Path(tmp) / "rois.json")
+
+    def test_with_gate(self):
+        # the statistics of every frame, the gate on the last one
+        plugin = RecordingPlugin()
+        with tempfile.TemporaryDirectory() as tmp:
+            store = FrameStore(tmp, position=1)
+            for i, value in enumerate((20, 50)):
+                path = Path(tmp) / f"{1700000000000000000 + i}_left_8x6_14bit.thermal.celsius.csv"
+                write_celsius_csv(path, np.full((6, 8), value, dtype=np.float32))
+                store.add(path)
+            imager = MobotixImager("127.0.0.1", "admin", "meinsm", tmp, frames=2, thermal_format='compact')
+            upload_position(plugin, imager, store, {'position': '1', 'loop_num': '1'}, gate=ChangeGate(),
+                            stats=ThermalStats([40]))
+
+        self.assertEqual([value for name, value, meta, _ in plugin.published if name == 'thermal.max'], [20, 50])
+        self.assertEqual([(value, meta['reason']) for name, value, meta, _ in plugin.published
+                          if name == 'gate.upload'], [(1, 'first')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from waggle.plugin import Plugin
+
+import MobotixScan
+from MobotixControl import MobotixPT
+from MobotixPresets import default_speed_table, move_angle
+from MobotixScan import scan_custom
+from MobotixSimulator import SimulatedPT, StubCameraServer, write_sampler
+from MobotixSweep import (calibrate_speeds, estimate_velocity, frame_angles, group_frames, load_speed_table,
+                          save_speed_table, speed_table_path)
+from MobotixThermal import write_celsius_csv
+from test_multi import make_args
+from test_panorama import FakeUploader, landscape
+
+
+class SceneImager:
+    ''' Streams the thermal frames of `scene` in front of a `SimulatedPT`, like `MobotixImager.start_stream`.'''
+    def __init__(self, pt, directory, scene, fov, width=96, height=72, rate=40):
+        self.pt = pt
+        self.directory = Path(directory)
+        self.scene = scene
+        self.pixels_per_degree = width / fov
+        self.shape = (height, width)
+        self.rate = rate
+        self.files = []
+
+    def _run(self):
+        height, width = self.shape
+        while not self._stop.is_set():
+            timestamp = time.time_ns()
+            x = 20 + int(round(self.pt.angles()[0] * self.pixels_per_degree))
+            path = self.directory / f"{timestamp}_left_{width}x{height}_14bit.thermal.celsius.csv"
+            write_celsius_csv(path, self.scene[10:10 + height, x:x + width])
+            self.files.append(path)
+            time.sleep(1 / self.rate)
+
+    def start_stream(self, tag=None, interval=0):
+        self.files = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        while not self.files:
+            time.sleep(0.001)
+
+    def stop_stream(self):
+        time.sleep(2 / self.rate)
+        self._stop.set()
+        self._thread.join()
+        return self.files
+
+
+class TestSpeedTable(unittest.TestCase):
+    def test_load_and_save(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = speed_table_path(Path(tmp) / "data")
+            self.assertEqual(path, Path(tmp) / "data.speeds.json")
+            # the estimates until calibrated
+            self.assertEqual(load_speed_table(path), default_speed_table())
+            self.assertEqual(move_angle('right', 5, 0.5, table=load_speed_table(path)), 30.0)
+
+            save_speed_table(path, {'pan': {3: 25.0}}, fov=45.0)
+            save_speed_table(path, {'pan': {5: 50.0}, 'tilt': {1: 0.5}}, fov=45.0)
+            table = load_speed_table(path)
+            self.assertEqual((table['pan'][3], table['pan'][5], table['tilt'][1]), (25.0, 50.0, 0.5))
+            self.assertEqual(table['pan'][1], default_speed_table()['pan'][1])
+            self.assertEqual(json.loads(path.read_text())['fov'], 45.0)
+
+            path.write_text("{")
+            self.assertEqual(load_speed_table(path), default_speed_table())
+
+
+class TestVelocity(unittest.TestCase):
+    def test_frame_angles(self):
+        start, stop = 10 ** 18, 10 ** 18 + 2 * 10 ** 9
+        angles = frame_angles([start - 10 ** 8, start, start + 5 * 10 ** 8, stop + 10 ** 8], start, stop, 30.0)
+        np.testing.assert_allclose(angles, [0, 0, 15, 60])
+
+    def test_group_frames(self):
+        files = ["/tmp/2_1280x960.rgb", "/tmp/1_left.thermal.celsius.csv", "/tmp/2_left.thermal.celsius.csv",
+                 "/tmp/plot.jpg"]
+        self.assertEqual([(ts, len(paths)) for ts, paths in group_frames(files)], [(1, 1), (2, 2)])
+
+    def test_estimate_velocity(self):
+        scene = landscape(100, 800)
+        # 20 deg/s for a 96 pixel wide, 24 degree field of view: 80 pixels/s, frames about 1/8 s apart
+        rng = np.random.default_rng(1)
+        times = np.cumsum(rng.uniform(0.1, 0.15, 12))
+        xs = np.rint(50 + 80 * times).astype(int)
+        frames = [scene[10:82, x:x + 96] for x in xs]
+        timestamps = (times * 1e9).astype(np.int64)
+        self.assertAlmostEqual(estimate_velocity(frames, timestamps, 'right', 30.0, fov=24.0), 20.0, delta=0.5)
+        # the other way round
+        self.assertAlmostEqual(estimate_velocity(frames[::-1], timestamps, 'left', 15.0, fov=24.0), 20.0, delta=0.5)
+        # nothing to align on a uniform sky
+        flat = [20 + rng.normal(0, 0.05, (72, 96)) for _ in range(4)]
+        self.assertIsNone(estimate_velocity(flat, timestamps[:4], 'right', 20.0, fov=24.0))
+
+
+class TestCalibration(unittest.TestCase):
+    def test_calibrate_simulated_head(self):
+        # the simulated head turns at 40 deg/s at full speed, the estimates assume 60
+        pt = SimulatedPT(pan_speed=40.0)
+        uploader = FakeUploader()
+        with tempfile.TemporaryDirectory() as tmp, StubCameraServer(pt=pt) as camera:
+            mobot_pt = MobotixPT('admin', 'meinsm', camera.address)
+            imager = SceneImager(pt, tmp, landscape(100, 400), fov=20.0)
+            path = Path(tmp) / "data.speeds.json"
+            try:
+                table = calibrate_speeds(mobot_pt, imager, uploader, path, speeds=(3, 5), duration=0.5, fov=20.0)
+            finally:
+                mobot_pt.close()
+
+            self.assertAlmostEqual(table['pan'][3], 40.0 * 31 / 63, delta=1.5)
+            self.assertAlmostEqual(table['pan'][5], 40.0, delta=2.0)
+            self.assertEqual(table['pan'][1], default_speed_table()['pan'][1])
+            self.assertEqual(load_speed_table(path), table)
+            self.assertEqual([p.name for p in Path(tmp).iterdir()], ["data.speeds.json"])
+        self.assertEqual([(name, meta) for name, value, meta in uploader.published],
+                         [('calibration.velocity', {'axis': 'pan', 'speed': '3'}),
+                          ('calibration.velocity', {'axis': 'pan', 'speed': '5'})])
+
+
+class TestSweepScan(unittest.TestCase):
+    def test_continuous_sweep(self):
+        published = []
+
+        def publish(self, name, value, meta={}, timestamp=None):
+            published.append((name, value, meta))
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                StubCameraServer(pt=SimulatedPT(time_scale=0.05)) as camera, \
+                mock.patch.dict(os.environ, {'WAGGLE_PLUGIN_UPLOAD_PATH': str(Path(tmp) / "uploads")}), \
+                mock.patch.object(Plugin, 'publish', publish), \
+                mock.patch.object(MobotixScan, 'ARCHIVE_DIR', str(Path(tmp) / "archive")):
+            sampler = write_sampler(Path(tmp) / "thermal-raw", width=32, height=24, thermal_width=16,
+                                    thermal_height=12, fps=50)
+            args = make_args(Path(tmp) / "data", ip=camera.address, sampler=str(sampler), mode='custom',
+                             num_shots='3', move_speed='3', move_duration='200', sweep=True, sweep_interval=0.1)
+            save_speed_table(speed_table_path(args.workdir), {'pan': {3: 10.0}}, fov=45.0)
+            scan_custom(args)
+
+            # one move for the whole sweep
+            self.assertEqual(camera.commands, ['%FF%01%00%07%00%01%09', '%FF%01%00%02%1F%00%22',
+                                               '%FF%01%00%00%00%00%01'])
+            labels = [json.loads(meta.read_text())['labels'] for meta in (Path(tmp) / "uploads").glob("*/meta")]
+            angles = sorted(float(label['sweep_angle']) for label in labels if label['filename'].endswith(".tfr"))
+
+        shots = [value for name, value, meta in published if name == 'sweep.frames']
+        self.assertEqual(len(angles), shots[0])
+        # a frame before the move, frames every 0.1 s of the 0.6 s move and one after it
+        self.assertGreaterEqual(len(angles), 5)
+        self.assertEqual(angles[0], 0.0)
+        self.assertAlmostEqual(angles[-1], 10.0 * 0.6, delta=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import tempfile
+import tracemalloc
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from MobotixControl import MobotixImager
+from MobotixFrameStore import FrameStore
+from MobotixThermal import (FrameAccumulator, read_celsius_csv, read_thermal_frame, thermal_values,
+                            write_celsius_csv, write_thermal_frame)
+
+
+class TestReadCelsiusCsv(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "1700000000000000000_left_7x5_14bit.thermal.celsius.csv"
+        self.data = np.arange(35, dtype=np.float32).reshape(5, 7) / 4 - 3
+        write_celsius_csv(self.path, self.data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_metadata(self):
+        metadata, _ = read_celsius_csv(self.path)
+        self.assertEqual(metadata['width'], '7')
+        self.assertEqual(metadata['height'], '5')
+        self.assertEqual(metadata['unit'], 'degrees Celsius')
+
+    def test_full_read(self):
+        _, data = read_celsius_csv(self.path)
+        self.assertEqual(data.dtype, np.float32)
+        np.testing.assert_array_equal(data, self.data)
+
+    def test_chunked_read(self):
+        for chunk_rows in (1, 2, 5, 10):
+            _, data = read_celsius_csv(self.path, chunk_rows=chunk_rows)
+            np.testing.assert_array_equal(data, self.data)
+
+    def test_truncated_file(self):
+        lines = self.path.read_text().splitlines(keepends=True)
+        self.path.write_text(''.join(lines[:-1]))
+        with self.assertRaises(ValueError):
+            read_celsius_csv(self.path)
+        with self.assertRaises(ValueError):
+            read_celsius_csv(self.path, chunk_rows=2)
+
+
+class TestCompactThermalFrame(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_celsius_round_trip(self):
+        rng = np.random.default_rng(1)
+        data = (rng.uniform(-70, 570, (9, 13))).round(2).astype(np.float32)
+        data[0, 0] = 1000  # clipped to the int16 range
+        path = write_thermal_frame(self.root / "frame.tfr", data, {'width': '13', 'height': '9'})
+        self.assertLess(path.stat().st_size, 256 + data.size * 2)
+
+        header, packed = read_thermal_frame(path)
+        self.assertIsInstance(packed, np.memmap)
+        self.assertEqual(packed.dtype, np.int16)
+        self.assertEqual(header['metadata'], {'width': '13', 'height': '9'})
+        values = thermal_values(header, packed)
+        self.assertAlmostEqual(float(values[0, 0]), 577.67, places=4)
+        np.testing.assert_allclose(values.ravel()[1:], data.ravel()[1:], atol=1e-4)
+
+        _, loaded = read_thermal_frame(path, mmap=False)
+        np.testing.assert_array_equal(loaded, packed)
+
+    def test_counts(self):
+        counts = np.arange(20, dtype=np.uint16).reshape(4, 5) * 800
+        path = write_thermal_frame(self.root / "frame.tfr", counts, {}, kind='counts')
+        header, packed = read_thermal_frame(path)
+        self.assertEqual(header['units'], 'counts')
+        np.testing.assert_array_equal(packed, counts)
+        np.testing.assert_array_equal(thermal_values(header, packed), counts)
+
+    def test_not_a_frame(self):
+        path = self.root / "frame.tfr"
+        path.write_bytes(b"sensor;left\n\n" + b"\0" * 16)
+        with self.assertRaises(ValueError):
+            read_thermal_frame(path)
+
+    def test_compact_conversion(self):
+        ts = 1700000000000000000
+        data = np.arange(35, dtype=np.float32).reshape(5, 7) / 4 - 3
+        write_celsius_csv(self.root / f"{ts}_left_7x5_14bit.thermal.celsius.csv", data)
+        write_celsius_csv(self.root / f"{ts}_left_7x5_14bit.thermal.uint.csv", np.arange(35).reshape(5, 7))
+        store = FrameStore(self.root)
+        for path in self.root.iterdir():
+            store.add(path)
+
+        imager = MobotixImager("127.0.0.1", "admin", "meinsm", self.root, frames=1, thermal_format='compact')
+        imager.convert(store)
+
+        names = sorted(path.name for path in store.paths())
+        self.assertEqual(names, [f"{ts}_left_7x5_14bit.thermal.celsius.tfr",
+                                 f"{ts}_left_7x5_14bit.thermal.celsius_plot.jpg",
+                                 f"{ts}_left_7x5_14bit.thermal.uint.tfr"])
+        self.assertEqual(sorted(path.name for path in self.root.iterdir()), names)
+        header, packed = read_thermal_frame(self.root / names[0])
+        self.assertEqual(header['metadata']['width'], '7')
+        np.testing.assert_allclose(thermal_values(header, packed), data, atol=1e-4)
+
+
+class TestFrameAccumulator(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        rng = np.random.default_rng(2)
+        self.frames = (30 + rng.normal(0, 0.5, (6, 5, 7)) + np.arange(7)).astype(np.float32)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_statistics(self):
+        accumulator = FrameAccumulator()
+        for i, frame in enumerate(self.frames):
+            accumulator.add(frame, time=100.0 + i)
+        self.assertEqual((accumulator.count, accumulator.start, accumulator.end), (6, 100.0, 105.0))
+        self.assertEqual(accumulator.mean.dtype, np.float32)
+        np.testing.assert_allclose(accumulator.mean, self.frames.mean(axis=0), atol=1e-5)
+        np.testing.assert_allclose(accumulator.variance(), self.frames.var(axis=0, ddof=1), atol=1e-5)
+        np.testing.assert_allclose(accumulator.std(ddof=0), self.frames.std(axis=0), atol=1e-5)
+        np.testing.assert_array_equal(accumulator.minimum, self.frames.min(axis=0))
+        np.testing.assert_array_equal(accumulator.maximum, self.frames.max(axis=0))
+
+        with self.assertRaises(ValueError):
+            accumulator.add(np.zeros((7, 5)))
+
+    def test_constant_memory(self):
+        frames = np.random.default_rng(3).normal(30, 1, (4, 252, 336)).astype(np.float32)
+        accumulator = FrameAccumulator()
+        accumulator.add(frames[0])
+        tracemalloc.start()
+        try:
+            for frame in frames[1:]:
+                accumulator.add(frame)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # no frame-sized temporaries
+        self.assertLess(peak, frames[0].nbytes // 10)
+
+    def test_single_frame(self):
+        accumulator = FrameAccumulator()
+        path = self.root / "frame.csv"
+        write_celsius_csv(path, self.frames[0])
+        self.assertEqual(accumulator.read(path)['width'], '7')
+        np.testing.assert_allclose(accumulator.mean, self.frames[0], atol=1e-4)
+        np.testing.assert_array_equal(accumulator.std(), np.zeros((5, 7)))
+
+    def test_aggregate_conversion(self):
+        import xarray as xr
+        ts = 1700000000000000000
+        for i, frame in enumerate(self.frames):
+            write_celsius_csv(self.root / f"{ts + i * 10 ** 8}_left_7x5_14bit.thermal.celsius.csv", frame)
+            (self.root / f"{ts + i * 10 ** 8}_1280x960.jpg").write_bytes(b"jpeg")
+        store = FrameStore(self.root)
+        for path in self.root.iterdir():
+            store.add(path)
+
+        thermal = []
+        imager = MobotixImager("127.0.0.1", "admin", "meinsm", self.root, frames=6, aggregate=True)
+        imager.convert(store, on_thermal=lambda path, metadata, data: thermal.append(data.copy()))
+
+        # one NetCDF and one plot for the six frames, the visible frames are left alone
+        names = sorted(path.name for path in store.paths())
+        thermal_names = [f"{ts}_left_7x5_14bit.thermal.celsius.nc", f"{ts}_left_7x5_14bit.thermal.celsius_plot.jpg"]
+        self.assertEqual([name for name in names if 'thermal' in name], thermal_names)
+        self.assertEqual(len(names), 8)
+        self.assertEqual(sorted(path.name for path in self.root.iterdir()), names)
+        self.assertEqual(len(thermal), 1)
+        np.testing.assert_allclose(thermal[0], self.frames.mean(axis=0), atol=1e-4)
+
+        with xr.open_dataset(self.root / thermal_names[0], decode_times=False) as ds:
+            np.testing.assert_allclose(ds.temperature.values[0], self.frames.mean(axis=0), atol=1e-4)
+            np.testing.assert_allclose(ds.temperature_std.values[0], self.frames.std(axis=0, ddof=1), atol=1e-4)
+            np.testing.assert_allclose(ds.temperature_max.values[0], self.frames.max(axis=0), atol=1e-4)
+            self.assertEqual(ds.time.values[0], 1700000000.0)
+            self.assertEqual(ds.attrs['frame_count'], 6)
+            self.assertAlmostEqual(ds.attrs['time_span'], 0.5)
+            self.assertEqual(ds.attrs['width'], '7')
+
+    def test_aggregate_malformed_frame(self):
+        ts = 1700000000000000000
+        paths = [self.root / f"{ts + i * 10 ** 8}_left_7x5_14bit.thermal.celsius.csv" for i in range(3)]
+        for path, frame in zip(paths, self.frames):
+            write_celsius_csv(path, frame)
+        # the last frame is cut short
+        lines = paths[-1].read_text().splitlines(keepends=True)
+        paths[-1].write_text("".join(lines[:-2]))
+
+        imager = MobotixImager("127.0.0.1", "admin", "meinsm", self.root, frames=3, aggregate=True)
+        with self.assertRaises(ValueError):
+            imager.convert(self.root)
+        # nothing written, the CSVs are still there to upload
+        self.assertEqual(sorted(self.root.iterdir()), paths)
+
+        with self.assertRaises(ValueError):
+            MobotixImager("127.0.0.1", "admin", "meinsm", self.root, frames=3, thermal_format='compact', aggregate=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
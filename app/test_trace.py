@@ -0,0 +1,84 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from MobotixTrace import Tracer
+
+
+class RecordingPlugin:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, name, value, meta={}, timestamp=None):
+        self.published.append((name, value, meta))
+
+
+class TestTracer(unittest.TestCase):
+    def test_spans_and_summary(self):
+        tracer = Tracer()
+
+        @tracer.traced('convert.jpeg')
+        def convert(fail=False):
+            if fail:
+                raise ValueError("bad frame")
+            return 'done'
+
+        self.assertEqual(convert(), 'done')
+        with self.assertRaises(ValueError):
+            convert(fail=True)
+        for seconds in [0.01, 0.02, 0.03, 0.04, 1.0]:
+            tracer.record('upload', 0, seconds)
+        with tracer.span('settle', position='5'):
+            time.sleep(0.01)
+
+        stats = tracer.summary()
+        self.assertEqual(stats['convert.jpeg']['count'], 2)
+        self.assertAlmostEqual(stats['upload']['p50'], 0.03)
+        self.assertAlmostEqual(stats['upload']['max'], 1.0)
+        self.assertAlmostEqual(stats['upload']['total'], 1.1)
+        self.assertGreater(stats['upload']['p95'], 0.04)
+        self.assertGreaterEqual(stats['settle']['max'], 0.01)
+        # the summary starts over
+        self.assertEqual(tracer.summary(), {})
+
+    def test_publish(self):
+        tracer = Tracer()
+        threads = [threading.Thread(target=tracer.record, args=('capture', 0, 0.5)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        plugin = RecordingPlugin()
+        tracer.publish(plugin, meta={'loop_num': '1'})
+        published = {name: (value, meta) for name, value, meta in plugin.published}
+        self.assertEqual(sorted(published), ['trace.count', 'trace.max.sec', 'trace.p50.sec', 'trace.p95.sec'])
+        self.assertEqual(published['trace.count'], (4, {'loop_num': '1', 'span': 'capture'}))
+        self.assertEqual(published['trace.p95.sec'][0], 0.5)
+
+    def test_dump(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "trace.json"
+            for run in range(2):
+                tracer = Tracer()
+                tracer.dump_to(path)
+                with tracer.span('move', position=str(run)):
+                    pass
+                tracer.publish(RecordingPlugin())
+                tracer.record('upload', time.perf_counter(), 0.25)
+                tracer.close()
+
+            # an unterminated JSON array of trace events, as chrome://tracing reads it
+            text = path.read_text()
+            self.assertTrue(text.startswith('[\n'))
+            events = json.loads(text.rstrip().rstrip(',') + ']')
+            self.assertEqual([e['name'] for e in events], ['move', 'upload', 'move', 'upload'])
+            self.assertEqual(events[1]['dur'], 250000)
+            self.assertEqual(events[2]['args'], {'position': '1'})
+            self.assertEqual(events[0]['ph'], 'X')
+
+
+if __name__ == '__main__':
+    unittest.main()
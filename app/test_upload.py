@@ -0,0 +1,68 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from MobotixUpload import UploadQueue
+
+
+class FakePlugin:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.uploaded = []
+        self.published = {}
+        self.lock = threading.Lock()
+
+    def upload_file(self, path, meta={}, timestamp=None):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise OSError("link down")
+            self.uploaded.append((Path(path).name, Path(path).read_text(), meta, timestamp))
+        Path(path).unlink()
+
+    def publish(self, name, value, meta={}):
+        self.published[name] = value
+
+
+class TestUploadQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.spool = self.root / "data.uploads"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_file(self, name):
+        path = self.root / name
+        path.write_text(name)
+        return path
+
+    def test_uploads_with_retries(self):
+        plugin = FakePlugin(failures=2)
+        with UploadQueue(plugin, self.spool, workers=2, backoff=0) as uploads:
+            for i in range(5):
+                uploads.upload_file(self.make_file(f"{i}.jpg"), meta={'position': str(i)}, timestamp=i)
+            uploads.join()
+            uploads.publish_metrics()
+        self.assertEqual(sorted(u[0] for u in plugin.uploaded), [f"{i}.jpg" for i in range(5)])
+        self.assertIn(("3.jpg", "3.jpg", {'position': '3'}, 3), plugin.uploaded)
+        self.assertEqual(plugin.published['upload.files'], 5)
+        self.assertEqual(plugin.published['upload.queue.depth'], 0)
+        self.assertEqual(list(self.spool.iterdir()), [])
+
+    def test_spool_survives_restart(self):
+        with UploadQueue(FakePlugin(failures=10), self.spool, workers=0, retries=2, backoff=0) as uploads:
+            uploads.upload_file(self.make_file("a.nc"), meta={'loop_num': '1'}, timestamp=7)
+            self.assertEqual(uploads.depth(), 1)
+
+        plugin = FakePlugin()
+        with UploadQueue(plugin, self.spool, workers=1) as uploads:
+            uploads.join()
+        self.assertEqual(plugin.uploaded, [("a.nc", "a.nc", {'loop_num': '1'}, 7)])
+        self.assertEqual(list(self.spool.iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
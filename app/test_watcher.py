@@ -0,0 +1,93 @@
+import io
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from MobotixSimulator import FakeSampler
+from MobotixWatcher import DirectoryWatcher, frame_timestamp
+
+TS = 1700000000000000000
+
+
+def run_sampler(directory, frames, fps, atomic=True):
+    '''Runs the simulated sampler in a thread, returns the thread.'''
+    sampler = FakeSampler(directory, width=8, height=6, thermal_width=8, thermal_height=6, fps=fps, frames=frames,
+                          atomic=atomic)
+    thread = threading.Thread(target=sampler.run, kwargs={'out': io.StringIO()}, daemon=True)
+    thread.start()
+    return thread
+
+
+def collect(watcher, count, timeout=5):
+    '''Polls until `count` files are reported, with their size when reported.'''
+    reported = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and len(reported) < count:
+        reported.extend((path, path.stat().st_size) for path in watcher.poll(timeout=0.1))
+    return reported
+
+
+class TestDirectoryWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmp.name) / "data"
+        self.directory.mkdir()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_backend(self, backend, atomic=True, fps=50, interval=0.02):
+        (self.directory / "old_8x6.rgb").write_bytes(b"old")
+        with DirectoryWatcher(self.directory, backend=backend, interval=interval, atomic=atomic) as watcher:
+            sampler = run_sampler(self.directory, frames=10, fps=fps, atomic=atomic)
+            reported = collect(watcher, 10 * 2)
+            sampler.join()
+            reported.extend((path, path.stat().st_size) for path in watcher.poll(timeout=0.1))
+        # every file once, complete, without the one that was there before
+        written = [path for path in self.directory.iterdir() if path.name != "old_8x6.rgb"]
+        self.assertEqual(len(written), 10 * 2)
+        self.assertEqual(sorted(path for path, size in reported), sorted(written))
+        for path, size in reported:
+            self.assertEqual(size, path.stat().st_size)
+
+    def test_inotify(self):
+        try:
+            DirectoryWatcher(self.directory, backend='inotify').close()
+        except OSError:
+            self.skipTest("inotify not available")
+        self.check_backend('inotify')
+
+    def test_poll(self):
+        self.check_backend('poll')
+
+    def test_poll_waits_for_stable_size(self):
+        # the sampler pauses 25 ms halfway through each file, less than a scan interval
+        self.check_backend('poll', atomic=False, fps=20, interval=0.05)
+
+    def test_poll_stable_for_interval(self):
+        with DirectoryWatcher(self.directory, backend='poll', interval=0.05, atomic=False) as watcher:
+            path = self.directory / f"{TS}_1280x960.rgb"
+            path.write_bytes(b"fra")
+            # two scans in a row are not enough for a file to be complete
+            self.assertEqual(watcher.poll(), [])
+            self.assertEqual(watcher.poll(), [])
+            with open(path, "ab") as f:
+                f.write(b"me")
+            time.sleep(0.03)
+            self.assertEqual(watcher.poll(), [])
+            time.sleep(0.06)
+            self.assertEqual(watcher.poll(), [path])
+
+    def test_frame_timestamp(self):
+        self.assertEqual(frame_timestamp(f"/tmp/{TS}_1280x960.rgb"), TS)
+        self.assertIsNone(frame_timestamp("/tmp/left_336x252_14bit.thermal.celsius_plot.jpg"))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            DirectoryWatcher(self.directory, backend='fanotify')
+
+
+if __name__ == '__main__':
+    unittest.main()
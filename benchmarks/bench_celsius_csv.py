@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Compares the per-row Python celsius CSV parser with the vectorized parser in
+MobotixThermal on synthetic frames of several sensor resolutions.
+
+    python3 benchmarks/bench_celsius_csv.py --repeat 20
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from MobotixThermal import read_celsius_csv, write_celsius_csv
+
+RESOLUTIONS = [(252, 336), (480, 640), (768, 1024)]
+
+
+def read_celsius_csv_readlines(file_path):
+    '''The original readlines() / map(float) implementation.'''
+    with file_path.open('r') as f:
+        lines = f.readlines()
+
+    metadata = {}
+    for line in lines[:7]:
+        key, value = line.strip().split(';')
+        metadata[key] = value
+
+    temperature_data = [list(map(float, line.split(';'))) for line in lines[8:]]
+    return metadata, np.array(temperature_data)
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    print(f"{'resolution':>12} {'readlines':>12} {'vectorized':>12} {'chunked':>12} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for height, width in RESOLUTIONS:
+            path = Path(tmp) / f"1700000000000000000_left_{width}x{height}_14bit.thermal.celsius.csv"
+            write_celsius_csv(path, rng.normal(20, 5, (height, width)).astype(np.float32))
+
+            _, expected = read_celsius_csv_readlines(path)
+            _, actual = read_celsius_csv(path)
+            np.testing.assert_allclose(actual, expected, rtol=1e-6)
+
+            legacy = best_of(lambda: read_celsius_csv_readlines(path), args.repeat)
+            fast = best_of(lambda: read_celsius_csv(path), args.repeat)
+            chunked = best_of(lambda: read_celsius_csv(path, chunk_rows=args.chunk_rows), args.repeat)
+            print(f"{width}x{height:<6} {legacy * 1e3:10.2f}ms {fast * 1e3:10.2f}ms "
+                  f"{chunked * 1e3:10.2f}ms {legacy / fast:7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="Timing repetitions, best is reported")
+    parser.add_argument("--chunk-rows", type=int, default=64, help="Rows per chunk in chunked mode")
+    main(parser.parse_args())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Counts the filesystem operations and bytes copied per captured frame when
+handing the sampler files from the workdir to the archive and the uploader:
+the former glob-and-rename handoff (stage_files, glob, rename, shutil.copy
+into the archive) against the FrameStore index with hardlinked archive copies.
+Conversion itself is left out, it is the same for both.
+
+    python3 benchmarks/bench_frame_store.py --frames 50
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from MobotixFrameStore import FrameStore
+
+# files the sampler writes per frame, with typical sizes
+FRAME_FILES = {
+    "1280x960.rgb": 1280 * 960 * 4,
+    "left_336x252_14bit.thermal.raw": 336 * 252 * 2,
+    "left_336x252_14bit.thermal.uint.csv": 500_000,
+    "left_336x252_14bit.thermal.celsius.csv": 760_000,
+}
+
+COUNTED = ['listdir', 'scandir', 'stat', 'lstat', 'rename', 'link', 'mkdir', 'rmdir', 'unlink']
+
+
+class FsCounter:
+    '''Counts calls to the `os` functions in COUNTED and the bytes copied by shutil.'''
+    def __init__(self):
+        self.calls = Counter()
+        self.copied = 0
+        self._saved = {}
+
+    def __enter__(self):
+        for name in COUNTED:
+            original = getattr(os, name)
+            self._saved[name] = original
+
+            def counted(*args, _name=name, _original=original, **kwargs):
+                self.calls[_name] += 1
+                return _original(*args, **kwargs)
+            setattr(os, name, counted)
+
+        self._saved['copyfile'] = shutil.copyfile
+
+        def copyfile(src, dst, *args, _original=shutil.copyfile, **kwargs):
+            self.copied += os.path.getsize(src)
+            return _original(src, dst, *args, **kwargs)
+        shutil.copyfile = copyfile
+        return self
+
+    def __exit__(self, *exc):
+        shutil.copyfile = self._saved.pop('copyfile')
+        for name, original in self._saved.items():
+            setattr(os, name, original)
+
+
+def write_frame(workdir, timestamp):
+    for name, size in FRAME_FILES.items():
+        with open(workdir / f"{timestamp}_{name}", "wb") as f:
+            f.truncate(size)
+
+
+def stage_files(workdir, staging_dir):
+    '''The former handoff: moves the files captured in `workdir` into `staging_dir`.'''
+    staging_dir = Path(staging_dir)
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    for path in Path(workdir).iterdir():
+        if path.is_file():
+            os.rename(path, staging_dir / path.name)
+    return staging_dir
+
+
+def handoff_glob(workdir, staging, archive, uploads):
+    staged = stage_files(workdir, staging)
+    for tspath in staged.glob("*"):  # convert
+        pass
+    for tspath in staged.glob("*"):
+        timestamp, name = tspath.name.split("_", 1)
+        new_name = tspath.with_name(name)
+        os.rename(tspath, new_name)
+        shutil.copy(new_name, archive / f"{timestamp}_{name}")
+        os.rename(new_name, uploads / f"{timestamp}_{name}")
+    staged.rmdir()
+
+
+def handoff_store(workdir, staging, archive, uploads):
+    store = FrameStore.stage(workdir, staging)
+    for tspath in store.paths():  # convert
+        pass
+    for tspath in store.paths():
+        timestamp, name = tspath.name.split("_", 1)
+        new_name = store.rename(tspath, tspath.with_name(name))
+        store.link(new_name, archive, f"{timestamp}_{name}")
+        os.rename(new_name, uploads / f"{timestamp}_{name}")
+    store.close()
+
+
+def run(handoff, frames):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        workdir, archive, uploads = root / "data", root / "archive", root / "uploads"
+        for d in (workdir, archive, uploads):
+            d.mkdir()
+        counter = FsCounter()
+        elapsed = 0.0
+        for i in range(frames):
+            write_frame(workdir, 1700000000000000000 + i)
+            start = time.perf_counter()
+            with counter:
+                handoff(workdir, root / "data.pending" / str(i), archive, uploads)
+            elapsed += time.perf_counter() - start
+    return counter, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20, help="frames handed off")
+    args = parser.parse_args()
+
+    print(f"{'handoff':<8} " + " ".join(f"{name:>7}" for name in COUNTED) + f" {'MB copied':>10} {'ms':>7}   (per frame)")
+    for label, handoff in [("glob", handoff_glob), ("store", handoff_store)]:
+        counter, elapsed = run(handoff, args.frames)
+        ops = " ".join(f"{counter.calls[name] / args.frames:>7.1f}" for name in COUNTED)
+        print(f"{label:<8} {ops} {counter.copied / args.frames / 1e6:>10.2f} {elapsed / args.frames * 1000:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
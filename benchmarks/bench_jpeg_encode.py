@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Compares encoding raw BGRA frames to JPEG with ffmpeg and with the in-process
+encoders in MobotixImaging at typical Mobotix visible resolutions.
+
+    python3 benchmarks/bench_jpeg_encode.py --repeat 5
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+import MobotixImaging
+from MobotixImaging import bgra_to_jpeg
+
+RESOLUTIONS = [(1280, 960), (1920, 1080), (3072, 2048)]
+
+
+def available_backends():
+    backends = []
+    if MobotixImaging.cv2 is not None:
+        backends.append('opencv')
+    if MobotixImaging.Image is not None:
+        backends.append('pillow')
+    if shutil.which('ffmpeg'):
+        backends.append('ffmpeg')
+    return backends
+
+
+def synthetic_frame(width, height):
+    # smooth gradients with some noise compress like a real scene, unlike pure noise
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.empty((height, width, 4), dtype=np.uint8)
+    frame[..., 0] = (x * 255 // width).astype(np.uint8)
+    frame[..., 1] = (y * 255 // height).astype(np.uint8)
+    frame[..., 2] = ((x + y) % 256).astype(np.uint8)
+    frame[..., 3] = 255
+    noise = np.random.default_rng(0).integers(0, 8, frame.shape, dtype=np.uint8)
+    return frame + noise
+
+
+def main(args):
+    backends = args.backends or available_backends()
+    print(f"{'resolution':>12} " + " ".join(f"{b:>10}" for b in backends))
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height in RESOLUTIONS:
+            fname_rgb = Path(tmp) / f"1700000000000000000_{width}x{height}.rgb"
+            synthetic_frame(width, height).tofile(fname_rgb)
+            row = []
+            for backend in backends:
+                fname_jpg = Path(tmp) / f"{backend}.jpg"
+                best = float('inf')
+                for _ in range(args.repeat):
+                    fname_jpg.unlink(missing_ok=True)
+                    start = time.perf_counter()
+                    bgra_to_jpeg(fname_rgb, fname_jpg, width, height, quality=args.quality,
+                                 scale=args.scale, backend=backend)
+                    best = min(best, time.perf_counter() - start)
+                row.append(f"{best * 1e3:8.1f}ms")
+            print(f"{width}x{height:<6} " + " ".join(f"{r:>10}" for r in row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions, best is reported")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality")
+    parser.add_argument("--scale", type=float, default=1, help="Downscale factor")
+    parser.add_argument("--backends", nargs="+", choices=['opencv', 'pillow', 'ffmpeg'],
+                        help="Backends to compare, defaults to all installed")
+    main(parser.parse_args())
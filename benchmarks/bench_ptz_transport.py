@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Measures MobotixPT command latency and throughput over the curl and the
+keep-alive HTTP transports against the local stub camera.
+
+    python3 benchmarks/bench_ptz_transport.py --commands 200 --latency 0.005
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from MobotixControl import TRANSPORTS, MobotixPT
+from MobotixSimulator import StubCameraServer
+
+
+def run(transport, address, commands):
+    mobot_pt = MobotixPT("admin", "meinsm", address, transport=transport)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(commands):
+        t0 = time.perf_counter()
+        status = mobot_pt.move_to_preset(i % 32 + 1)
+        latencies.append(time.perf_counter() - t0)
+        assert status.strip() == "OK", status
+    elapsed = time.perf_counter() - start
+    mobot_pt.close()
+    return latencies, elapsed
+
+
+def main(args):
+    with StubCameraServer(latency=args.latency) as camera:
+        print(f"{'transport':>10} {'p50':>9} {'p95':>9} {'max':>9} {'cmd/s':>8}")
+        for name in args.transports:
+            latencies, elapsed = run(name, camera.address, args.commands)
+            p95 = statistics.quantiles(latencies, n=20)[-1]
+            print(f"{name:>10} {statistics.median(latencies) * 1e3:7.2f}ms {p95 * 1e3:7.2f}ms "
+                  f"{max(latencies) * 1e3:7.2f}ms {args.commands / elapsed:8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=100, help="Commands sent per transport")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated camera latency in seconds")
+    parser.add_argument("--transports", nargs="+", default=list(TRANSPORTS), choices=list(TRANSPORTS))
+    main(parser.parse_args())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Runs complete scans against the simulated camera (MobotixSimulator) and
+reports the end-to-end seconds per preset and per loop of each scan mode:
+PT moves with the travel times of the real head, settle detection on the
+simulated snapshots, thermal-raw captures from the fake sampler, conversion,
+NetCDF and uploads into a temporary directory. A preset lasts from its move
+command to the next one; the last preset of a loop ends with the loop.
+With --cameras N the preset and direction scans run on N simulated cameras
+at once (--cameras), and the times are per camera. The files uploaded by
+each mode and their size are counted; --panorama uploads one panorama per
+custom sweep instead of its shots, --sweep captures each custom loop in one
+continuous move instead of stopping for every shot, --aggregate folds the
+--frames of each capture into one NetCDF file.
+
+    python3 benchmarks/bench_scan_e2e.py --modes preset,custom --loops 2
+    python3 benchmarks/bench_scan_e2e.py --time-scale 0.2 --session
+    python3 benchmarks/bench_scan_e2e.py --modes preset --cameras 3 --workers 2
+    python3 benchmarks/bench_scan_e2e.py --modes custom --shots 6 --panorama
+    python3 benchmarks/bench_scan_e2e.py --modes custom --shots 15 --sweep
+    python3 benchmarks/bench_scan_e2e.py --modes preset --frames 10 --aggregate
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+import MobotixScan
+from waggle.plugin import Plugin
+from MobotixArchive import DEFAULT_ARCHIVE_COMPACT, DEFAULT_ARCHIVE_MAX_AGE, DEFAULT_ARCHIVE_MAX_BYTES
+from MobotixControl import MobotixPT
+from MobotixGate import DEFAULT_GATE_HASH, DEFAULT_GATE_KEYFRAME, DEFAULT_GATE_THERMAL
+from MobotixImaging import DEFAULT_JPEG_QUALITY
+from MobotixMulti import camera_args, scan_cameras
+from MobotixPanorama import DEFAULT_PANORAMA_FOV
+from MobotixScan import scan_custom, scan_presets
+from MobotixSettle import DEFAULT_SETTLE_THRESHOLD
+from MobotixSimulator import DEFAULT_SIM_FPS, SimulatedPT, StubCameraServer, write_sampler
+from MobotixStats import DEFAULT_HOT_THRESHOLDS
+from MobotixSweep import DEFAULT_SWEEP_INTERVAL
+from MobotixUpload import DEFAULT_UPLOAD_WORKERS
+from app import resolve_directions
+
+
+class Timeline:
+    '''Records the preset moves and loop ends of a scan, by camera IP.'''
+    def __init__(self):
+        self.events = []
+        self._saved = {}
+
+    def __enter__(self):
+        move_to_preset, publish = MobotixPT.move_to_preset, Plugin.publish
+        self._saved = {'move_to_preset': move_to_preset, 'publish': publish}
+
+        def moved(pt, pt_id, *args, **kwargs):
+            self.events.append((time.monotonic(), 'move', pt.ip))
+            return move_to_preset(pt, pt_id, *args, **kwargs)
+
+        def published(plugin, name, value, *args, **kwargs):
+            if name == 'scan.duration.sec':
+                # the cameras of a multi-camera scan are named after their IP
+                self.events.append((time.monotonic(), 'end', kwargs.get('meta', {}).get('camera')))
+            return publish(plugin, name, value, *args, **kwargs)
+
+        MobotixPT.move_to_preset, Plugin.publish = moved, published
+        return self
+
+    def __exit__(self, *exc):
+        MobotixPT.move_to_preset = self._saved['move_to_preset']
+        Plugin.publish = self._saved['publish']
+
+    def cameras(self):
+        '''Events of each camera, loop ends without a camera going to all of them.'''
+        ips = {ip for t, kind, ip in self.events if kind == 'move'}
+        return [[(t, kind) for t, kind, ip in self.events if ip in (camera, None)] for camera in ips]
+
+    def presets(self):
+        '''Seconds from each preset move to the next move or loop end of the camera.'''
+        seconds = []
+        for events in self.cameras():
+            for (t, kind), (t_next, _) in zip(events, events[1:]):
+                if kind == 'move':
+                    seconds.append(t_next - t)
+        return seconds
+
+    def loops(self, start):
+        '''Seconds of each loop, from `start` and then from the previous loop end of the camera.'''
+        seconds = []
+        for events in self.cameras() or [self.events]:
+            ends = [e[0] for e in events if e[1] == 'end']
+            seconds.extend(b - a for a, b in zip([start] + ends, ends))
+        return seconds
+
+
+def scan_args(opts, mode, camera, sampler, workdir):
+    # the app.py defaults, with the positions and sizes of the benchmark
+    return argparse.Namespace(
+        ip=camera.address, user='admin', password='meinsm', workdir=workdir, frames=opts.frames, mode=mode,
+        preset=opts.directions if mode == 'direction' else opts.preset, south='1',
+        loops=opts.loops, loopsleep=0, num_shots=opts.shots, move_direction='right', move_speed=opts.speed,
+        move_duration=opts.duration, daemon=False, schedule='300', scan_timeout=MobotixScan.DEFAULT_SCAN_TIMEOUT,
+        pt_transport='http', capture_session=opts.session, sampler=str(sampler), trace=opts.trace, workers=opts.workers,
+        upload_workers=DEFAULT_UPLOAD_WORKERS, jpeg_backend='auto', jpeg_quality=DEFAULT_JPEG_QUALITY,
+        jpeg_scale=1, preview='fast', preview_colorbar=False, settle='auto',
+        settle_threshold=DEFAULT_SETTLE_THRESHOLD, order=opts.order, netcdf=opts.netcdf, netcdf_packing='int16',
+        thermal_format=opts.thermal_format, gate=opts.gate, gate_thermal=DEFAULT_GATE_THERMAL,
+        gate_hash=DEFAULT_GATE_HASH, gate_keyframe=DEFAULT_GATE_KEYFRAME, thermal_stats=opts.thermal_stats,
+        hot_thresholds=DEFAULT_HOT_THRESHOLDS, roi='', cameras='',
+        archive_max_bytes=DEFAULT_ARCHIVE_MAX_BYTES, archive_max_age=DEFAULT_ARCHIVE_MAX_AGE,
+        archive_compact=DEFAULT_ARCHIVE_COMPACT, panorama=opts.panorama, panorama_fov=DEFAULT_PANORAMA_FOV,
+        sweep=opts.sweep, sweep_interval=opts.sweep_interval, calibrate=False, aggregate=opts.aggregate)
+
+
+def run_cameras(opts, mode, root, sampler):
+    with ExitStack() as stack:
+        cameras = [stack.enter_context(StubCameraServer(latency=opts.latency, pt=SimulatedPT(time_scale=opts.time_scale)))
+                   for _ in range(opts.cameras)]
+        timeline = stack.enter_context(Timeline())
+        args = scan_args(opts, mode, cameras[0], sampler, root / mode / "data")
+        configs = camera_args(args, [{'name': camera.address, 'ip': camera.address} for camera in cameras])
+        start = time.monotonic()
+        if mode == 'direction':
+            for config in configs:
+                resolve_directions(config)
+        scan_cameras(args, configs)
+        return timeline.presets(), timeline.loops(start)
+
+
+def run_mode(opts, mode, root):
+    sampler = write_sampler(root / "thermal-raw", width=opts.width, height=opts.height, fps=opts.fps)
+    if opts.cameras > 1 and mode != 'custom':
+        return run_cameras(opts, mode, root, sampler)
+    pt = SimulatedPT(time_scale=opts.time_scale)
+    with StubCameraServer(latency=opts.latency, pt=pt) as camera, Timeline() as timeline:
+        args = scan_args(opts, mode, camera, sampler, root / mode / "data")
+        start = time.monotonic()
+        if mode == 'custom':
+            # custom scans visit each preset once, as a single loop
+            args.num_shots = ",".join([opts.shots] * len(args.preset.split(",")))
+            args.move_speed = ",".join([opts.speed] * len(args.preset.split(",")))
+            args.move_duration = ",".join([opts.duration] * len(args.preset.split(",")))
+            scan_custom(args)
+            return timeline.presets(), [time.monotonic() - start]
+        if mode == 'direction':
+            resolve_directions(args)
+        scan_presets(args)
+        return timeline.presets(), timeline.loops(start)
+
+
+def uploaded(directory):
+    '''Files uploaded into the pywaggle upload `directory` so far, and their bytes.'''
+    sizes = [path.stat().st_size for path in Path(directory).glob("*/data")]
+    return len(sizes), sum(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="preset,direction,custom", help="Comma-separated scan modes")
+    parser.add_argument("--preset", default="1,5,9,13", help="Presets of the preset and custom scans")
+    parser.add_argument("--directions", default="SS,WH,NB,EG", help="Directions of the direction scan")
+    parser.add_argument("--loops", type=int, default=1, help="Loops of the preset and direction scans")
+    parser.add_argument("--frames", type=int, default=1, help="Frames per capture")
+    parser.add_argument("--shots", default="3", help="Shots per preset of the custom scan")
+    parser.add_argument("--speed", default="3", help="Move speed (1-5) between custom shots")
+    parser.add_argument("--duration", default="500", help="Move duration (ms) between custom shots")
+    parser.add_argument("--order", default="given", choices=["given", "optimal"])
+    parser.add_argument("--netcdf", default="frame", choices=["frame", "loop"])
+    parser.add_argument("--thermalformat", dest="thermal_format", default="netcdf", choices=["netcdf", "compact"])
+    parser.add_argument("--aggregate", action="store_true", help="Upload one NetCDF of the --frames of each capture")
+    parser.add_argument("--gate", action="store_true", help="Skip the upload of unchanged positions")
+    parser.add_argument("--thermalstats", dest="thermal_stats", action="store_true",
+                        help="Publish the statistics of every thermal frame")
+    parser.add_argument("--panorama", action="store_true", help="Upload one panorama per custom sweep")
+    parser.add_argument("--sweep", action="store_true", help="Capture each custom loop in one continuous move")
+    parser.add_argument("--sweepinterval", dest="sweep_interval", type=float, default=DEFAULT_SWEEP_INTERVAL,
+                        help="Seconds between the frames kept from a continuous sweep")
+    parser.add_argument("--session", action="store_true", help="Keep one sampler running per scan")
+    parser.add_argument("--workers", type=int, default=2, help="Pipeline workers")
+    parser.add_argument("--cameras", type=int, default=1, help="Simulated cameras of the preset and direction scans")
+    parser.add_argument("--width", type=int, default=1280, help="Visible frame width")
+    parser.add_argument("--height", type=int, default=960, help="Visible frame height")
+    parser.add_argument("--fps", type=float, default=DEFAULT_SIM_FPS, help="Sampler frame rate")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the camera takes to answer a command")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplies the simulated travel times")
+    parser.add_argument("--trace", default="", help="Write the timing spans of the scans to this file")
+    parser.add_argument("--debug", action="store_true")
+    opts = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if opts.debug else logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        # keep the uploads and the custom-scan archive out of the system directories
+        os.environ["WAGGLE_PLUGIN_UPLOAD_PATH"] = str(root / "uploads")
+        MobotixScan.ARCHIVE_DIR = str(root / "archive")
+
+        print(f"{'mode':<10} {'presets':>7} {'s/preset':>9} {'max':>7} {'loops':>5} {'s/loop':>8} "
+              f"{'uploads':>7} {'MB':>7}")
+        for mode in opts.modes.split(","):
+            before = uploaded(root / "uploads")
+            presets, loops = run_mode(opts, mode, root)
+            files, size = (a - b for a, b in zip(uploaded(root / "uploads"), before))
+            print(f"{mode:<10} {len(presets):>7} {statistics.mean(presets):>9.2f} {max(presets):>7.2f} "
+                  f"{len(loops):>5} {statistics.mean(loops):>8.2f} {files:>7} {size / 1e6:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
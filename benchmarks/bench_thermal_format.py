@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Compares the thermal payload and the conversion memory of a scan loop with
+`--thermalformat netcdf` (celsius and uint CSVs uploaded, plus a NetCDF file
+per frame) and `--thermalformat compact` (int16/uint16 binary frames). Plots
+are left out of the payload, they are the same for both. Memory is the peak
+traced by tracemalloc while converting one frame, Python and numpy
+allocations only.
+
+    python3 benchmarks/bench_thermal_format.py --positions 32
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from MobotixControl import MobotixImager
+from MobotixFrameStore import FrameStore
+from MobotixThermal import read_thermal_frame, thermal_values, write_celsius_csv
+
+TS = 1700000000000000000
+
+
+def write_frame(directory, timestamp, width, height, rng):
+    y, x = np.mgrid[0:height, 0:width]
+    celsius = (15 + 10 * y / height + rng.normal(0, 0.5, (height, width))).round(2).astype(np.float32)
+    base = directory / f"{timestamp}_left_{width}x{height}_14bit.thermal"
+    write_celsius_csv(f"{base}.celsius.csv", celsius)
+    # the uint CSV has the same layout, with sensor counts
+    write_celsius_csv(f"{base}.uint.csv", (celsius * 100 + 2000).astype(np.uint16))
+    return celsius
+
+
+def run(thermal_format, positions, width, height):
+    rng = np.random.default_rng(0)
+    payload = peak = 0
+    elapsed = 0.0
+    error = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        imager = MobotixImager("127.0.0.1", "admin", "meinsm", tmp, frames=1, thermal_format=thermal_format)
+        for position in range(positions):
+            directory = Path(tmp) / str(position)
+            directory.mkdir()
+            celsius = write_frame(directory, TS + position, width, height, rng)
+            store = FrameStore(directory, position)
+            for path in directory.iterdir():
+                store.add(path)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            imager.convert(store)
+            elapsed += time.perf_counter() - start
+            if position > 0:
+                # the first frame also imports xarray and netCDF4
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            thermal = [p for p in store.paths() if not p.name.endswith("_plot.jpg")]
+            payload += sum(p.stat().st_size for p in thermal)
+            for path in thermal:
+                if path.name.endswith(".celsius.tfr"):
+                    error = max(error, float(np.abs(thermal_values(*read_thermal_frame(path)) - celsius).max()))
+    return payload, peak, elapsed, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--positions", type=int, default=32, help="frames in the loop")
+    parser.add_argument("--width", type=int, default=336)
+    parser.add_argument("--height", type=int, default=252)
+    args = parser.parse_args()
+
+    print(f"{'format':<8} {'payload MB':>10} {'kB/frame':>9} {'peak MB':>8} {'ms/frame':>9} {'max err':>8}")
+    for thermal_format in ["netcdf", "compact"]:
+        payload, peak, elapsed, error = run(thermal_format, args.positions, args.width, args.height)
+        print(f"{thermal_format:<8} {payload / 1e6:>10.2f} {payload / args.positions / 1e3:>9.0f} "
+              f"{peak / 1e6:>8.2f} {elapsed / args.positions * 1000:>9.1f} {error:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
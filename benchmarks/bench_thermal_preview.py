@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Times the thermal previews of MobotixImager.plot_data over a 32-preset loop
+of 336x252 frames, with the fast turbo renderer and with the matplotlib
+'publication' plot. Each mode runs in its own process so the peak RSS
+(import included) is its own.
+
+    python3 benchmarks/bench_thermal_preview.py --loops 2
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+PRESETS = 32
+MODES = ['fast', 'publication']
+
+
+def synthetic_frames(count, width=336, height=252):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    for i in range(count):
+        scene = 15 + 10 * np.sin(x / 40 + i) + 5 * np.cos(y / 30) + rng.normal(0, 0.3, (height, width))
+        yield scene.astype(np.float32)
+
+
+def run_mode(mode, loops, colorbar):
+    start = time.perf_counter()
+    from MobotixControl import MobotixImager
+    import_sec = time.perf_counter() - start
+
+    metadata = {'width': '336', 'height': '252'}
+    times = []
+    with tempfile.TemporaryDirectory() as tmp:
+        imager = MobotixImager(ip='', user='', passwd='', workdir=tmp, frames=1,
+                               preview=mode, preview_colorbar=colorbar)
+        for i, frame in enumerate(synthetic_frames(PRESETS * loops)):
+            ds = imager.convert_to_dataset(metadata, frame, 1700000000 + i)
+            start = time.perf_counter()
+            imager.plot_data(ds, Path(tmp) / f"{i}_336x252.thermal.celsius.csv")
+            times.append(time.perf_counter() - start)
+
+    times = np.array(times) * 1000
+    return {
+        'mode': mode,
+        'frames': len(times),
+        'import_ms': import_sec * 1000,
+        'mean_ms': float(times.mean()),
+        'p95_ms': float(np.percentile(times, 95)),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loops", type=int, default=1, help="32-preset loops per mode")
+    parser.add_argument("--colorbar", action="store_true", help="add the colour strip to fast previews")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.loops, args.colorbar)))
+        return
+
+    print(f"{'mode':<12} {'frames':>6} {'import ms':>10} {'mean ms':>8} {'p95 ms':>8} {'peak RSS MB':>12}")
+    for mode in MODES:
+        cmd = [sys.executable, __file__, "--mode", mode, "--loops", str(args.loops)]
+        if args.colorbar:
+            cmd.append("--colorbar")
+        result = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout)
+        print(f"{result['mode']:<12} {result['frames']:>6} {result['import_ms']:>10.0f} {result['mean_ms']:>8.2f}"
+              f" {result['p95_ms']:>8.2f} {result['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Reports the estimated PT travel time of a preset scan loop for the given
+preset order and for the order chosen by `--order optimal`.
+
+    python3 benchmarks/sim_preset_order.py --preset "1,5,9,13" --loops 3
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from MobotixPresets import optimize_order, tour_time
+
+
+def default_preset():
+    # same default as app.py
+    return ', '.join(str(i) for j in range(4) for i in range(j + 1, 33, 4))
+
+
+def main(args):
+    presets = [int(p) for p in args.preset.split(',')]
+
+    given = optimized = 0.0
+    last_given = last_optimized = None
+    for loop in range(1, args.loops + 1):
+        order = optimize_order(presets, start=last_optimized)
+        given_loop = tour_time(presets, last_given)
+        optimized_loop = tour_time(order, last_optimized)
+        print(f"loop {loop}: given {given_loop:6.2f} s, optimal {optimized_loop:6.2f} s  {order}")
+        given += given_loop
+        optimized += optimized_loop
+        last_given, last_optimized = presets[-1], order[-1]
+
+    print(f"total:  given {given:6.2f} s, optimal {optimized:6.2f} s, "
+          f"saved {given - optimized:.2f} s ({100 * (1 - optimized / given):.0f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", type=str, default=default_preset(), help="Comma-separated preset IDs")
+    parser.add_argument("--loops", type=int, default=3, help="Scan loops to simulate")
+    main(parser.parse_args())